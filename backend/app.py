@@ -2,17 +2,48 @@
 
 from shapely.geometry import shape
 from shapely.wkt import dumps as wkt_dumps
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from geoalchemy2 import Geometry, Geography, functions
 from flask_cors import CORS
+from services.hydraulic_calculator import (get_manning_n, calculate_network_hydraulics, calculate_manhole_levels,
+                                          calculate_rational_peak_flows)
+from services.job_queue import JobQueue
+from services.metrics import MetricsRegistry, RequestTimings, PhaseTimer, current_timings
+from services.result_cache import ResultCache
+from services.scenarios import stack_catchment_parameters, summarize_scenario
+from services.timeseries import (alternating_block_hyetograph, triangular_unit_hydrograph,
+                                 catchment_runoff_hydrographs, route_hydrographs, peak_and_time)
+from services.network_graph import NetworkGraph
+from services.gis_processor import (geometries_from_elements, measure_areas, measure_lengths,
+                                    transform_geometries_to_utm, utm_epsg_for_extent)
+from services.gis_io import (LAYER_GEOMETRY_TYPES, EXPORT_DRIVERS, list_layers, layer_fields, read_feature_chunks,
+                             explode_geometries, fiona_schema, shapefile_field_names, write_features, zip_shapefile)
+from services.topology import snap_pipe_endpoints, assign_catchment_outlets
+from services.serializers import serialize_feature, serialize_features, stream_feature_collection, stream_ndjson
+import csv
+import hashlib
+import io
 import json
 import os
+import shutil
+import socket
+import tempfile
+import threading
 import math
+import time
 import traceback
+import uuid
+from datetime import datetime, timedelta
+from collections import namedtuple
+from types import SimpleNamespace
+import numpy as np
+import shapely
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Network-Revision'])
 
 # 資料庫配置
 # 請替換 'your_username' 和 'your_password' 為您的 PostgreSQL 實際用戶名和密碼
@@ -25,7 +56,16 @@ db = SQLAlchemy(app)
 # 資料庫模型定義
 # ==============================================================================
 
-class Manhole(db.Model):
+class FeatureMixin:
+    # 各圖層要輸出的屬性欄位 (geom 由序列化層統一轉為 GeoJSON)
+    serialize_fields = ()
+    # 最後一次新增、修改或寫回模擬結果時的管網版本 (供 /api/changes 增量同步)
+    revision = db.Column(db.BigInteger, index=True)
+
+    def to_dict(self):
+        return serialize_feature(self, self.serialize_fields)
+
+class Manhole(FeatureMixin, db.Model):
     __tablename__ = 'manholes'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -36,86 +76,478 @@ class Manhole(db.Model):
     overflow_elevation = db.Column(db.Float, default=-0.5)
     inflow = db.Column(db.Float, default=0.0)
     downstream_capacity = db.Column(db.Float, default=0.0)
+    calculated_inflow = db.Column(db.Float) # 本地入流 + 集水區逕流 + 上游累加流量
     calculated_water_level = db.Column(db.Float)
     is_overflow = db.Column(db.Boolean)
 
-    def to_dict(self):
-        geojson_str = db.session.scalar(db.func.ST_AsGeoJSON(self.geom))
-        geojson_dict = json.loads(geojson_str) if geojson_str else None
-        return {
-            'id': self.id,
-            'name': self.name,
-            'geom': geojson_dict,
-            'top_elevation': self.top_elevation,
-            'bottom_elevation': self.bottom_elevation,
-            'design_flow_limit': self.design_flow_limit,
-            'overflow_elevation': self.overflow_elevation,
-            'inflow': self.inflow,
-            'downstream_capacity': self.downstream_capacity,
-            'calculated_water_level': self.calculated_water_level,
-            'is_overflow': self.is_overflow
-        }
+    # 可由使用者輸入的屬性欄位 (新增、匯入)
+    editable_fields = ('name', 'top_elevation', 'bottom_elevation', 'design_flow_limit', 'overflow_elevation',
+                       'inflow', 'downstream_capacity')
+    serialize_fields = ('id', 'name', 'top_elevation', 'bottom_elevation', 'design_flow_limit',
+                        'overflow_elevation', 'inflow', 'downstream_capacity',
+                        'calculated_inflow', 'calculated_water_level', 'is_overflow', 'revision')
 
-class Pipeline(db.Model):
+class Pipeline(FeatureMixin, db.Model):
     __tablename__ = 'pipelines'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     geom = db.Column(Geometry('LINESTRING', srid=4326))
+    from_manhole_id = db.Column(db.Integer, db.ForeignKey('manholes.id', ondelete='SET NULL'))
+    to_manhole_id = db.Column(db.Integer, db.ForeignKey('manholes.id', ondelete='SET NULL'))
     diameter = db.Column(db.Float, default=0.5)
     slope = db.Column(db.Float, default=0.001)
     material = db.Column(db.String(50), default='混凝土')
     design_flow = db.Column(db.Float, default=0.1)
     calculated_flow = db.Column(db.Float)
+    calculated_velocity = db.Column(db.Float)
+    calculated_depth = db.Column(db.Float)
     full_capacity_ratio = db.Column(db.Float)
     calculated_length_m = db.Column(db.Float) # 新增長度欄位
 
-    def to_dict(self):
-        geojson_str = db.session.scalar(db.func.ST_AsGeoJSON(self.geom))
-        geojson_dict = json.loads(geojson_str) if geojson_str else None
-        return {
-            'id': self.id,
-            'name': self.name,
-            'geom': geojson_dict,
-            'diameter': self.diameter,
-            'slope': self.slope,
-            'material': self.material,
-            'design_flow': self.design_flow,
-            'calculated_flow': self.calculated_flow,
-            'full_capacity_ratio': self.full_capacity_ratio,
-            'calculated_length_m': self.calculated_length_m # 返回長度資訊
-        }
+    editable_fields = ('name', 'from_manhole_id', 'to_manhole_id', 'diameter', 'slope', 'material', 'design_flow')
+    serialize_fields = ('id', 'name', 'from_manhole_id', 'to_manhole_id', 'diameter', 'slope', 'material', 'design_flow',
+                        'calculated_flow', 'calculated_velocity', 'calculated_depth',
+                        'full_capacity_ratio', 'calculated_length_m', 'revision')
 
-class CatchmentArea(db.Model):
+class CatchmentArea(FeatureMixin, db.Model):
     __tablename__ = 'catchment_areas'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     geom = db.Column(Geography('POLYGON', srid=4326))
+    outlet_manhole_id = db.Column(db.Integer, db.ForeignKey('manholes.id', ondelete='SET NULL')) # 逕流排入的人孔
     runoff_coefficient = db.Column(db.Float, default=0.5)
     rainfall_intensity = db.Column(db.Float, default=50.0)
     calculated_peak_flow = db.Column(db.Float)
     calculated_area_sq_m = db.Column(db.Float) # 新增面積欄位
 
-    def to_dict(self):
-        geojson_str = db.session.scalar(db.func.ST_AsGeoJSON(self.geom))
-        geojson_dict = json.loads(geojson_str) if geojson_str else None
-        return {
+    editable_fields = ('name', 'outlet_manhole_id', 'runoff_coefficient', 'rainfall_intensity')
+    serialize_fields = ('id', 'name', 'outlet_manhole_id', 'runoff_coefficient', 'rainfall_intensity',
+                        'calculated_peak_flow', 'calculated_area_sq_m', 'revision')
+
+# 圖層名稱 (資料表名稱) → 模型
+LAYER_MODELS = {model.__tablename__: model for model in (Manhole, Pipeline, CatchmentArea)}
+
+class NetworkState(db.Model):
+    """管網版本：人孔、管線、集水區任何新增、修改、刪除或寫回模擬結果時遞增"""
+    __tablename__ = 'network_state'
+    id = db.Column(db.Integer, primary_key=True) # 只有 id=1 一筆
+    revision = db.Column(db.BigInteger, nullable=False, default=0)
+    simulated_revision = db.Column(db.BigInteger) # 上次穩態模擬寫回時已涵蓋的管網版本，NULL 表示尚未完整模擬過
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DeletedFeature(db.Model):
+    """已刪除要素的紀錄 (tombstone)，讓 /api/changes 能回傳刪除事件"""
+    __tablename__ = 'deleted_features'
+    id = db.Column(db.Integer, primary_key=True)
+    layer = db.Column(db.String(50), nullable=False)
+    feature_id = db.Column(db.Integer, nullable=False)
+    revision = db.Column(db.BigInteger, index=True, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SimulationScenario(db.Model):
+    """批次情境模擬結果，不修改基礎資料表"""
+    __tablename__ = 'simulation_scenarios'
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), index=True, nullable=False)
+    name = db.Column(db.String(100))
+    parameters = db.Column(db.JSON) # 情境參數覆寫
+    summary = db.Column(db.JSON) # 溢流人孔、最大滿管度等精簡摘要
+    results = db.Column(db.JSON) # 各要素完整結果 (以欄位為單位的陣列)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self, include_results=False):
+        data = {
             'id': self.id,
+            'batch_id': self.batch_id,
             'name': self.name,
-            'geom': geojson_dict,
-            'runoff_coefficient': self.runoff_coefficient,
-            'rainfall_intensity': self.rainfall_intensity,
-            'calculated_peak_flow': self.calculated_peak_flow,
-            'calculated_area_sq_m': self.calculated_area_sq_m # 返回面積資訊
+            'parameters': self.parameters,
+            'summary': self.summary,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
         }
+        if include_results:
+            data['results'] = self.results
+        return data
+
+class SimulationJob(db.Model):
+    """背景模擬工作的狀態、進度與結果"""
+    __tablename__ = 'simulation_jobs'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued / running / succeeded / failed
+    progress = db.Column(db.Float, nullable=False, default=0.0) # 0 ~ 1
+    stage = db.Column(db.String(50))
+    parameters = db.Column(db.JSON)
+    dedupe_key = db.Column(db.String(64), index=True)
+    owner = db.Column(db.String(255)) # 執行工作的行程 (主機名稱:pid)
+    heartbeat_at = db.Column(db.DateTime) # 所屬行程最後一次回報存活的時間
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self, include_result=False):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'stage': self.stage,
+            'parameters': self.parameters,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+# ==============================================================================
+# 管網版本與結果快取
+# ==============================================================================
+
+# 模擬結果與列表回應以 (管網版本, 類別, 參數) 為鍵快取，版本未變時直接回傳
+result_cache = ResultCache(max_bytes=int(float(os.environ.get('HYDRO_RESULT_CACHE_MB', 128)) * 1024 * 1024))
+
+def current_network_revision():
+    revision = db.session.execute(db.select(NetworkState.revision).where(NetworkState.id == 1)).scalar()
+    return revision or 0
+
+def bump_network_revision():
+    """在目前的交易中遞增管網版本並回傳新版本，與資料變更一起 commit"""
+    revision = db.session.execute(
+        db.update(NetworkState)
+        .where(NetworkState.id == 1)
+        .values(revision=NetworkState.revision + 1, updated_at=datetime.utcnow())
+        .returning(NetworkState.revision)
+    ).scalar()
+    if revision is None:
+        db.session.add(NetworkState(id=1, revision=1))
+        db.session.flush()
+        revision = 1
+    return revision
+
+def record_deletions(model, feature_ids, revision):
+    db.session.add_all(DeletedFeature(layer=model.__tablename__, feature_id=feature_id, revision=revision)
+                       for feature_id in feature_ids)
+
+def touch_manhole_references(manhole_ids, revision):
+    """刪除人孔時，資料庫會將參照它的管線與集水區欄位設為 NULL，這些要素也需列為已變更"""
+    Pipeline.query.filter(db.or_(Pipeline.from_manhole_id.in_(manhole_ids), Pipeline.to_manhole_id.in_(manhole_ids))) \
+        .update({'revision': revision}, synchronize_session=False)
+    CatchmentArea.query.filter(CatchmentArea.outlet_manhole_id.in_(manhole_ids)) \
+        .update({'revision': revision}, synchronize_session=False)
+
+def feature_key_columns(model):
+    """要素 id 與連結人孔的外鍵欄位 (標記待重算時需要)"""
+    return [model.id] + [getattr(model, name) for name in model.editable_fields if name.endswith('_manhole_id')]
+
+def load_feature_keys(model, *criteria):
+    return db.session.execute(db.select(*feature_key_columns(model)).where(*criteria)).all()
+
+# 依幾何量測並儲存的欄位，只在新增或修改幾何時重新計算
+MEASURED_COLUMNS = {
+    'pipelines': ('calculated_length_m', measure_lengths),
+    'catchment_areas': ('calculated_area_sq_m', measure_areas),
+}
+
+def geometry_measurements(model, geometries):
+    """批次量測幾何陣列，回傳 {欄位: 數值陣列}；人孔沒有量測欄位，回傳空 dict"""
+    if model.__tablename__ not in MEASURED_COLUMNS:
+        return {}
+    column, measure = MEASURED_COLUMNS[model.__tablename__]
+    return {column: measure(geometries)}
+
+def cache_key(revision, kind, params):
+    return revision, kind, json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+def json_body(data):
+    return app.json.dumps(data).encode('utf-8')
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify({'network_revision': current_network_revision(), **result_cache.stats()})
+
+@app.route('/api/cache', methods=['DELETE'])
+def clear_cache():
+    result_cache.clear()
+    return '', 204
+
+# ==============================================================================
+# 效能指標 (請求耗時、SQL 數與耗時、模擬各階段耗時)
+# ==============================================================================
+
+# 預設開啟 (HYDRO_METRICS=0 關閉)。每個 SQL 只多兩次計時，數值先累積在請求自己的
+# RequestTimings，請求結束時才加鎖併入全域指標，可長期在正式環境開啟
+METRICS_ENABLED = os.environ.get('HYDRO_METRICS', '1') != '0'
+
+metrics = MetricsRegistry()
+metrics.describe('hydro_http_requests_total', 'counter', 'HTTP 請求數')
+metrics.describe('hydro_http_request_duration_seconds', 'summary', 'HTTP 請求耗時 (秒)')
+metrics.describe('hydro_sql_statements_total', 'counter', '送出的 SQL 數')
+metrics.describe('hydro_sql_duration_seconds_total', 'counter', 'SQL 執行耗時 (秒)')
+metrics.describe('hydro_simulation_phase_seconds', 'summary', '模擬各階段耗時 (秒)')
+
+def collect_cache_metrics():
+    stats = result_cache.stats()
+    return [
+        ('hydro_result_cache_bytes', 'gauge', '結果快取大小 (bytes)', [({}, stats['bytes'])]),
+        ('hydro_result_cache_entries', 'gauge', '結果快取項目數', [({}, stats['entries'])]),
+        ('hydro_result_cache_lookups_total', 'counter', '結果快取查詢次數',
+         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+    ]
+
+metrics.add_collector(collect_cache_metrics)
+
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def stop_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    timings = current_timings.get()
+    if timings is None: # 不屬於任何請求或背景工作 (例如建表腳本)
+        metrics.merge([('inc', 'hydro_sql_statements_total', 1, {'endpoint': 'none'}),
+                       ('inc', 'hydro_sql_duration_seconds_total', elapsed, {'endpoint': 'none'})])
+    else:
+        timings.sql_count += 1
+        timings.sql_seconds += elapsed
+
+def discard_sql_timer(exception_context):
+    # 執行失敗時不會觸發 after_cursor_execute，丟棄對應的開始時間
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+
+def record_timings(timings):
+    """將一個請求或背景工作的 SQL 數與耗時併入全域指標"""
+    labels = {'endpoint': timings.endpoint}
+    metrics.merge([('inc', 'hydro_sql_statements_total', timings.sql_count, labels),
+                   ('inc', 'hydro_sql_duration_seconds_total', timings.sql_seconds, labels)])
+
+def record_phases(mode, phases):
+    """記錄一次模擬各階段的耗時，並附加到目前請求的 Server-Timing"""
+    metrics.merge([('observe', 'hydro_simulation_phase_seconds', seconds, {'mode': mode, 'phase': stage})
+                   for stage, seconds in phases.items()])
+    timings = current_timings.get()
+    if timings is not None:
+        for stage, seconds in phases.items():
+            timings.add_phase(stage, seconds)
+
+def start_request_timing():
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.request_timings = RequestTimings(endpoint)
+    g.request_timings_token = current_timings.set(g.request_timings)
+
+def add_server_timing(response):
+    """串流回應在此時尚未輸出內容，標頭只包含到目前為止的耗時"""
+    timings = g.get('request_timings')
+    if timings is not None:
+        g.response_status = response.status_code
+        response.headers['Server-Timing'] = timings.server_timing()
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+def finish_request_timing(exception=None):
+    # 串流回應 (stream_with_context) 在內容輸出完畢後才執行，包含串流期間的 SQL
+    timings = g.pop('request_timings', None)
+    if timings is None:
+        return
+    current_timings.reset(g.pop('request_timings_token'))
+    status = g.pop('response_status', 500)
+    labels = {'method': request.method, 'endpoint': timings.endpoint}
+    metrics.merge([('inc', 'hydro_http_requests_total', 1, {**labels, 'status': str(status)}),
+                   ('observe', 'hydro_http_request_duration_seconds', timings.elapsed(), labels)])
+    record_timings(timings)
+
+if METRICS_ENABLED:
+    event.listen(Engine, 'before_cursor_execute', start_sql_timer)
+    event.listen(Engine, 'after_cursor_execute', stop_sql_timer)
+    event.listen(Engine, 'handle_error', discard_sql_timer)
+    app.before_request(start_request_timing)
+    app.after_request(add_server_timing)
+    app.teardown_request(finish_request_timing)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text format 的效能指標"""
+    if not METRICS_ENABLED:
+        return jsonify({"message": "效能指標未啟用 (HYDRO_METRICS=0)"}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# ==============================================================================
+# 要素列表查詢 (分頁、視窗範圍過濾、串流輸出)
+# ==============================================================================
+
+MAX_PAGE_LIMIT = 10000
+STREAM_BATCH_SIZE = 1000
+
+def parse_bbox(value):
+    """解析 bbox=minx,miny,maxx,maxy (WGS84 經緯度)"""
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in value.split(','))
+    except ValueError:
+        return None
+    if minx > maxx or miny > maxy:
+        return None
+    return minx, miny, maxx, maxy
+
+def bbox_filter(model, bbox):
+    return envelope_filter(model, db.func.ST_MakeEnvelope(*bbox, 4326))
+
+def envelope_filter(model, envelope):
+    # 使用 && 外框重疊運算子，可直接利用 geom 欄位上的 GIST 索引；envelope 為 EPSG:4326
+    if isinstance(model.geom.type, Geography):
+        envelope = db.cast(envelope, Geography(srid=4326))
+    return model.geom.op('&&')(envelope)
+
+def list_features(model):
+    """
+    列出圖層要素，支援下列查詢參數：
+    - bbox=minx,miny,maxx,maxy : 只回傳與視窗範圍重疊的要素
+    - limit=N&after=<id>       : 以 id 為游標的 keyset 分頁，下一頁游標放在 X-Next-Cursor 標頭
+    - format=json|geojson|ndjson : 預設為原本的 JSON 陣列；geojson/ndjson 以串流方式輸出
+    JSON 陣列回應會依管網版本快取，管網未變動時重複查詢不再存取資料庫。
+    目前的管網版本放在 X-Network-Revision 標頭，之後可用 /api/changes?since=<版本> 取得增量變更。
+    """
+    output_format = request.args.get('format', 'json')
+    revision = current_network_revision()
+    if output_format == 'json':
+        key = cache_key(revision, model.__tablename__, sorted(request.args.items()))
+        cached = result_cache.get(key)
+        if cached is None:
+            response = build_feature_list(model, output_format, revision)
+            if response.status_code == 200:
+                result_cache.put(key, (response.get_data(), dict(response.headers)), len(response.get_data()))
+            return response
+        body, headers = cached
+        return Response(body, headers=headers)
+    return build_feature_list(model, output_format, revision)
+
+def build_feature_list(model, output_format, revision):
+    query = model.query.order_by(model.id)
+
+    bbox_param = request.args.get('bbox')
+    if bbox_param:
+        bbox = parse_bbox(bbox_param)
+        if bbox is None:
+            return make_response(jsonify({"message": "bbox 格式錯誤，應為 minx,miny,maxx,maxy"}), 400)
+        query = query.filter(bbox_filter(model, bbox))
+
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.filter(model.id > after)
+
+    if output_format not in ('json', 'geojson', 'ndjson'):
+        return make_response(jsonify({"message": f"不支援的輸出格式: {output_format}"}), 400)
+
+    headers = {'X-Network-Revision': str(revision)}
+    next_cursor = None
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_LIMIT))
+        # 多取一筆以判斷是否還有下一頁
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1].id
+            headers['X-Next-Cursor'] = str(next_cursor)
+    else:
+        rows = query.yield_per(STREAM_BATCH_SIZE)
+
+    fields = model.serialize_fields
+    if output_format == 'geojson':
+        body = stream_feature_collection(rows, fields, next_cursor=next_cursor)
+        return Response(stream_with_context(body), mimetype='application/geo+json', headers=headers)
+    if output_format == 'ndjson':
+        body = stream_ndjson(rows, fields)
+        return Response(stream_with_context(body), mimetype='application/x-ndjson', headers=headers)
+    return make_response(jsonify([row.to_dict() for row in rows]), 200, headers)
+
+# ==============================================================================
+# 編輯追蹤 (增量模擬用)
+# ==============================================================================
+
+# 待重算的要素由資料庫推得：版本大於 network_state.simulated_revision 的要素 (含模擬後新增、修改者)
+# 及其目前連結的人孔，所有行程共用，重啟後也不會遺失。
+# 管線與集水區改接或刪除時，原本連結的人孔不在要素目前的欄位中，需在同一交易中一併更新其版本。
+
+DirtySet = namedtuple('DirtySet', ['since', 'manholes', 'pipelines', 'catchment_areas'])
+
+def touch_manholes(manhole_ids, revision):
+    """將人孔版本更新為 revision，列為下次增量模擬的重算起點，None 會被忽略"""
+    ids = sorted({i for i in manhole_ids if i is not None})
+    if ids:
+        Manhole.query.filter(Manhole.id.in_(ids)).update({'revision': revision}, synchronize_session=False)
+
+def touch_linked_manholes(model, records, revision):
+    """records 需有外鍵欄位 (修改或刪除前的值)，將其連結的人孔列為待重算"""
+    fields = [column.key for column in feature_key_columns(model)[1:]]
+    touch_manholes([getattr(record, field) for record in records for field in fields], revision)
+
+def load_simulation_state():
+    """回傳 (目前管網版本, 上次模擬已涵蓋的管網版本)"""
+    row = db.session.execute(
+        db.select(NetworkState.revision, NetworkState.simulated_revision).where(NetworkState.id == 1)).first()
+    return (row.revision or 0, row.simulated_revision) if row is not None else (0, None)
+
+def load_dirty_set(since):
+    """
+    版本大於 since 的各圖層要素 id。
+    刪除要素原本連結的人孔在刪除時已更新版本，因此會出現在 manholes 中。
+    """
+    ids = {model.__tablename__: frozenset(db.session.execute(
+               db.select(model.id).where(model.revision > since)).scalars())
+           for model in (Manhole, Pipeline, CatchmentArea)}
+    return DirtySet(since, **ids)
+
+def mark_simulated(revision):
+    """記錄模擬寫回的結果已涵蓋到此管網版本，與寫回在同一交易中 commit；不會倒退"""
+    db.session.execute(
+        db.update(NetworkState)
+        .where(NetworkState.id == 1,
+               db.or_(NetworkState.simulated_revision.is_(None), NetworkState.simulated_revision < revision))
+        .values(simulated_revision=revision))
 
 # ==============================================================================
 # API Routes
 # ==============================================================================
 # ... (這裡的 API Routes 保持不變，因為它們會自動處理新的欄位)
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """
+    增量同步：回傳管網版本 since 之後新增、修改 (含模擬結果寫回) 或刪除的要素。
+    回應中的 revision 為目前版本，下次以此值作為 since。
+    """
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return jsonify({"message": "since 必須為非負整數的管網版本"}), 400
+    # 版本遞增與資料變更在同一交易中 commit，且 network_state 的列鎖讓 commit 依版本順序發生，
+    # 因此版本不大於 revision 的變更都已可見
+    revision = current_network_revision()
+    if since > revision:
+        return jsonify({"message": f"since 不可大於目前的管網版本 {revision}"}), 400
+
+    changes = {}
+    for model in (Manhole, Pipeline, CatchmentArea):
+        rows = model.query.filter(model.revision > since, model.revision <= revision).order_by(model.id)
+        deleted = db.session.execute(
+            db.select(DeletedFeature.feature_id)
+            .where(DeletedFeature.layer == model.__tablename__,
+                   DeletedFeature.revision > since, DeletedFeature.revision <= revision)
+            .order_by(DeletedFeature.feature_id)
+        ).scalars()
+        changes[model.__tablename__] = {
+            'upserted': [row.to_dict() for row in rows],
+            'deleted': list(deleted),
+        }
+    return jsonify({'since': since, 'revision': revision, **changes})
+
 @app.route('/api/manholes', methods=['GET'])
 def get_manholes():
-    manholes = Manhole.query.all()
-    return jsonify([mh.to_dict() for mh in manholes])
+    return list_features(Manhole)
 
 @app.route('/api/manholes', methods=['POST'])
 def add_manhole():
@@ -134,7 +566,10 @@ def add_manhole():
         inflow=data.get('inflow'),
         downstream_capacity=data.get('downstream_capacity')
     )
+    new_manhole.revision = bump_network_revision()
     db.session.add(new_manhole)
+    db.session.flush()
+    auto_connect(Manhole, {new_manhole.id: set(data)}, new_manhole.revision)
     db.session.commit()
     return jsonify(new_manhole.to_dict()), 201
 
@@ -153,12 +588,18 @@ def update_manhole(id):
     manhole.overflow_elevation = data.get('overflow_elevation', manhole.overflow_elevation)
     manhole.inflow = data.get('inflow', manhole.inflow)
     manhole.downstream_capacity = data.get('downstream_capacity', manhole.downstream_capacity)
+    manhole.revision = bump_network_revision()
+    auto_connect(Manhole, {id: set(data)}, manhole.revision)
     db.session.commit()
     return jsonify(manhole.to_dict())
 
 @app.route('/api/manholes/<int:id>', methods=['DELETE'])
 def delete_manhole(id):
     manhole = Manhole.query.get_or_404(id)
+    # 連接此人孔的管線與集水區會失去連結，版本一併更新，增量模擬時重算
+    revision = bump_network_revision()
+    touch_manhole_references([id], revision)
+    record_deletions(Manhole, [id], revision)
     db.session.delete(manhole)
     db.session.commit()
     return '', 204
@@ -166,8 +607,7 @@ def delete_manhole(id):
 # --- Pipelines ---
 @app.route('/api/pipelines', methods=['GET'])
 def get_pipelines():
-    pipelines = Pipeline.query.all()
-    return jsonify([pl.to_dict() for pl in pipelines])
+    return list_features(Pipeline)
 
 @app.route('/api/pipelines', methods=['POST'])
 def add_pipeline():
@@ -179,34 +619,50 @@ def add_pipeline():
     new_pipeline = Pipeline(
         name=data.get('name', '新建管線'),
         geom=wkt_geom,
+        calculated_length_m=float(measure_lengths([shapely_geom])[0]),
+        from_manhole_id=data.get('from_manhole_id'),
+        to_manhole_id=data.get('to_manhole_id'),
         diameter=data.get('diameter'),
         slope=data.get('slope'),
         material=data.get('material'),
         design_flow=data.get('design_flow')
     )
+    new_pipeline.revision = bump_network_revision()
     db.session.add(new_pipeline)
+    db.session.flush()
+    auto_connect(Pipeline, {new_pipeline.id: set(data)}, new_pipeline.revision)
     db.session.commit()
     return jsonify(new_pipeline.to_dict()), 201
 
 @app.route('/api/pipelines/<int:id>', methods=['PUT'])
 def update_pipeline(id):
     pipeline = Pipeline.query.get_or_404(id)
+    old_manhole_ids = (pipeline.from_manhole_id, pipeline.to_manhole_id) # 修改前的起迄人孔也需重算
     data = request.get_json()
     if 'geom' in data:
         geojson_dict = data['geom']
         shapely_geom = shape(geojson_dict)
         pipeline.geom = wkt_dumps(shapely_geom)
+        pipeline.calculated_length_m = float(measure_lengths([shapely_geom])[0])
     pipeline.name = data.get('name', pipeline.name)
+    pipeline.from_manhole_id = data.get('from_manhole_id', pipeline.from_manhole_id)
+    pipeline.to_manhole_id = data.get('to_manhole_id', pipeline.to_manhole_id)
     pipeline.diameter = data.get('diameter', pipeline.diameter)
     pipeline.slope = data.get('slope', pipeline.slope)
     pipeline.material = data.get('material', pipeline.material)
     pipeline.design_flow = data.get('design_flow', pipeline.design_flow)
+    pipeline.revision = bump_network_revision()
+    touch_manholes(old_manhole_ids, pipeline.revision)
+    auto_connect(Pipeline, {id: set(data)}, pipeline.revision)
     db.session.commit()
     return jsonify(pipeline.to_dict())
 
 @app.route('/api/pipelines/<int:id>', methods=['DELETE'])
 def delete_pipeline(id):
     pipeline = Pipeline.query.get_or_404(id)
+    revision = bump_network_revision()
+    touch_manholes((pipeline.from_manhole_id, pipeline.to_manhole_id), revision)
+    record_deletions(Pipeline, [id], revision)
     db.session.delete(pipeline)
     db.session.commit()
     return '', 204
@@ -214,8 +670,7 @@ def delete_pipeline(id):
 # --- Catchment Areas ---
 @app.route('/api/catchment_areas', methods=['GET'])
 def get_catchment_areas():
-    catchment_areas = CatchmentArea.query.all()
-    return jsonify([ca.to_dict() for ca in catchment_areas])
+    return list_features(CatchmentArea)
 
 @app.route('/api/catchment_areas', methods=['POST'])
 def add_catchment_area():
@@ -227,109 +682,1260 @@ def add_catchment_area():
     new_area = CatchmentArea(
         name=data.get('name', '新建集水區'),
         geom=wkt_geom,
+        calculated_area_sq_m=float(measure_areas([shapely_geom])[0]),
+        outlet_manhole_id=data.get('outlet_manhole_id'),
         runoff_coefficient=data.get('runoff_coefficient'),
         rainfall_intensity=data.get('rainfall_intensity')
     )
+    new_area.revision = bump_network_revision()
     db.session.add(new_area)
+    db.session.flush()
+    auto_connect(CatchmentArea, {new_area.id: set(data)}, new_area.revision)
     db.session.commit()
     return jsonify(new_area.to_dict()), 201
 
 @app.route('/api/catchment_areas/<int:id>', methods=['PUT'])
 def update_catchment_area(id):
     area = CatchmentArea.query.get_or_404(id)
+    old_outlet_id = area.outlet_manhole_id
     data = request.get_json()
     if 'geom' in data:
         geojson_dict = data['geom']
         shapely_geom = shape(geojson_dict)
         area.geom = wkt_dumps(shapely_geom)
+        area.calculated_area_sq_m = float(measure_areas([shapely_geom])[0])
     area.name = data.get('name', area.name)
+    area.outlet_manhole_id = data.get('outlet_manhole_id', area.outlet_manhole_id)
     area.runoff_coefficient = data.get('runoff_coefficient', area.runoff_coefficient)
     area.rainfall_intensity = data.get('rainfall_intensity', area.rainfall_intensity)
+    area.revision = bump_network_revision()
+    touch_manholes([old_outlet_id], area.revision) # 修改前的出流人孔也需重算
+    auto_connect(CatchmentArea, {id: set(data)}, area.revision)
     db.session.commit()
     return jsonify(area.to_dict())
 
 @app.route('/api/catchment_areas/<int:id>', methods=['DELETE'])
 def delete_catchment_area(id):
     area = CatchmentArea.query.get_or_404(id)
+    revision = bump_network_revision()
+    touch_manholes([area.outlet_manhole_id], revision)
+    record_deletions(CatchmentArea, [id], revision)
     db.session.delete(area)
     db.session.commit()
     return '', 204
 
 # ==============================================================================
-# 模擬端點 - 修正後的版本
+# 向量圖磚 (Mapbox Vector Tile)
 # ==============================================================================
 
-@app.route('/api/simulate', methods=['POST'])
-def simulate_hydraulics():
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_TILE_ZOOM = 24
+
+def build_vector_tile(model, z, x, y):
+    """
+    以 ST_AsMVT 產生單一圖層的向量圖磚，屬性包含模擬結果欄位 (is_overflow、full_capacity_ratio 等) 供前端著色。
+    只查詢與圖磚範圍 (含緩衝區) 重疊的要素，可利用 geom 欄位上的 GIST 索引。
+    """
+    tile_envelope = db.func.ST_TileEnvelope(z, x, y) # EPSG:3857
+    search_envelope = db.func.ST_Transform(
+        db.func.ST_TileEnvelope(z, x, y, db.func.ST_TileEnvelope(0, 0, 0), TILE_BUFFER / TILE_EXTENT), 4326)
+    geom = model.geom
+    if isinstance(model.geom.type, Geography):
+        geom = db.cast(geom, Geometry(srid=4326))
+    features = db.select(
+        *(getattr(model, field) for field in model.serialize_fields),
+        db.func.ST_AsMVTGeom(db.func.ST_Transform(geom, 3857), tile_envelope, TILE_EXTENT, TILE_BUFFER, True).label('geom'),
+    ).where(envelope_filter(model, search_envelope)).subquery()
+    tile = db.session.execute(db.select(
+        db.func.ST_AsMVT(features.table_valued(), model.__tablename__, TILE_EXTENT, 'geom', 'id')
+    )).scalar()
+    return bytes(tile or b'')
+
+@app.route('/api/tiles/<layer>/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+def get_vector_tile(layer, z, x, y):
+    """
+    向量圖磚 (XYZ 編號，Web Mercator)，layer 為 manholes / pipelines / catchment_areas。
+    圖磚依管網版本快取並附 ETag，任何編輯或寫回模擬結果後版本遞增，快取自動失效。
+    """
+    model = LAYER_MODELS.get(layer)
+    if model is None:
+        return jsonify({"message": f"不支援的圖層: {layer}"}), 404
+    if not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"message": "圖磚編號超出範圍"}), 400
+
+    revision = current_network_revision()
+    key = cache_key(revision, 'tile', [layer, z, x, y])
+    tile = result_cache.get(key)
+    if tile is None:
+        tile = build_vector_tile(model, z, x, y)
+        result_cache.put(key, tile)
+    response = Response(tile, mimetype='application/vnd.mapbox-vector-tile')
+    response.set_etag(f'{revision}-{layer}-{z}-{x}-{y}')
+    response.headers['Cache-Control'] = 'no-cache' # 每次以 ETag 向伺服器確認版本
+    return response.make_conditional(request)
+
+# ==============================================================================
+# 管網拓撲自動連結
+# ==============================================================================
+
+AUTO_TOPOLOGY = os.environ.get('HYDRO_AUTO_TOPOLOGY', '1') != '0'
+SNAP_TOLERANCE_M = float(os.environ.get('HYDRO_SNAP_TOLERANCE_M', 1.0)) # 管線端點吸附人孔的容許距離
+OUTLET_SEARCH_M = float(os.environ.get('HYDRO_OUTLET_SEARCH_M', 50.0)) # 集水區內沒有人孔時，搜尋出流人孔的距離
+PIPE_ENDPOINTS = (('from_manhole_id', db.func.ST_StartPoint), ('to_manhole_id', db.func.ST_EndPoint))
+
+def as_geography(geom):
+    # 與 init_db.sql 中人孔 geography 運算式索引的型別相同，KNN 排序才能使用索引
+    return db.cast(geom, Geography(srid=4326))
+
+def apply_links(model, links, revision):
+    """
+    links: {要素 id: {外鍵欄位: 人孔 id}}；以一次 executemany 寫回。
+    被改接的原連結人孔版本一併更新 (增量模擬需重算)。
+    """
+    if not links:
+        return
+    touch_linked_manholes(model, load_feature_keys(model, model.id.in_(list(links))), revision)
+    db.session.execute(db.update(model), [{'id': feature_id, **values, 'revision': revision}
+                                          for feature_id, values in links.items()])
+
+def snap_pipelines(pipeline_fields, revision):
+    """
+    以 PostGIS KNN (geography <->，利用人孔 geography 的 GIST 索引) 將管線端點吸附到 SNAP_TOLERANCE_M 公尺內最近的人孔。
+    排序與容許距離都以公尺 (球面距離) 計算，經緯度距離最近的人孔不一定是實際最近者。
+    pipeline_fields: {外鍵欄位: 管線 id 列表}，只重新吸附這些端點；找不到人孔時保留原連結。
+    """
+    links = {}
+    for field, endpoint_func in PIPE_ENDPOINTS:
+        pipeline_ids = pipeline_fields.get(field)
+        if not pipeline_ids:
+            continue
+        endpoint = endpoint_func(Pipeline.geom)
+        nearest = db.select(Manhole.id, Manhole.geom) \
+            .order_by(as_geography(Manhole.geom).op('<->')(as_geography(endpoint))).limit(1).lateral('nearest')
+        rows = db.session.execute(
+            db.select(Pipeline.id, nearest.c.id)
+            .select_from(Pipeline)
+            .join(nearest, db.true())
+            .where(Pipeline.id.in_(pipeline_ids),
+                   db.func.ST_DWithin(as_geography(nearest.c.geom), as_geography(endpoint), SNAP_TOLERANCE_M))
+        )
+        for pipeline_id, manhole_id in rows:
+            links.setdefault(pipeline_id, {})[field] = manhole_id
+    apply_links(Pipeline, links, revision)
+
+def assign_outlets(catchment_ids, revision):
+    """
+    指定集水區的出流人孔：集水區內底部標高最低 (最下游) 的人孔；
+    集水區內沒有人孔時，以 KNN 取 OUTLET_SEARCH_M 公尺內最近的人孔。找不到時保留原連結。
+    """
+    if not catchment_ids:
+        return
+    polygon = db.cast(CatchmentArea.geom, Geometry(srid=4326))
+    inside = db.select(Manhole.id) \
+        .where(db.func.ST_Intersects(Manhole.geom, polygon)) \
+        .order_by(Manhole.bottom_elevation.asc().nulls_last(), Manhole.id).limit(1).lateral('inside')
+    nearest = db.select(Manhole.id, Manhole.geom) \
+        .order_by(as_geography(Manhole.geom).op('<->')(as_geography(polygon))).limit(1).lateral('nearest')
+    rows = db.session.execute(
+        db.select(CatchmentArea.id, inside.c.id, nearest.c.id,
+                  db.func.ST_DWithin(as_geography(nearest.c.geom), CatchmentArea.geom, OUTLET_SEARCH_M))
+        .select_from(CatchmentArea)
+        .outerjoin(inside, db.true())
+        .outerjoin(nearest, db.true())
+        .where(CatchmentArea.id.in_(catchment_ids))
+    )
+    links = {}
+    for catchment_id, inside_id, nearest_id, within_search in rows:
+        outlet_id = inside_id if inside_id is not None else (nearest_id if within_search else None)
+        if outlet_id is not None:
+            links[catchment_id] = {'outlet_manhole_id': outlet_id}
+    apply_links(CatchmentArea, links, revision)
+
+def connect_manholes(manhole_ids, revision):
+    """
+    人孔新增或移動後，將端點在容許距離內且尚未連結的管線、
+    以及包含此人孔且尚未指定出流人孔的集水區連到它。
+    """
+    # 以經緯度外框 (ST_Expand) 先篩選，讓 && 能利用管線 geom 的 GIST 索引
+    search_box = db.func.ST_Expand(
+        Manhole.geom, SNAP_TOLERANCE_M / (111320.0 * db.func.cos(db.func.radians(db.func.ST_Y(Manhole.geom)))))
+    links = {}
+    for field, endpoint_func in PIPE_ENDPOINTS:
+        endpoint = endpoint_func(Pipeline.geom)
+        rows = db.session.execute(
+            db.select(Pipeline.id, Manhole.id)
+            .where(Manhole.id.in_(manhole_ids),
+                   getattr(Pipeline, field).is_(None),
+                   Pipeline.geom.op('&&')(search_box),
+                   db.func.ST_DWithin(as_geography(endpoint), as_geography(Manhole.geom), SNAP_TOLERANCE_M))
+        )
+        for pipeline_id, manhole_id in rows:
+            links.setdefault(pipeline_id, {})[field] = manhole_id
+    apply_links(Pipeline, links, revision)
+
+    rows = db.session.execute(
+        db.select(CatchmentArea.id, Manhole.id)
+        .where(Manhole.id.in_(manhole_ids),
+               CatchmentArea.outlet_manhole_id.is_(None),
+               CatchmentArea.geom.op('&&')(as_geography(Manhole.geom)),
+               db.func.ST_Intersects(db.cast(CatchmentArea.geom, Geometry(srid=4326)), Manhole.geom))
+    )
+    links = {catchment_id: {'outlet_manhole_id': manhole_id} for catchment_id, manhole_id in rows}
+    apply_links(CatchmentArea, links, revision)
+
+def auto_connect(model, edits, revision):
+    """
+    要素新增或修改幾何後，在同一交易中自動連結拓撲。
+    edits: {要素 id: 請求中提供的欄位}，只處理有 geom 的要素，使用者明確指定的外鍵欄位不會被覆寫。
+    """
+    edits = {feature_id: fields for feature_id, fields in edits.items() if 'geom' in fields}
+    if not AUTO_TOPOLOGY or not edits:
+        return
+    db.session.flush()
+    if model is Manhole:
+        connect_manholes(list(edits), revision)
+    elif model is Pipeline:
+        pipeline_fields = {field: [feature_id for feature_id, fields in edits.items() if field not in fields]
+                           for field, _ in PIPE_ENDPOINTS}
+        snap_pipelines(pipeline_fields, revision)
+    else:
+        catchment_ids = [feature_id for feature_id, fields in edits.items() if 'outlet_manhole_id' not in fields]
+        assign_outlets(catchment_ids, revision)
+
+def connect_network(snap_tolerance_m, outlet_search_m, overwrite):
+    """
+    以 STRtree 在 UTM 座標下一次處理整個管網：吸附所有管線端點、指定所有集水區的出流人孔。
+    overwrite 為 False 時只填補尚未連結的欄位。回傳摘要。
+    """
+    manholes = load_records(Manhole)
+    pipelines = load_records(Pipeline)
+    catchment_areas = load_records(CatchmentArea)
+    manhole_ids = np.array([mh.id for mh in manholes], dtype=np.int64)
+    manhole_geometries = geometries_from_elements([mh.geom for mh in manholes])
+    epsg = utm_epsg_for_extent(manhole_geometries) # 所有圖層使用同一個 UTM 帶才能比較距離
+    manhole_points = transform_geometries_to_utm(manhole_geometries, epsg)
+    from_index, to_index = snap_pipe_endpoints(
+        transform_geometries_to_utm(geometries_from_elements([pl.geom for pl in pipelines]), epsg),
+        manhole_points, snap_tolerance_m)
+    outlet_index = assign_catchment_outlets(
+        transform_geometries_to_utm(geometries_from_elements([ca.geom for ca in catchment_areas]), epsg),
+        manhole_points, column_array(manholes, 'bottom_elevation', np.nan), outlet_search_m)
+
+    old_manhole_ids = [] # 原本連結的人孔也需重算
+
+    def link(model, records, assignments):
+        """assignments: [(欄位, 人孔索引陣列)]，回傳連結有變動的記錄"""
+        changed = []
+        for k, record in enumerate(records):
+            old = [getattr(record, field) for field, _ in assignments]
+            for field, index in assignments:
+                if index[k] >= 0 and (overwrite or getattr(record, field) is None):
+                    setattr(record, field, manhole_ids[index[k]].item())
+            if [getattr(record, field) for field, _ in assignments] != old:
+                old_manhole_ids.extend(old)
+                changed.append(record)
+        return changed
+
+    changed_pipelines = link(Pipeline, pipelines, [('from_manhole_id', from_index), ('to_manhole_id', to_index)])
+    changed_catchments = link(CatchmentArea, catchment_areas, [('outlet_manhole_id', outlet_index)])
+    if changed_pipelines or changed_catchments:
+        revision = bump_network_revision()
+        bulk_update(Pipeline, changed_pipelines, ('from_manhole_id', 'to_manhole_id'), revision)
+        bulk_update(CatchmentArea, changed_catchments, ('outlet_manhole_id',), revision)
+        touch_manholes(old_manhole_ids, revision)
+    else:
+        revision = current_network_revision() # 連結皆未變動，不遞增版本 (快取與增量同步維持有效)
+
+    summary = {
+        'revision': revision,
+        'pipelines_updated': len(changed_pipelines),
+        'catchment_areas_updated': len(changed_catchments),
+        'unconnected_pipe_endpoints': sum((pl.from_manhole_id is None) + (pl.to_manhole_id is None) for pl in pipelines),
+        'catchment_areas_without_outlet': sum(ca.outlet_manhole_id is None for ca in catchment_areas),
+    }
+    return summary
+
+@app.route('/api/topology/connect', methods=['POST'])
+def connect_topology():
+    """
+    整個管網的拓撲自動連結 (匯入大量資料後使用)，請求參數皆為選填：
+    {"snap_tolerance_m": 1.0, "outlet_search_m": 50.0, "overwrite": false}
+    overwrite 為 true 時以空間位置重新計算所有連結，否則只填補尚未連結的欄位。
+    """
+    data = request.get_json(silent=True) or {}
     try:
-        manholes = Manhole.query.all()
-        pipelines = Pipeline.query.all()
-        catchment_areas = CatchmentArea.query.all()
-
-        # 1. 計算集水區洪峰流量 (Q = C * I * A) 和面積
-        for area in catchment_areas:
-            geom_transformed = db.func.ST_Transform(area.geom, 3857)
-            area_sq_m = db.session.scalar(db.func.ST_Area(geom_transformed))
-            
-            calculated_flow = (area.runoff_coefficient * area.rainfall_intensity * area_sq_m) / 3600000
-            area.calculated_peak_flow = max(0, calculated_flow)
-            area.calculated_area_sq_m = area_sq_m # 儲存計算出的面積
-            
-            db.session.add(area) 
-
-        # 2. 管道水理計算和長度
-        for pipeline in pipelines:
-            n = 0.013 
-            if pipeline.material == '鑄鐵':
-                n = 0.014
-            elif pipeline.material == 'PVC':
-                n = 0.009
-            
-            # 計算管線長度
-            # 由於 geom 欄位是 Geometry('LINESTRING', srid=4326)，我們也需要進行投影轉換以獲得公尺單位
-            geom_transformed_len = db.func.ST_Transform(pipeline.geom, 3857)
-            pipeline.calculated_length_m = db.session.scalar(db.func.ST_Length(geom_transformed_len))
-
-            A_full = math.pi * (pipeline.diameter / 2)**2
-            R_full = pipeline.diameter / 4
-
-            Q_full = (1/n) * A_full * (R_full**(2/3)) * (pipeline.slope**0.5)
-
-            pipeline.calculated_flow = pipeline.design_flow
-            
-            if Q_full > 0:
-                pipeline.full_capacity_ratio = (pipeline.calculated_flow / Q_full) * 100
-            else:
-                pipeline.full_capacity_ratio = 0
-            
-            db.session.add(pipeline) 
-
-        # 3. 人孔水位和溢流判斷
-        for manhole in manholes:
-            if manhole.design_flow_limit > 0:
-                water_level_ratio = manhole.inflow / manhole.design_flow_limit
-                manhole.calculated_water_level = manhole.bottom_elevation + \
-                                                 water_level_ratio * (manhole.overflow_elevation - manhole.bottom_elevation)
-                manhole.calculated_water_level = min(manhole.calculated_water_level, manhole.top_elevation)
+        snap_tolerance_m = float(data.get('snap_tolerance_m', SNAP_TOLERANCE_M))
+        outlet_search_m = float(data.get('outlet_search_m', OUTLET_SEARCH_M))
+    except (TypeError, ValueError):
+        return jsonify({"message": "snap_tolerance_m 與 outlet_search_m 必須為數值 (公尺)"}), 400
+    try:
+        summary = connect_network(snap_tolerance_m, outlet_search_m, bool(data.get('overwrite', False)))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print("拓撲連結失敗:")
+        traceback.print_exc()
+        return jsonify({"message": f"拓撲連結失敗: {str(e)}"}), 500
+    return jsonify(summary)
+
+# ==============================================================================
+# 批次編輯 (單一交易)
+# ==============================================================================
+
+MAX_BATCH_OPERATIONS = 10000
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+NEW_FEATURE_NAMES = {'manholes': '新建人孔', 'pipelines': '新建管線', 'catchment_areas': '新建集水區'}
+# 新增依上游到下游的參照順序，刪除則相反，讓外鍵參照在同一批次內成立
+CREATE_ORDER = (Manhole, Pipeline, CatchmentArea)
+DELETE_ORDER = (CatchmentArea, Pipeline, Manhole)
+
+class BatchNotFound(LookupError):
+    pass
+
+def non_nullable_fields(model, data):
+    """data 中值為 null、但資料表不允許 NULL 的欄位 (geom 也不可為 null)"""
+    columns = model.__table__.c
+    return sorted(name for name, value in data.items() if value is None and (
+        name == 'geom' or name in model.editable_fields and not columns[name].nullable))
+
+def parse_batch_operations(operations):
+    """
+    檢查操作格式，回傳 ({(model, op): [(位置, 操作), ...]}, {參照的既有人孔 id: 第一個參照的操作位置})。
+    外鍵欄位的 ref 必須是同一批次新增的人孔。
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations 必須為非空陣列")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f"單次最多 {MAX_BATCH_OPERATIONS} 個操作")
+    groups = {}
+    refs = {} # ref → 圖層
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise ValueError(f"第 {index} 個操作格式錯誤")
+        op = operation.get('op')
+        model = LAYER_MODELS.get(operation.get('layer'))
+        if op not in BATCH_OPERATIONS or model is None:
+            raise ValueError(f"第 {index} 個操作的 op 或 layer 不正確")
+        if op == 'create':
+            data = operation.get('data')
+            if not isinstance(data, dict) or 'geom' not in data:
+                raise ValueError(f"第 {index} 個操作缺少 data.geom")
+            ref = operation.get('ref')
+            if ref is not None:
+                if ref in refs:
+                    raise ValueError(f"ref 重複: {ref}")
+                refs[ref] = model
+        else:
+            if not isinstance(operation.get('id'), int):
+                raise ValueError(f"第 {index} 個操作缺少整數 id")
+            if op == 'update' and not isinstance(operation.get('data'), dict):
+                raise ValueError(f"第 {index} 個操作缺少 data")
+        if op != 'delete':
+            nulls = non_nullable_fields(model, operation['data'])
+            if nulls:
+                raise ValueError(f"第 {index} 個操作的 {', '.join(nulls)} 不可為 null")
+        groups.setdefault((model, op), []).append((index, operation))
+
+    # 新增的 ref 可以在操作列表的任何位置，因此全部讀完後再檢查外鍵欄位
+    manhole_ids = {}
+    for index, operation in enumerate(operations):
+        for name, value in (operation.get('data') or {}).items():
+            if not name.endswith('_manhole_id') or value is None:
+                continue
+            if isinstance(value, str):
+                if refs.get(value) is not Manhole:
+                    raise ValueError(f"第 {index} 個操作的 {name} 參照的 {value} 不是同一批次新增的人孔")
+            elif isinstance(value, int) and not isinstance(value, bool):
+                manhole_ids.setdefault(value, index)
             else:
-                manhole.calculated_water_level = manhole.bottom_elevation
+                raise ValueError(f"第 {index} 個操作的 {name} 必須為人孔 id 或 ref")
+    return groups, manhole_ids
+
+def check_manholes_exist(manhole_ids):
+    """manhole_ids: {人孔 id: 操作位置}；外鍵參照不存在的人孔時指出第一個出錯的操作"""
+    if not manhole_ids:
+        return
+    existing = set(db.session.execute(db.select(Manhole.id).where(Manhole.id.in_(list(manhole_ids)))).scalars())
+    missing = sorted((index, manhole_id) for manhole_id, index in manhole_ids.items() if manhole_id not in existing)
+    if missing:
+        index, manhole_id = missing[0]
+        raise ValueError(f"第 {index} 個操作參照的人孔 {manhole_id} 不存在")
+
+def feature_values(model, data, revision, refs):
+    """
+    將操作的 data 轉為欄位值。外鍵欄位可填同一批次新增人孔的 ref 字串，
+    geom 為 GeoJSON 幾何，轉為 WKT 寫入，並同時量測長度或面積。
+    """
+    unknown = set(data) - set(model.editable_fields) - {'geom'}
+    if unknown:
+        raise ValueError(f"{model.__tablename__} 不支援的欄位: {', '.join(sorted(unknown))}")
+    values = {name: value for name, value in data.items() if name != 'geom'}
+    for name in values:
+        if name.endswith('_manhole_id') and isinstance(values[name], str):
+            if values[name] not in refs:
+                raise ValueError(f"找不到 ref: {values[name]}")
+            values[name] = refs[values[name]]
+    if 'geom' in data:
+        geometry = shape(data['geom'])
+        values['geom'] = wkt_dumps(geometry)
+        for column, measured in geometry_measurements(model, [geometry]).items():
+            values[column] = float(measured[0])
+    values['revision'] = revision
+    return values
+
+def apply_batch(operations):
+    """
+    在目前的交易中套用批次操作：依圖層分組後，新增以一次多列 INSERT ... RETURNING、
+    修改以依主鍵的 executemany UPDATE、刪除以 DELETE ... WHERE id IN 完成。
+    回傳 (管網版本, 各操作結果 (依輸入順序))。
+    """
+    groups, manhole_ids = parse_batch_operations(operations)
+    check_manholes_exist(manhole_ids)
+    revision = bump_network_revision()
+    results = [None] * len(operations)
+    refs = {}
+    geometry_edits = {model: {} for model in CREATE_ORDER} # {要素 id: 操作提供的欄位}
+
+    # 修改與刪除前先確認要素存在，原本連結的人孔列為待重算
+    for model in CREATE_ORDER:
+        ids = {operation['id'] for op in ('update', 'delete') for _, operation in groups.get((model, op), [])}
+        if not ids:
+            continue
+        old_keys = load_feature_keys(model, model.id.in_(ids))
+        missing = ids - {row.id for row in old_keys}
+        if missing:
+            raise BatchNotFound(f"{model.__tablename__} 找不到 id: {', '.join(map(str, sorted(missing)))}")
+        touch_linked_manholes(model, old_keys, revision)
+
+    for model in CREATE_ORDER:
+        creates = groups.get((model, 'create'), [])
+        if not creates:
+            continue
+        defaults = {name: column_default(model.__table__.c[name]) for name in model.editable_fields}
+        defaults['name'] = NEW_FEATURE_NAMES[model.__tablename__]
+        rows = [{**defaults, **feature_values(model, operation['data'], revision, refs)} for _, operation in creates]
+        ids = db.session.execute(db.insert(model).returning(model.id, sort_by_parameter_order=True), rows).scalars().all()
+        for (index, operation), feature_id in zip(creates, ids):
+            geometry_edits[model][feature_id] = set(operation['data'])
+            if operation.get('ref') is not None:
+                refs[operation['ref']] = feature_id
+            results[index] = {'op': 'create', 'layer': model.__tablename__, 'id': feature_id, 'ref': operation.get('ref')}
+
+    for model in CREATE_ORDER:
+        updates = groups.get((model, 'update'), [])
+        if not updates:
+            continue
+        merged = {}
+        for index, operation in updates:
+            merged.setdefault(operation['id'], {}).update(feature_values(model, operation['data'], revision, refs))
+            geometry_edits[model].setdefault(operation['id'], set()).update(operation['data'])
+            results[index] = {'op': 'update', 'layer': model.__tablename__, 'id': operation['id']}
+        db.session.execute(db.update(model), [{'id': feature_id, **values} for feature_id, values in merged.items()])
 
-            manhole.is_overflow = manhole.calculated_water_level > manhole.overflow_elevation
-            
-            db.session.add(manhole) 
+    for model in DELETE_ORDER:
+        deletes = groups.get((model, 'delete'), [])
+        if not deletes:
+            continue
+        ids = sorted({operation['id'] for _, operation in deletes})
+        if model is Manhole:
+            touch_manhole_references(ids, revision)
+        record_deletions(model, ids, revision)
+        db.session.execute(db.delete(model).where(model.id.in_(ids)))
+        for index, operation in deletes:
+            results[index] = {'op': 'delete', 'layer': model.__tablename__, 'id': operation['id']}
 
+    # 新增或修改幾何的要素自動連結拓撲 (已刪除的要素不會被查到)
+    for model in CREATE_ORDER:
+        auto_connect(model, geometry_edits[model], revision)
+    return revision, results
+
+@app.route('/api/batch', methods=['POST'])
+def batch_edit():
+    """
+    批次編輯，請求格式：
+    {"operations": [
+        {"op": "create", "layer": "manholes", "ref": "m1", "data": {"name": "...", "geom": {...}}},
+        {"op": "create", "layer": "pipelines", "data": {"from_manhole_id": "m1", "to_manhole_id": 12, "geom": {...}}},
+        {"op": "update", "layer": "pipelines", "id": 5, "data": {"geom": {...}}},
+        {"op": "delete", "layer": "catchment_areas", "id": 3}
+    ]}
+    所有操作在同一交易中完成 (新增 → 修改 → 刪除)，任何一個失敗則全部取消。
+    外鍵欄位可使用同一批次新增人孔的 ref。回傳新的管網版本與各操作的要素 id。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        revision, results = apply_batch(data.get('operations'))
         db.session.commit()
+    except BatchNotFound as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 404
+    except (ValueError, TypeError, KeyError) as e:
+        db.session.rollback()
+        return jsonify({"message": f"批次操作格式錯誤: {str(e)}"}), 400
+    except Exception as e:
+        db.session.rollback()
+        print("批次編輯失敗:")
+        traceback.print_exc()
+        return jsonify({"message": f"批次編輯失敗: {str(e)}"}), 500
+    return jsonify({'revision': revision, 'results': results})
 
-        updated_manholes = Manhole.query.all()
-        updated_pipelines = Pipeline.query.all()
-        updated_catchment_areas = CatchmentArea.query.all()
+# ==============================================================================
+# 批次匯入與匯出 (GeoPackage / Shapefile / GeoJSON)
+# ==============================================================================
 
-        return jsonify({
-            "message": "模擬執行成功！",
-            "manholes": [mh.to_dict() for mh in updated_manholes],
-            "pipelines": [pl.to_dict() for pl in updated_pipelines],
-            "catchment_areas": [ca.to_dict() for ca in updated_catchment_areas]
-        })
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_DEFAULT_NAMES = {'manholes': '匯入人孔', 'pipelines': '匯入管線', 'catchment_areas': '匯入集水區'}
+EXPORT_FIELD_TYPES = {int: 'int', float: 'float', str: 'str', bool: 'bool'}
+
+def column_default(column):
+    default = column.default
+    return default.arg if default is not None and default.is_scalar else None
+
+COPY_NULL = r'\N'
+
+def copy_rows(model, columns, rows):
+    """
+    以 PostgreSQL COPY 將多筆資料列寫入資料表，與目前的 session 同一交易。
+    CSV 格式預設將空欄位視為 NULL，因此 None 改寫為 \\N，空字串才會保留為空字串。
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([COPY_NULL if value is None else value for value in row] for row in rows)
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN "
+                           f"WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+    finally:
+        cursor.close()
+
+def load_manhole_points_utm():
+    """所有人孔的 id、UTM 座標點與所用的 UTM 帶 EPSG 代碼 (供端點吸附，管線須轉換到同一個帶)"""
+    rows = db.session.execute(db.select(Manhole.id, Manhole.geom)).all()
+    ids = np.array([row.id for row in rows], dtype=np.int64)
+    geometries = geometries_from_elements([row.geom for row in rows])
+    epsg = utm_epsg_for_extent(geometries)
+    return ids, transform_geometries_to_utm(geometries, epsg), epsg
+
+def resolve_field_map(model, field_map, source_fields):
+    """
+    檔案中沒有的來源屬性，若為本服務匯出 Shapefile 時的短名稱 (欄位名稱超過 10 字元時截斷)，
+    改用短名稱讀取，讓匯出的 Shapefile 可以直接匯入
+    """
+    short_names = shapefile_field_names(model.serialize_fields)
+    return {field: short_names[source] if source not in source_fields and short_names.get(source) in source_fields
+            else source for field, source in field_map.items()}
+
+def import_features(model, path, source_layer, field_map, snap_tolerance_m):
+    """
+    分批讀取向量檔並以 COPY 寫入圖層，所有要素共用一個新的管網版本。
+    管線未提供起迄人孔時，將端點吸附到 snap_tolerance_m 公尺內最近的人孔。
+    回傳匯入摘要。
+    """
+    table = model.__tablename__
+    fields = model.editable_fields
+    defaults = {field: column_default(model.__table__.c[field]) for field in fields}
+    defaults['name'] = IMPORT_DEFAULT_NAMES[table]
+    measured_columns = list(geometry_measurements(model, []))
+    columns = list(fields) + measured_columns + ['geom', 'revision']
+    revision = bump_network_revision()
+
+    snap = model is Pipeline and snap_tolerance_m > 0
+    if snap:
+        manhole_ids, manhole_points, epsg = load_manhole_points_utm()
+    imported = skipped = snapped = 0
+    for geometries, properties in read_feature_chunks(path, source_layer, IMPORT_CHUNK_SIZE):
+        geometries, properties, chunk_skipped = explode_geometries(geometries, properties, LAYER_GEOMETRY_TYPES[table])
+        skipped += chunk_skipped
+        if not len(geometries):
+            continue
+        values = {field: [props.get(source) for props in properties] for field, source in field_map.items()}
+        if snap:
+            from_index, to_index = snap_pipe_endpoints(
+                transform_geometries_to_utm(geometries, epsg), manhole_points, snap_tolerance_m)
+            for field, index in (('from_manhole_id', from_index), ('to_manhole_id', to_index)):
+                provided = values.get(field, [None] * len(geometries))
+                filled = [manhole_ids[i].item() if value is None and i >= 0 else value
+                          for value, i in zip(provided, index)]
+                snapped += sum(value is None and i >= 0 for value, i in zip(provided, index))
+                values[field] = filled
+
+        measured = [column.tolist() for column in geometry_measurements(model, geometries).values()]
+        wkb = shapely.to_wkb(shapely.set_srid(geometries, 4326), hex=True, include_srid=True)
+        rows = []
+        for k in range(len(geometries)):
+            row = []
+            for field in fields:
+                value = values[field][k] if field in values else None
+                # 屬性表的空白欄位 (Shapefile 字串欄位常見) 視為未提供，使用預設值
+                row.append(defaults[field] if value is None or (isinstance(value, str) and not value.strip())
+                           else value)
+            rows.append(row + [column[k] for column in measured] + [wkb[k], revision])
+        copy_rows(model, columns, rows)
+        imported += len(rows)
+
+    records = load_feature_keys(model, model.revision == revision)
+    # 匯入的人孔連結附近尚未連結的管線與集水區；匯入的集水區指定出流人孔
+    if model is Manhole:
+        auto_connect(model, {record.id: {'geom'} for record in records}, revision)
+    elif model is CatchmentArea:
+        auto_connect(model, {record.id: {'geom'} for record in records if record.outlet_manhole_id is None}, revision)
+    summary = {
+        'layer': table,
+        'imported': imported,
+        'skipped': skipped,
+        'snapped_endpoints': snapped,
+        'revision': revision,
+    }
+    return summary
+
+@app.route('/api/import/<layer>', methods=['POST'])
+def import_layer(layer):
+    """
+    批次匯入要素，multipart/form-data 參數：
+    - file: GeoPackage、GeoJSON 或 zip 壓縮的 Shapefile，座標系依檔案定義轉換為 WGS84
+    - source_layer: 檔案中的圖層名稱 (GeoPackage 有多個圖層時)
+    - field_map: JSON {欄位: 來源屬性名稱}，預設為同名欄位
+    - snap_tolerance_m: 管線端點吸附人孔的容許距離 (公尺)，預設 1，0 表示不吸附
+    整個檔案在同一交易中匯入，任何錯誤都不會留下部分資料。
+    """
+    model = LAYER_MODELS.get(layer)
+    if model is None:
+        return jsonify({"message": f"不支援的圖層: {layer}"}), 404
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({"message": "請上傳 file"}), 400
+    try:
+        field_map = json.loads(request.form.get('field_map') or 'null') or {f: f for f in model.editable_fields}
+    except ValueError:
+        return jsonify({"message": "field_map 必須為 JSON 物件"}), 400
+    if not isinstance(field_map, dict) or set(field_map) - set(model.editable_fields):
+        return jsonify({"message": f"field_map 的欄位必須為 {', '.join(model.editable_fields)} 之一"}), 400
+    snap_tolerance_m = request.form.get('snap_tolerance_m', SNAP_TOLERANCE_M, type=float)
+
+    directory = tempfile.mkdtemp(prefix='hydro-import-')
+    path = os.path.join(directory, os.path.basename(upload.filename))
+    try:
+        upload.save(path)
+        source_layer = request.form.get('source_layer')
+        if source_layer is not None and source_layer not in list_layers(path):
+            return jsonify({"message": f"檔案中找不到圖層 {source_layer}"}), 400
+        field_map = resolve_field_map(model, field_map, layer_fields(path, source_layer))
+        summary = import_features(model, path, source_layer, field_map, snap_tolerance_m)
+        db.session.commit()
+        return jsonify(summary), 201
+    except Exception as e:
+        db.session.rollback()
+        print("匯入失敗:")
+        traceback.print_exc()
+        return jsonify({"message": f"匯入失敗: {str(e)}"}), 500
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def export_chunks(rows, fields, driver):
+    """
+    將查詢結果分批轉為 (GeoJSON 幾何, 屬性) 列表。
+    Shapefile 不支援布林欄位，改寫為 0/1；欄位名稱改為短名稱 (見 shapefile_field_names)。
+    """
+    short_names = shapefile_field_names(fields)
+    chunk = []
+    for row in rows:
+        properties = serialize_feature(row, fields)
+        geometry = properties.pop('geom')
+        if driver == 'ESRI Shapefile':
+            properties = {short_names[k]: int(v) if isinstance(v, bool) else v for k, v in properties.items()}
+        chunk.append((geometry, properties))
+        if len(chunk) >= STREAM_BATCH_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_file(path, directory):
+    """分段輸出檔案內容，輸出完畢後刪除暫存目錄"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                yield block
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@app.route('/api/export/<layer>', methods=['GET'])
+def export_layer(layer):
+    """
+    匯出圖層，format=geojson (預設，直接串流)、gpkg 或 shp (zip)。可加 bbox 只匯出視窗範圍。
+    gpkg/shp 以分批查詢寫入暫存檔後再串流輸出，記憶體用量與圖層大小無關。
+    Shapefile 的欄位名稱超過 10 字元時截斷 (見 shapefile_field_names)，匯入時會自動對應回原欄位。
+    """
+    model = LAYER_MODELS.get(layer)
+    if model is None:
+        return jsonify({"message": f"不支援的圖層: {layer}"}), 404
+    output_format = request.args.get('format', 'geojson')
+    if output_format != 'geojson' and output_format not in EXPORT_DRIVERS:
+        return jsonify({"message": f"不支援的匯出格式: {output_format}"}), 400
+
+    query = model.query.order_by(model.id)
+    bbox_param = request.args.get('bbox')
+    if bbox_param:
+        bbox = parse_bbox(bbox_param)
+        if bbox is None:
+            return jsonify({"message": "bbox 格式錯誤，應為 minx,miny,maxx,maxy"}), 400
+        query = query.filter(bbox_filter(model, bbox))
+    rows = query.yield_per(STREAM_BATCH_SIZE)
+    fields = model.serialize_fields
+
+    if output_format == 'geojson':
+        headers = {'Content-Disposition': f'attachment; filename={layer}.geojson'}
+        body = stream_feature_collection(rows, fields)
+        return Response(stream_with_context(body), mimetype='application/geo+json', headers=headers)
+
+    driver, extension, mimetype = EXPORT_DRIVERS[output_format]
+    field_types = []
+    short_names = shapefile_field_names(fields)
+    for field in fields:
+        field_type = EXPORT_FIELD_TYPES[model.__table__.c[field].type.python_type]
+        if driver == 'ESRI Shapefile':
+            field, field_type = short_names[field], 'int' if field_type == 'bool' else field_type
+        field_types.append((field, field_type))
+    schema = fiona_schema(LAYER_GEOMETRY_TYPES[layer], field_types)
+
+    directory = tempfile.mkdtemp(prefix='hydro-export-')
+    try:
+        path = os.path.join(directory, layer + extension)
+        write_features(path, driver, schema, export_chunks(rows, fields, driver), layer=layer if driver == 'GPKG' else None)
+        if driver == 'ESRI Shapefile':
+            path = zip_shapefile(path)
+    except Exception as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        print("匯出失敗:")
+        traceback.print_exc()
+        return jsonify({"message": f"匯出失敗: {str(e)}"}), 500
+    headers = {
+        'Content-Disposition': f'attachment; filename={os.path.basename(path)}',
+        'Content-Length': str(os.path.getsize(path)),
+    }
+    return Response(stream_file(path, directory), mimetype=mimetype, headers=headers)
+
+# ==============================================================================
+# 模擬端點 - 修正後的版本
+# ==============================================================================
+
+def column_array(objects, attr, default=0.0):
+    """將多個物件的同一欄位取出為 float 陣列，None 以預設值取代"""
+    return np.array([default if getattr(obj, attr) is None else getattr(obj, attr) for obj in objects], dtype=float)
+
+# 模擬結果欄位，寫回時只更新這些欄位
+RESULT_COLUMNS = {
+    'manholes': ('calculated_inflow', 'calculated_water_level', 'is_overflow'),
+    'pipelines': ('calculated_length_m', 'calculated_flow', 'calculated_velocity', 'calculated_depth',
+                  'full_capacity_ratio'),
+    'catchment_areas': ('calculated_area_sq_m', 'calculated_peak_flow'),
+}
+BULK_UPDATE_CHUNK_SIZE = 5000
+
+def load_records(model, *criteria):
+    """
+    以單一 Core 查詢載入整列資料為輕量記錄物件 (不經過 ORM identity map 與變更追蹤)。
+    模擬結果直接寫在記錄上，再以 bulk_update 一次寫回。
+    """
+    stmt = db.select(model.__table__)
+    if criteria:
+        stmt = stmt.where(*criteria)
+    return [SimpleNamespace(**row) for row in db.session.execute(stmt).mappings()]
+
+def bulk_update(model, records, columns, revision=None):
+    """
+    以 UPDATE ... FROM (VALUES ...) 分批寫回多筆記錄的指定欄位。
+    指定 revision 時只更新值有變動的列，將其 revision 設為此版本，並回傳這些列的 id。
+    """
+    table = model.__table__
+    changed_ids = set()
+    for start in range(0, len(records), BULK_UPDATE_CHUNK_SIZE):
+        chunk = records[start:start + BULK_UPDATE_CHUNK_SIZE]
+        results = db.values(
+            db.column('id', db.Integer),
+            *(db.column(name, table.c[name].type) for name in columns),
+            name='results',
+        ).data([(record.id, *(getattr(record, name) for name in columns)) for record in chunk])
+        new_values = {name: db.cast(results.c[name], table.c[name].type) for name in columns}
+        stmt = table.update().where(table.c.id == results.c.id).values(new_values)
+        if revision is not None:
+            stmt = stmt.where(
+                db.tuple_(*(table.c[name] for name in columns)).is_distinct_from(db.tuple_(*new_values.values()))
+            ).values(revision=revision).returning(table.c.id)
+            changed_ids.update(db.session.execute(stmt).scalars())
+        else:
+            db.session.execute(stmt)
+    return changed_ids
+
+def persist_results(model, records, revision):
+    """寫回模擬結果欄位，結果有變動的記錄同步更新 revision，回傳有變動的筆數"""
+    changed_ids = bulk_update(model, records, RESULT_COLUMNS[model.__tablename__], revision)
+    for record in records:
+        if record.id in changed_ids:
+            record.revision = revision
+    return len(changed_ids)
+
+def pipe_parameters(pipelines):
+    """取出管徑、坡度與曼寧 n 陣列"""
+    return (
+        column_array(pipelines, 'diameter'),
+        column_array(pipelines, 'slope'),
+        np.array([get_manning_n(pl.material) for pl in pipelines], dtype=float),
+    )
+
+def stored_measurements(records, column, measure):
+    """
+    取出新增或修改幾何時已儲存的長度或面積，只量測尚未儲存 (NULL) 的記錄，
+    量測值寫在記錄上，隨模擬結果一起寫回。
+    量測方式變更 (例如 HYDRO_UTM_EPSG) 時以 remeasure_geometry.py 重新量測全部要素。
+    """
+    values = column_array(records, column, np.nan)
+    missing = np.flatnonzero(np.isnan(values))
+    if len(missing):
+        values[missing] = measure(geometries_from_elements([records[i].geom for i in missing]))
+        for i in missing.tolist():
+            setattr(records[i], column, float(values[i]))
+    return values
+
+def update_catchment_runoff(catchment_areas):
+    """計算集水區洪峰流量 (Q = C * I * A)，面積沿用已儲存的量測值"""
+    areas_sq_m = stored_measurements(catchment_areas, 'calculated_area_sq_m', measure_areas)
+    peak_flows = calculate_rational_peak_flows(
+        areas_sq_m,
+        column_array(catchment_areas, 'runoff_coefficient'),
+        column_array(catchment_areas, 'rainfall_intensity'),
+    )
+    for i, area in enumerate(catchment_areas):
+        area.calculated_peak_flow = float(peak_flows[i])
+
+def route_network(graph, manhole_inflow, outlet_ids, catchment_peak_flows, pipe_params):
+    """
+    將集水區逕流加到排入人孔，再與人孔本地入流一起依拓撲順序往下游累加。
+    多條出流管時依滿管容量比例分流。回傳 (RoutingResult, 已指定排入人孔的集水區遮罩)。
+    """
+    local_inflow = np.array(manhole_inflow, dtype=float)
+    outlet_index = graph.node_index(outlet_ids)
+    assigned = outlet_index >= 0
+    np.add.at(local_inflow, outlet_index[assigned], np.asarray(catchment_peak_flows, dtype=float)[assigned])
+    capacities = calculate_network_hydraulics(*pipe_params, 0.0).capacity
+    return graph.accumulate(local_inflow, split_weights=capacities), assigned
+
+def update_pipe_results(pipelines, pipe_params, routed_flows):
+    """
+    依演算流量計算管線水理並寫入記錄。
+    未連結人孔或位於迴路上的管線 (routed_flows 為 NaN) 無法演算，沿用設計流量。
+    """
+    pipe_flows = np.where(np.isnan(routed_flows), column_array(pipelines, 'design_flow'), routed_flows)
+    hydraulics = calculate_network_hydraulics(*pipe_params, pipe_flows)
+    for i, pipeline in enumerate(pipelines):
+        pipeline.calculated_flow = float(pipe_flows[i])
+        pipeline.calculated_velocity = float(hydraulics.velocity[i])
+        pipeline.calculated_depth = float(hydraulics.depth[i])
+        pipeline.full_capacity_ratio = float(hydraulics.capacity_ratio[i]) * 100
+
+def update_manhole_results(manholes, total_inflow):
+    """以累加後的總入流量計算人孔水位和溢流判斷並寫入記錄"""
+    water_levels, overflows = calculate_manhole_levels(
+        column_array(manholes, 'bottom_elevation'),
+        column_array(manholes, 'overflow_elevation'),
+        column_array(manholes, 'top_elevation'),
+        total_inflow,
+        column_array(manholes, 'design_flow_limit'),
+    )
+    for i, manhole in enumerate(manholes):
+        manhole.calculated_inflow = float(total_inflow[i])
+        manhole.calculated_water_level = float(water_levels[i])
+        manhole.is_overflow = bool(overflows[i])
+
+def build_network_graph(manholes, pipelines):
+    return NetworkGraph(
+        [mh.id for mh in manholes],
+        [pl.id for pl in pipelines],
+        [pl.from_manhole_id for pl in pipelines],
+        [pl.to_manhole_id for pl in pipelines],
+    )
+
+def network_summary(graph, assigned):
+    summary = graph.summary()
+    summary['unassigned_catchment_count'] = int(np.count_nonzero(~assigned))
+    return summary
+
+def no_progress(stage, fraction):
+    pass
+
+def simulate_full(progress=no_progress):
+    """完整模擬：重算所有集水區、管線與人孔"""
+    progress('loading', 0.0)
+    manholes = load_records(Manhole)
+    pipelines = load_records(Pipeline)
+    catchment_areas = load_records(CatchmentArea)
+
+    # 1. 計算集水區洪峰流量和面積
+    progress('catchment_runoff', 0.2)
+    update_catchment_runoff(catchment_areas)
+
+    # 2. 建立管網拓撲，將集水區逕流與人孔本地入流依拓撲順序往下游累加
+    progress('routing', 0.35)
+    graph = build_network_graph(manholes, pipelines)
+    pipe_params = pipe_parameters(pipelines)
+    routing, assigned = route_network(
+        graph,
+        column_array(manholes, 'inflow'),
+        [ca.outlet_manhole_id for ca in catchment_areas],
+        column_array(catchment_areas, 'calculated_peak_flow'),
+        pipe_params,
+    )
+
+    # 3. 管道水理計算和長度 (整個管網一次向量化計算)
+    progress('pipe_hydraulics', 0.5)
+    stored_measurements(pipelines, 'calculated_length_m', measure_lengths)
+    update_pipe_results(pipelines, pipe_params, routing.pipe_flow)
+
+    # 4. 人孔水位和溢流判斷
+    progress('manhole_overflow', 0.65)
+    update_manhole_results(manholes, routing.node_inflow)
+
+    return {
+        "mode": "full",
+        "network": network_summary(graph, assigned),
+        "manholes": manholes,
+        "pipelines": pipelines,
+        "catchment_areas": catchment_areas,
+    }
+
+def simulate_incremental(dirty, progress=no_progress):
+    """
+    增量模擬：只重算被編輯的集水區與管線，以及受影響人孔的下游子網路。
+    拓撲與流量累加只讀取不含幾何的輕量欄位，整網累加為 O(V+E) 的陣列運算；
+    幾何量測、水理計算與寫回只針對受影響的要素。
+    """
+    progress('loading', 0.0)
+    manhole_rows = db.session.query(Manhole.id, Manhole.inflow).all()
+    pipe_rows = db.session.query(
+        Pipeline.id, Pipeline.from_manhole_id, Pipeline.to_manhole_id,
+        Pipeline.diameter, Pipeline.slope, Pipeline.material, Pipeline.design_flow,
+    ).all()
+    catchment_rows = db.session.query(
+        CatchmentArea.id, CatchmentArea.outlet_manhole_id, CatchmentArea.calculated_peak_flow,
+    ).all()
+
+    # 1. 只重算被編輯的集水區
+    progress('catchment_runoff', 0.2)
+    changed_catchments = load_records(CatchmentArea, CatchmentArea.id.in_(dirty.catchment_areas))
+    update_catchment_runoff(changed_catchments)
+    peak_flows = column_array(catchment_rows, 'calculated_peak_flow')
+    catchment_index = {row.id: i for i, row in enumerate(catchment_rows)}
+    for area in changed_catchments:
+        peak_flows[catchment_index[area.id]] = area.calculated_peak_flow
+
+    # 2. 找出受影響的人孔 (被編輯的人孔、被編輯集水區的排入人孔、被編輯管線的起迄人孔) 及其下游
+    progress('routing', 0.35)
+    graph = build_network_graph(manhole_rows, pipe_rows)
+    seed_ids = set(dirty.manholes)
+    seed_ids.update(area.outlet_manhole_id for area in changed_catchments)
+    for row in pipe_rows:
+        if row.id in dirty.pipelines:
+            seed_ids.update((row.from_manhole_id, row.to_manhole_id))
+    affected_nodes = graph.downstream_closure(graph.node_index(list(seed_ids)))
+
+    pipe_params = pipe_parameters(pipe_rows)
+    routing, assigned = route_network(
+        graph,
+        column_array(manhole_rows, 'inflow'),
+        [row.outlet_manhole_id for row in catchment_rows],
+        peak_flows,
+        pipe_params,
+    )
+
+    # 3. 受影響的管線：起點在受影響人孔上，或本身被編輯過
+    progress('pipe_hydraulics', 0.5)
+    from_index = graph.node_index([row.from_manhole_id for row in pipe_rows])
+    affected_pipes = np.array([row.id in dirty.pipelines for row in pipe_rows], dtype=bool)
+    affected_pipes |= (from_index >= 0) & affected_nodes[np.maximum(from_index, 0)]
+    pipe_positions = np.flatnonzero(affected_pipes)
+    pipe_by_id = {pl.id: pl for pl in load_records(
+        Pipeline, Pipeline.id.in_([pipe_rows[i].id for i in pipe_positions]))}
+    pipelines = [pipe_by_id[pipe_rows[i].id] for i in pipe_positions]
+    update_pipe_results(pipelines, tuple(p[pipe_positions] for p in pipe_params), routing.pipe_flow[pipe_positions])
+    # 長度在編輯幾何時已儲存，只量測尚未儲存者
+    stored_measurements(pipelines, 'calculated_length_m', measure_lengths)
+
+    # 4. 受影響的人孔水位和溢流判斷
+    progress('manhole_overflow', 0.65)
+    node_positions = np.flatnonzero(affected_nodes)
+    manhole_by_id = {mh.id: mh for mh in load_records(
+        Manhole, Manhole.id.in_(graph.manhole_ids[node_positions].tolist()))}
+    manholes = [manhole_by_id[i] for i in graph.manhole_ids[node_positions].tolist()]
+    update_manhole_results(manholes, routing.node_inflow[node_positions])
+
+    return {
+        "mode": "incremental",
+        "network": network_summary(graph, assigned),
+        "manholes": manholes,
+        "pipelines": pipelines,
+        "catchment_areas": changed_catchments,
+    }
+
+# 時序模擬的時間步數上限 (降雨加退水)，歷線陣列為 (要素數, 時間步數)，避免過細的步長耗盡記憶體
+MAX_TIMESERIES_STEPS = int(os.environ.get('HYDRO_MAX_TIMESERIES_STEPS', 20000))
+
+def check_timeseries_steps(steps):
+    if steps > MAX_TIMESERIES_STEPS:
+        raise ValueError(f"時間步數 {steps} 超過上限 {MAX_TIMESERIES_STEPS}，請加大 time_step_min 或縮短延時")
+
+def parse_hyetograph(rainfall):
+    """
+    解析設計雨型，回傳 (每步降雨強度 mm/hr 陣列, 時間步長分鐘)。
+    - {"hyetograph": [...], "time_step_min": 1}：直接指定每個時間步的降雨強度
+    - {"idf": {"a": ..., "b": ..., "c": ...}, "duration_min": 1440, "time_step_min": 1, "peak_position": 0.5}：
+      由 IDF 曲線 i = a / (t + b)^c 以交替區塊法產生
+    """
+    time_step_min = float(rainfall.get('time_step_min', 1))
+    if not time_step_min > 0:
+        raise ValueError("time_step_min 必須大於 0")
+    if 'hyetograph' in rainfall:
+        hyetograph = np.asarray(rainfall['hyetograph'], dtype=float)
+    elif 'idf' in rainfall:
+        idf = rainfall['idf']
+        duration_min = float(rainfall.get('duration_min', 1440))
+        check_timeseries_steps(round(duration_min / time_step_min)) # 產生雨型前先檢查
+        hyetograph = alternating_block_hyetograph(
+            float(idf['a']), float(idf.get('b', 0.0)), float(idf.get('c', 1.0)),
+            duration_min, time_step_min,
+            float(rainfall.get('peak_position', 0.5)),
+        )
+    else:
+        raise ValueError("rainfall 需提供 hyetograph 或 idf")
+    if hyetograph.ndim != 1 or len(hyetograph) == 0 or np.any(hyetograph < 0):
+        raise ValueError("hyetograph 必須為非負的降雨強度序列")
+    return hyetograph, time_step_min
+
+def parse_timeseries_options(options):
+    """解析並檢查時序模擬參數，回傳 (降雨強度陣列, 時間步長分鐘, 退水步數)"""
+    hyetograph, time_step_min = parse_hyetograph(options.get('rainfall') or {})
+    recession_min = float(options.get('recession_min', 120))
+    if recession_min < 0:
+        raise ValueError("recession_min 不可為負")
+    recession_steps = int(math.ceil(recession_min / time_step_min))
+    check_timeseries_steps(len(hyetograph) + recession_steps)
+    return hyetograph, time_step_min, recession_steps
+
+def simulate_timeseries(options, progress=no_progress):
+    """
+    時序降雨模擬：依設計雨型計算各集水區逕流歷線 (三角形單位歷線)，
+    再以 Muskingum 法將人孔入流歷線逐層往下游演算。結果不寫回資料庫。
+    options:
+    - rainfall: 設計雨型 (見 parse_hyetograph)
+    - time_of_concentration_min: 集流時間，預設 15 分鐘
+    - recession_min: 降雨結束後繼續演算的時間，預設 120 分鐘
+    - muskingum_x: Muskingum X 值，預設 0.2
+    - include_hydrographs: 是否回傳各要素完整歷線，預設 false
+    """
+    hyetograph, time_step_min, recession_steps = parse_timeseries_options(options)
+    steps = len(hyetograph) + recession_steps
+    rainfall_series = np.pad(hyetograph, (0, recession_steps))
+    include_hydrographs = bool(options.get('include_hydrographs', False))
+
+    progress('loading', 0.0)
+    manholes = load_records(Manhole)
+    pipelines = load_records(Pipeline)
+    catchment_areas = load_records(CatchmentArea)
+
+    # 1. 集水區逕流歷線
+    progress('catchment_runoff', 0.2)
+    areas_sq_m = stored_measurements(catchment_areas, 'calculated_area_sq_m', measure_areas)
+    unit_hydrograph = triangular_unit_hydrograph(float(options.get('time_of_concentration_min', 15)), time_step_min)
+    runoff = catchment_runoff_hydrographs(
+        areas_sq_m, column_array(catchment_areas, 'runoff_coefficient'), rainfall_series, unit_hydrograph, steps)
+
+    # 2. 人孔本地入流歷線 = 基流 + 排入的集水區逕流
+    progress('routing', 0.35)
+    graph = build_network_graph(manholes, pipelines)
+    local_inflow = np.repeat(column_array(manholes, 'inflow')[:, None], steps, axis=1)
+    outlet_index = graph.node_index([ca.outlet_manhole_id for ca in catchment_areas])
+    assigned = outlet_index >= 0
+    np.add.at(local_inflow, outlet_index[assigned], runoff[assigned])
+
+    # 3. 管線 Muskingum 演算，K 值取滿管流速下的流經時間
+    pipe_params = pipe_parameters(pipelines)
+    capacities = calculate_network_hydraulics(*pipe_params, 0.0).capacity
+    area_full = np.pi * (pipe_params[0] / 2) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        full_velocity = np.where(area_full > 0, capacities / area_full, 0.0)
+    lengths_m = stored_measurements(pipelines, 'calculated_length_m', measure_lengths)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        travel_time_s = np.where(full_velocity > 0, lengths_m / full_velocity, 0.0)
+    routed = route_hydrographs(graph, local_inflow, travel_time_s, time_step_min * 60, capacities,
+                               float(options.get('muskingum_x', 0.2)))
+
+    # 未連結人孔或位於迴路上的管線無法演算，沿用設計流量
+    unrouted = np.isnan(routed.pipe_inflow[:, 0]) if steps else np.zeros(len(pipelines), dtype=bool)
+    pipe_series = np.where(unrouted[:, None], column_array(pipelines, 'design_flow')[:, None], routed.pipe_inflow)
+
+    # 4. 洪峰值與洪峰時間，並以洪峰流量檢核管線與人孔
+    progress('pipe_hydraulics', 0.7)
+    pipe_peaks, pipe_peak_times = peak_and_time(pipe_series, time_step_min)
+    hydraulics = calculate_network_hydraulics(*pipe_params, pipe_peaks)
+    node_peaks, node_peak_times = peak_and_time(routed.node_inflow, time_step_min)
+    water_levels, overflows = calculate_manhole_levels(
+        column_array(manholes, 'bottom_elevation'),
+        column_array(manholes, 'overflow_elevation'),
+        column_array(manholes, 'top_elevation'),
+        node_peaks,
+        column_array(manholes, 'design_flow_limit'),
+    )
+    runoff_peaks, runoff_peak_times = peak_and_time(runoff, time_step_min)
+    progress('serializing', 0.9)
+
+    def feature_results(records, columns, series):
+        results = []
+        for i, record in enumerate(records):
+            item = {'id': record.id}
+            item.update({name: values[i].item() for name, values in columns.items()})
+            if include_hydrographs:
+                item['hydrograph'] = series[i].tolist()
+            results.append(item)
+        return results
+
+    return {
+        "mode": "timeseries",
+        "time_step_min": time_step_min,
+        "steps": steps,
+        "rainfall": rainfall_series.tolist(),
+        "network": network_summary(graph, assigned),
+        "manholes": feature_results(manholes, {
+            'peak_inflow': node_peaks,
+            'peak_time_min': node_peak_times,
+            'max_water_level': water_levels,
+            'is_overflow': overflows,
+        }, routed.node_inflow),
+        "pipelines": feature_results(pipelines, {
+            'peak_flow': pipe_peaks,
+            'peak_time_min': pipe_peak_times,
+            'max_velocity': hydraulics.velocity,
+            'max_depth': hydraulics.depth,
+            'max_full_capacity_ratio': hydraulics.capacity_ratio * 100,
+        }, pipe_series),
+        "catchment_areas": feature_results(catchment_areas, {
+            'peak_flow': runoff_peaks,
+            'peak_time_min': runoff_peak_times,
+        }, runoff),
+    }
+
+def run_steady_simulation(mode, progress=no_progress):
+    """
+    執行穩態模擬 (full 或 incremental)，寫回結果並回傳 (回應內容, 結果對應的管網版本)。
+    增量模擬的重算起點為上次模擬後版本有變動的要素；尚未完整模擬過時改為完整模擬。
+    結果與資料庫內容相同時不遞增管網版本；模擬期間有其他編輯寫入時，結果對應的版本為 None (不快取)。
+    """
+    start_revision, simulated_revision = load_simulation_state()
+    if mode == 'incremental' and simulated_revision is not None:
+        result = simulate_incremental(load_dirty_set(simulated_revision), progress)
+    else:
+        result = simulate_full(progress)
+
+    # 每個資料表以一次 UPDATE ... FROM (VALUES ...) 寫回
+    progress('persisting', 0.8)
+    revision = bump_network_revision()
+    changed = sum(persist_results(model, result[model.__tablename__], revision)
+                  for model in (Manhole, Pipeline, CatchmentArea))
+    if changed:
+        # 模擬期間沒有其他編輯時，結果涵蓋到寫回後的版本；否則只涵蓋到開始時的版本，
+        # 期間的編輯 (版本較大) 留待下次增量模擬
+        result_revision = revision if revision == start_revision + 1 else None
+        mark_simulated(revision if result_revision is not None else start_revision)
+    else:
+        # 結果與資料庫相同：取消版本遞增，既有快取與前端已同步的版本都仍然有效
+        db.session.rollback()
+        result_revision = start_revision if current_network_revision() == start_revision else None
+        mark_simulated(start_revision)
+    db.session.commit()
+
+    # 回應直接由記憶體中的模擬結果產生，不再重新查詢
+    progress('serializing', 0.9)
+    return {
+        "message": "模擬執行成功！",
+        "mode": result['mode'],
+        "base_revision": start_revision, # 模擬開始時的管網版本
+        "revision": revision if changed else start_revision, # 寫回後的管網版本
+        "network": result['network'],
+        "manholes": serialize_features(result['manholes'], Manhole.serialize_fields),
+        "pipelines": serialize_features(result['pipelines'], Pipeline.serialize_fields),
+        "catchment_areas": serialize_features(result['catchment_areas'], CatchmentArea.serialize_fields)
+    }, result_revision
+
+SIMULATION_MODES = ('full', 'incremental', 'timeseries')
+
+def run_simulation(options, progress=no_progress):
+    """依 options['mode'] 執行模擬並回傳 JSON 回應 (bytes)，同步端點與背景工作共用，並記錄各階段耗時"""
+    if not METRICS_ENABLED:
+        return build_simulation_body(options, progress)
+    timer = PhaseTimer(progress)
+    try:
+        return build_simulation_body(options, timer)
+    finally:
+        mode = options.get('mode', 'full')
+        record_phases(mode if mode in SIMULATION_MODES else 'other', timer.stop())
+
+def build_simulation_body(options, progress):
+    """
+    執行模擬並產生 JSON 回應 (bytes)。
+    管網版本未變時直接回傳快取結果，不重新量測與計算。
+    穩態模擬寫回有變動的結果時會遞增版本，因此結果以寫回後的版本快取：
+    之後沒有任何編輯時，重跑模擬的結果與寫回內容都會相同。
+    """
+    mode = options.get('mode', 'full')
+    revision = current_network_revision()
+    cached = result_cache.get(cache_key(revision, 'simulate', options))
+    if cached is not None:
+        progress('cached', 1.0)
+        return cached
+
+    if mode == 'timeseries':
+        body = json_body(simulate_timeseries(options, progress))
+        result_cache.put(cache_key(revision, 'simulate', options), body)
+        return body
+
+    result, result_revision = run_steady_simulation(mode, progress)
+    body = json_body(result)
+    # 模擬期間若有其他編輯寫入，結果不一定對應任何一個版本，不快取
+    if result_revision is not None:
+        result_cache.put(cache_key(result_revision, 'simulate', options), body)
+    return body
+
+@app.route('/api/simulate', methods=['POST'])
+def simulate_hydraulics():
+    """
+    執行水理模擬。
+    mode=full (預設) 重算整個管網；mode=incremental 只重算上次模擬後被編輯的要素及其下游，
+    回應中只包含有變動的要素。尚未執行過完整模擬時，增量模式會自動改為完整模擬。
+    mode=timeseries 依設計雨型做時序演算，回傳各要素洪峰與歷線，不寫回資料庫。
+    大型管網建議改用 POST /api/jobs/simulate 在背景執行。
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"message": "請求內容必須為 JSON 物件"}), 400
+    payload.setdefault('mode', request.args.get('mode', 'full'))
+    if payload['mode'] not in SIMULATION_MODES:
+        return jsonify({"message": f"不支援的模擬模式: {payload['mode']}"}), 400
+    if payload['mode'] == 'timeseries':
+        try:
+            parse_timeseries_options(payload) # 參數錯誤或步數過多時不查詢資料庫
+            return Response(run_simulation(payload), mimetype='application/json')
+        except (ValueError, KeyError, TypeError) as e:
+            db.session.rollback()
+            return jsonify({"message": f"時序模擬參數錯誤: {str(e)}"}), 400
+        except Exception as e:
+            db.session.rollback()
+            print("時序模擬失敗:")
+            traceback.print_exc()
+            return jsonify({"message": f"時序模擬失敗: {str(e)}"}), 500
+    try:
+        return Response(run_simulation(payload), mimetype='application/json')
 
     except Exception as e:
         db.session.rollback()
@@ -337,5 +1943,339 @@ def simulate_hydraulics():
         traceback.print_exc() 
         return jsonify({"message": f"模擬執行失敗: {str(e)}"}), 500
 
+# ==============================================================================
+# 多情境批次模擬
+# ==============================================================================
+
+MAX_BATCH_SCENARIOS = 200
+
+def simulate_scenarios(scenarios):
+    """
+    一次計算多個情境的穩態模擬。所有情境疊成 (要素數, 情境數) 陣列，
+    集水區逕流、管網累加、管線水理與人孔水位都只各做一次陣列運算。
+    回傳每個情境的 (摘要, 完整結果)。
+    """
+    manholes = load_records(Manhole)
+    pipelines = load_records(Pipeline)
+    catchment_areas = load_records(CatchmentArea)
+
+    # 1. 各情境的集水區洪峰流量 (集水區數, 情境數)
+    areas_sq_m = stored_measurements(catchment_areas, 'calculated_area_sq_m', measure_areas)
+    runoff_coefficients, rainfall_intensities = stack_catchment_parameters(
+        [ca.id for ca in catchment_areas],
+        column_array(catchment_areas, 'runoff_coefficient'),
+        column_array(catchment_areas, 'rainfall_intensity'),
+        scenarios,
+    )
+    peak_flows = calculate_rational_peak_flows(areas_sq_m[:, None], runoff_coefficients, rainfall_intensities)
+
+    # 2. 所有情境一起往下游累加
+    count = len(scenarios)
+    graph = build_network_graph(manholes, pipelines)
+    pipe_params = pipe_parameters(pipelines)
+    routing, _ = route_network(
+        graph,
+        np.repeat(column_array(manholes, 'inflow')[:, None], count, axis=1),
+        [ca.outlet_manhole_id for ca in catchment_areas],
+        peak_flows,
+        pipe_params,
+    )
+
+    # 3. 管線水理與人孔水位
+    pipe_flows = np.where(np.isnan(routing.pipe_flow), column_array(pipelines, 'design_flow')[:, None],
+                          routing.pipe_flow)
+    hydraulics = calculate_network_hydraulics(*(p[:, None] for p in pipe_params), pipe_flows)
+    full_capacity_ratio = hydraulics.capacity_ratio * 100
+    water_levels, overflows = calculate_manhole_levels(
+        column_array(manholes, 'bottom_elevation')[:, None],
+        column_array(manholes, 'overflow_elevation')[:, None],
+        column_array(manholes, 'top_elevation')[:, None],
+        routing.node_inflow,
+        column_array(manholes, 'design_flow_limit')[:, None],
+    )
+
+    manhole_ids = [mh.id for mh in manholes]
+    pipeline_ids = [pl.id for pl in pipelines]
+    catchment_ids = [ca.id for ca in catchment_areas]
+    outcomes = []
+    for s in range(count):
+        summary = summarize_scenario(manhole_ids, overflows[:, s], routing.node_inflow[:, s],
+                                     full_capacity_ratio[:, s], peak_flows[:, s])
+        results = {
+            'manholes': {
+                'id': manhole_ids,
+                'calculated_inflow': routing.node_inflow[:, s].tolist(),
+                'calculated_water_level': water_levels[:, s].tolist(),
+                'is_overflow': overflows[:, s].tolist(),
+            },
+            'pipelines': {
+                'id': pipeline_ids,
+                'calculated_flow': pipe_flows[:, s].tolist(),
+                'calculated_velocity': hydraulics.velocity[:, s].tolist(),
+                'calculated_depth': hydraulics.depth[:, s].tolist(),
+                'full_capacity_ratio': full_capacity_ratio[:, s].tolist(),
+            },
+            'catchment_areas': {
+                'id': catchment_ids,
+                'calculated_peak_flow': peak_flows[:, s].tolist(),
+            },
+        }
+        outcomes.append((summary, results))
+    return outcomes
+
+@app.route('/api/scenarios/batch', methods=['POST'])
+def run_scenario_batch():
+    """
+    批次情境模擬，請求格式：{"scenarios": [{"name": "Q50 +20%", "rainfall_factor": 1.2}, ...]}
+    回傳各情境的精簡摘要，完整結果以情境 id 儲存，可由 GET /api/scenarios/<id> 取得。
+    """
+    data = request.get_json(silent=True) or {}
+    scenarios = data.get('scenarios')
+    if not isinstance(scenarios, list) or not scenarios or not all(isinstance(sc, dict) for sc in scenarios):
+        return jsonify({"message": "scenarios 必須為非空的情境參數陣列"}), 400
+    if len(scenarios) > MAX_BATCH_SCENARIOS:
+        return jsonify({"message": f"單次最多 {MAX_BATCH_SCENARIOS} 個情境"}), 400
+
+    try:
+        outcomes = simulate_scenarios(scenarios)
+    except (ValueError, TypeError) as e:
+        return jsonify({"message": f"情境參數錯誤: {str(e)}"}), 400
+
+    try:
+        batch_id = str(uuid.uuid4())
+        records = []
+        for index, (scenario, (summary, results)) in enumerate(zip(scenarios, outcomes)):
+            record = SimulationScenario(
+                batch_id=batch_id,
+                name=scenario.get('name', f'情境 {index + 1}'),
+                parameters=scenario,
+                summary=summary,
+                results=results,
+            )
+            db.session.add(record)
+            records.append(record)
+        db.session.commit()
+        return jsonify({
+            "batch_id": batch_id,
+            "scenarios": [record.to_dict() for record in records],
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        print("情境模擬失敗:")
+        traceback.print_exc()
+        return jsonify({"message": f"情境模擬失敗: {str(e)}"}), 500
+
+@app.route('/api/scenarios', methods=['GET'])
+def get_scenarios():
+    query = SimulationScenario.query.order_by(SimulationScenario.id.desc())
+    batch_id = request.args.get('batch_id')
+    if batch_id:
+        query = query.filter(SimulationScenario.batch_id == batch_id)
+    return jsonify([scenario.to_dict() for scenario in query.all()])
+
+@app.route('/api/scenarios/<int:id>', methods=['GET'])
+def get_scenario(id):
+    scenario = SimulationScenario.query.get_or_404(id)
+    return jsonify(scenario.to_dict(include_results=True))
+
+@app.route('/api/scenarios/<int:id>', methods=['DELETE'])
+def delete_scenario(id):
+    scenario = SimulationScenario.query.get_or_404(id)
+    db.session.delete(scenario)
+    db.session.commit()
+    return '', 204
+
+# ==============================================================================
+# 背景模擬工作
+# ==============================================================================
+
+JOB_STATUS_POLL_SECONDS = 0.5
+# 每個行程定期更新自己排隊中與執行中工作的 heartbeat_at；
+# 超過 JOB_STALE_SECONDS 未更新的工作，所屬行程已經結束，才會被標記為失敗
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('HYDRO_JOB_HEARTBEAT_SECONDS', 15))
+JOB_STALE_SECONDS = float(os.environ.get('HYDRO_JOB_STALE_SECONDS', 120))
+job_queue = JobQueue(max_workers=int(os.environ.get('HYDRO_JOB_WORKERS', 2)))
+_heartbeat_lock = threading.Lock()
+_heartbeat_pid = None
+
+def job_owner():
+    # 每次呼叫時取 pid，預先 fork 的多行程伺服器中每個 worker 各自不同
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def job_dedupe_key(options):
+    """相同參數且管網版本相同的工作視為重複"""
+    key = cache_key(current_network_revision(), 'simulate', options)
+    return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+def update_job(job_id, expected_status=None, **values):
+    """
+    以獨立連線更新工作狀態並立即提交，
+    讓模擬本身的交易尚未提交時，其他請求也能讀到最新進度。
+    指定 expected_status 時只在工作仍為該狀態時更新 (例如已被判定逾時失敗的工作不再改回成功)。
+    """
+    stmt = db.update(SimulationJob).where(SimulationJob.id == job_id).values(**values)
+    if expected_status is not None:
+        stmt = stmt.where(SimulationJob.status == expected_status)
+    with db.engine.begin() as connection:
+        connection.execute(stmt)
+
+def job_heartbeat_loop(owner):
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            with app.app_context(), db.engine.begin() as connection:
+                connection.execute(
+                    db.update(SimulationJob)
+                    .where(SimulationJob.owner == owner, SimulationJob.status.in_(('queued', 'running')))
+                    .values(heartbeat_at=datetime.utcnow()))
+        except Exception:
+            print("更新工作 heartbeat 失敗:")
+            traceback.print_exc()
+
+def start_job_heartbeat():
+    """本行程第一次提交工作時啟動 heartbeat 執行緒 (每個行程一個)"""
+    global _heartbeat_pid
+    with _heartbeat_lock:
+        if _heartbeat_pid == os.getpid():
+            return
+        _heartbeat_pid = os.getpid()
+    threading.Thread(target=job_heartbeat_loop, args=(job_owner(),), daemon=True,
+                     name='hydro-job-heartbeat').start()
+
+def fail_stale_jobs():
+    """
+    heartbeat 逾時的排隊中或執行中工作標記為失敗：所屬行程已經結束，工作不可能完成。
+    其他存活行程的工作會持續更新 heartbeat，不受影響。
+    """
+    deadline = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    SimulationJob.query.filter(
+        SimulationJob.status.in_(('queued', 'running')),
+        db.or_(SimulationJob.heartbeat_at.is_(None), SimulationJob.heartbeat_at < deadline),
+    ).update({'status': 'failed', 'error': '執行工作的服務已停止，工作已中斷', 'finished_at': datetime.utcnow()},
+             synchronize_session=False)
+    db.session.commit()
+
+def execute_simulation_job(job_id):
+    """在背景執行緒中執行模擬工作"""
+    with app.app_context():
+        job = db.session.get(SimulationJob, job_id)
+        options = dict(job.parameters or {})
+        db.session.remove()
+        update_job(job_id, expected_status='queued', status='running', started_at=datetime.utcnow(), stage='queued')
+
+        def report(stage, fraction):
+            update_job(job_id, stage=stage, progress=fraction)
+
+        timings = RequestTimings('job:simulate')
+        token = current_timings.set(timings)
+        try:
+            result = json.loads(run_simulation(options, report))
+            update_job(job_id, expected_status='running', status='succeeded', progress=1.0, stage='done',
+                       result=result, finished_at=datetime.utcnow())
+        except Exception as e:
+            db.session.rollback()
+            print(f"背景模擬工作 {job_id} 失敗:")
+            traceback.print_exc()
+            update_job(job_id, expected_status='running', status='failed', error=str(e),
+                       finished_at=datetime.utcnow())
+        finally:
+            db.session.remove()
+            current_timings.reset(token)
+            if METRICS_ENABLED:
+                record_timings(timings)
+
+@app.route('/api/jobs/simulate', methods=['POST'])
+def submit_simulation_job():
+    """
+    提交背景模擬工作，參數與 POST /api/simulate 相同，立即回傳工作 id (202)。
+    相同參數且管網未再編輯時，若已有排隊或執行中的工作，直接回傳該工作 (200)。
+    進度可輪詢 GET /api/jobs/<id> 或訂閱 GET /api/jobs/<id>/events (Server-Sent Events)。
+    """
+    options = request.get_json(silent=True) or {}
+    if not isinstance(options, dict):
+        return jsonify({"message": "請求內容必須為 JSON 物件"}), 400
+    options.setdefault('mode', request.args.get('mode', 'full'))
+    if options['mode'] not in SIMULATION_MODES:
+        return jsonify({"message": f"不支援的模擬模式: {options['mode']}"}), 400
+    if options['mode'] == 'timeseries':
+        try:
+            parse_timeseries_options(options)
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({"message": f"時序模擬參數錯誤: {str(e)}"}), 400
+
+    try:
+        start_job_heartbeat()
+        fail_stale_jobs()
+        dedupe_key = job_dedupe_key(options)
+
+        def create_job():
+            existing = SimulationJob.query.filter(
+                SimulationJob.dedupe_key == dedupe_key,
+                SimulationJob.status.in_(('queued', 'running'))).first()
+            if existing is not None:
+                return existing.id, False
+            job = SimulationJob(id=str(uuid.uuid4()), parameters=options, dedupe_key=dedupe_key,
+                                owner=job_owner(), heartbeat_at=datetime.utcnow())
+            db.session.add(job)
+            db.session.commit()
+            return job.id, True
+
+        job_id, is_new = job_queue.submit(dedupe_key, create_job, execute_simulation_job)
+        job = db.session.get(SimulationJob, job_id)
+        return jsonify(job.to_dict()), 202 if is_new else 200
+    except Exception as e:
+        db.session.rollback()
+        traceback.print_exc()
+        return jsonify({"message": f"提交模擬工作失敗: {str(e)}"}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    query = SimulationJob.query.order_by(SimulationJob.created_at.desc())
+    status = request.args.get('status')
+    if status:
+        query = query.filter(SimulationJob.status == status)
+    return jsonify([job.to_dict() for job in query.limit(100).all()])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = db.get_or_404(SimulationJob, job_id)
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """工作完成後取得模擬結果；尚未完成回傳 202，失敗回傳 409"""
+    job = db.get_or_404(SimulationJob, job_id)
+    if job.status == 'succeeded':
+        return jsonify(job.result)
+    if job.status == 'failed':
+        return jsonify({"message": f"模擬工作失敗: {job.error}", "job": job.to_dict()}), 409
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """以 Server-Sent Events 推送工作進度，工作結束後關閉串流"""
+    db.get_or_404(SimulationJob, job_id)
+
+    def generate():
+        last = None
+        while True:
+            db.session.expire_all()
+            job = db.session.get(SimulationJob, job_id)
+            if job is None:
+                return
+            state = job.to_dict()
+            if state != last:
+                yield f"event: progress\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+                last = state
+            if job.is_finished:
+                db.session.rollback()
+                return
+            # 釋放連線，避免長時間占用連線池
+            db.session.rollback()
+            time.sleep(JOB_STATUS_POLL_SECONDS)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,115 @@
+# backend/benchmarks/synthetic_network.py
+import math
+
+import numpy as np
+import shapely
+
+from services.network_graph import NetworkGraph
+
+# 效能基準測試用的合成下水道管網。
+# 人孔排成方格，出流口在左下角，每個人孔往左或往下接到相鄰人孔，形成樹狀 (dendritic) 管網；
+# looped 拓撲再為部分人孔加上第二條出流管，形成分流後再匯流的環路 (仍為有向無環，可演算)。
+# 每個人孔周圍一個方形集水區，逕流排入該人孔。座標為 WGS84，預設位於台北附近。
+
+TOPOLOGIES = ('tree', 'looped')
+STANDARD_DIAMETERS = np.array([0.3, 0.4, 0.5, 0.6, 0.8, 1.0, 1.2, 1.5, 1.8, 2.0, 2.4])
+MATERIALS = np.array(['混凝土', 'pvc', 'ductile_iron'])
+
+def _to_lonlat(x_m, y_m, origin):
+    """以原點為中心的公尺偏移量換算為經緯度 (小範圍等距近似)"""
+    lon0, lat0 = origin
+    lon = lon0 + x_m / (111320.0 * math.cos(math.radians(lat0)))
+    lat = lat0 + y_m / 110540.0
+    return lon, lat
+
+def generate_network(node_count, topology='tree', seed=0, spacing_m=40.0, loop_ratio=0.1,
+                     catchment_ratio=1.0, origin=(121.5, 25.0)):
+    """
+    產生 node_count 個人孔的合成管網，回傳 {圖層: {欄位: 陣列}}，欄位名稱與資料表相同，
+    幾何為 Shapely 幾何陣列 (欄位 geom)，id 從 1 起算。
+    - topology: 'tree' 或 'looped'
+    - loop_ratio: looped 拓撲中有第二條出流管的人孔比例
+    - catchment_ratio: 有集水區的人孔比例
+    """
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"topology 必須為 {', '.join(TOPOLOGIES)} 之一")
+    rng = np.random.default_rng(seed)
+    width = int(math.ceil(math.sqrt(node_count)))
+    index = np.arange(node_count)
+    col, row = index % width, index // width
+
+    # 人孔：管底標高由出流口往上游遞增，坡度約 0.3% ~ 0.8%
+    distance_m = (col + row) * spacing_m
+    bottom = distance_m * rng.uniform(0.003, 0.008) + rng.normal(0, 0.02, node_count)
+    bottom[0] = 0.0
+    depth = rng.uniform(1.5, 4.0, node_count)
+    lon, lat = _to_lonlat(col * spacing_m, row * spacing_m, origin)
+    manholes = {
+        'id': index + 1,
+        'name': np.array([f'MH-{i + 1}' for i in index], dtype=object),
+        'geom': shapely.points(lon, lat),
+        'top_elevation': bottom + depth,
+        'bottom_elevation': bottom,
+        'design_flow_limit': rng.uniform(0.05, 0.5, node_count),
+        'overflow_elevation': bottom + depth - 0.3,
+        'inflow': rng.uniform(0.0, 0.002, node_count),
+        'downstream_capacity': np.zeros(node_count),
+    }
+
+    # 管線：往左 (col-1) 或往下 (row-1) 接到相鄰人孔；兩個方向都可以時隨機擇一
+    can_left, can_down = col > 0, row > 0
+    go_left = can_left & (~can_down | (rng.random(node_count) < 0.5))
+    upstream = index[1:]
+    downstream = np.where(go_left, index - 1, index - width)[1:]
+    if topology == 'looped':
+        # 兩個方向都可以的人孔中，依 loop_ratio 再加一條往另一個方向的管線
+        both = np.flatnonzero(can_left & can_down & (rng.random(node_count) < loop_ratio))
+        upstream = np.concatenate([upstream, both])
+        downstream = np.concatenate([downstream, np.where(go_left[both], both - width, both - 1)])
+    pipe_count = len(upstream)
+
+    # 管徑依上游排水的人孔數選擇，坡度由兩端管底標高計算
+    graph = NetworkGraph(manholes['id'], np.arange(1, pipe_count + 1), upstream + 1, downstream + 1)
+    upstream_count = np.nan_to_num(graph.accumulate(np.ones(node_count)).pipe_flow, nan=1.0)
+    size_class = np.log2(np.maximum(upstream_count, 1.0)).astype(int) // 2
+    diameter = STANDARD_DIAMETERS[np.minimum(size_class, len(STANDARD_DIAMETERS) - 1)]
+    slope = np.maximum((bottom[upstream] - bottom[downstream]) / spacing_m, 0.001)
+    coords = np.stack([np.column_stack([lon[upstream], lat[upstream]]),
+                       np.column_stack([lon[downstream], lat[downstream]])], axis=1)
+    pipelines = {
+        'id': np.arange(1, pipe_count + 1),
+        'name': np.array([f'P-{i + 1}' for i in range(pipe_count)], dtype=object),
+        'geom': shapely.linestrings(coords),
+        'from_manhole_id': upstream + 1,
+        'to_manhole_id': downstream + 1,
+        'diameter': diameter,
+        'slope': slope,
+        'material': MATERIALS[rng.integers(0, len(MATERIALS), pipe_count)].astype(object),
+        'design_flow': upstream_count * 0.002,
+    }
+
+    # 集水區：以人孔為中心、邊長略小於間距的方形
+    outlets = np.flatnonzero(rng.random(node_count) < catchment_ratio)
+    half = spacing_m * 0.45
+    corners = np.array([(-half, -half), (half, -half), (half, half), (-half, half), (-half, -half)])
+    x = col[outlets, None] * spacing_m + corners[:, 0]
+    y = row[outlets, None] * spacing_m + corners[:, 1]
+    ring_lon, ring_lat = _to_lonlat(x, y, origin)
+    catchment_areas = {
+        'id': np.arange(1, len(outlets) + 1),
+        'name': np.array([f'C-{i + 1}' for i in range(len(outlets))], dtype=object),
+        'geom': shapely.polygons(np.stack([ring_lon, ring_lat], axis=-1)),
+        'outlet_manhole_id': outlets + 1,
+        'runoff_coefficient': rng.uniform(0.4, 0.9, len(outlets)),
+        'rainfall_intensity': rng.uniform(60.0, 120.0, len(outlets)),
+    }
+    return {'manholes': manholes, 'pipelines': pipelines, 'catchment_areas': catchment_areas}
+
+def feature_count(network):
+    return sum(len(layer['id']) for layer in network.values())
+
+def layer_rows(layer):
+    """將欄位陣列轉為每筆一個 dict (數值轉為 Python 型別)"""
+    columns = {name: values.tolist() if name != 'geom' else list(values) for name, values in layer.items()}
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
@@ -0,0 +1,34 @@
+# backend/remeasure_geometry.py
+
+# 一次性重新量測所有管線長度與集水區面積 (UTM 座標)。
+# 長度與面積只在新增或修改幾何時量測並儲存，量測方式變更時需手動執行此腳本：
+# 從舊版 (以 EPSG:3857 量測，數值偏大) 升級後，或變更 HYDRO_UTM_EPSG 後。
+# 值有變動的要素會更新版本，下次增量模擬即會重算受影響的集水區與其下游。
+
+from app import (app, db, LAYER_MODELS, MEASURED_COLUMNS, geometries_from_elements, load_records,
+                 bulk_update, bump_network_revision)
+
+def remeasure_geometry():
+    with app.app_context():
+        revision = bump_network_revision()
+        changed = {}
+        for layer, (column, measure) in MEASURED_COLUMNS.items():
+            model = LAYER_MODELS[layer]
+            records = load_records(model)
+            print(f"正在重新量測 {layer} ({len(records)} 筆)...")
+            if not records:
+                changed[layer] = 0
+                continue
+            values = measure(geometries_from_elements([record.geom for record in records]))
+            for record, value in zip(records, values.tolist()):
+                setattr(record, column, value)
+            changed[layer] = len(bulk_update(model, records, (column,), revision))
+        if any(changed.values()):
+            db.session.commit()
+            print(f"重新量測完成，管網版本 {revision}，有變動的要素: {changed}")
+        else:
+            db.session.rollback()
+            print("重新量測完成，量測值皆未變動。")
+
+if __name__ == '__main__':
+    remeasure_geometry()
@@ -0,0 +1,122 @@
+# backend/services/gis_io.py
+import os
+import zipfile
+
+import fiona
+import numpy as np
+import shapely
+from shapely.geometry import shape, mapping
+
+from services.gis_processor import reproject_geometries
+
+# 大型 GIS 檔案 (GeoPackage、Shapefile、GeoJSON) 的分批讀寫。
+# 讀取時每次只載入 chunk_size 筆要素並批次轉換到 WGS84；寫出時同樣分批寫入，
+# 記憶體用量與檔案大小無關。
+
+EXPORT_DRIVERS = {
+    'gpkg': ('GPKG', '.gpkg', 'application/geopackage+sqlite3'),
+    'shp': ('ESRI Shapefile', '.shp', 'application/zip'),
+}
+
+# Shapefile 的屬性表 (DBF) 欄位名稱最多 10 個字元
+SHAPEFILE_FIELD_LENGTH = 10
+
+# 每個圖層接受的幾何類型；多部件幾何會拆成多筆要素
+LAYER_GEOMETRY_TYPES = {
+    'manholes': 'Point',
+    'pipelines': 'LineString',
+    'catchment_areas': 'Polygon',
+}
+
+def dataset_path(path):
+    """Shapefile 以 zip 上傳時改用 zip:// 路徑讓 Fiona 直接讀取壓縮檔"""
+    if zipfile.is_zipfile(path):
+        return f'zip://{path}'
+    return path
+
+def list_layers(path):
+    return fiona.listlayers(dataset_path(path))
+
+def layer_fields(path, layer=None):
+    """圖層的屬性欄位名稱"""
+    with fiona.open(dataset_path(path), layer=layer) as source:
+        return list(source.schema['properties'])
+
+def shapefile_field_names(fields):
+    """
+    Shapefile 欄位短名稱 {欄位: 短名稱}：依序截斷為 10 個字元，截斷後重複者改以 _1、_2 結尾區分。
+    匯出與匯入以同一組欄位順序計算，匯出的 Shapefile 可以原欄位匯入。
+    """
+    names, used = {}, set()
+    for field in fields:
+        name, n = field[:SHAPEFILE_FIELD_LENGTH], 0
+        while name in used:
+            n += 1
+            suffix = f'_{n}'
+            name = field[:SHAPEFILE_FIELD_LENGTH - len(suffix)] + suffix
+        names[field] = name
+        used.add(name)
+    return names
+
+def read_feature_chunks(path, layer=None, chunk_size=5000):
+    """
+    分批讀取向量檔，每批回傳 (WGS84 Shapely 幾何陣列, 屬性 dict 列表)。
+    來源座標系由檔案讀取，未定義時視為 WGS84。
+    """
+    with fiona.open(dataset_path(path), layer=layer) as source:
+        source_crs = source.crs_wkt or 'EPSG:4326'
+        geometries, properties = [], []
+        for feature in source:
+            geometry = feature['geometry']
+            geometries.append(shape(geometry) if geometry is not None else None)
+            properties.append(dict(feature['properties']))
+            if len(geometries) >= chunk_size:
+                yield reproject_geometries(geometries, source_crs), properties
+                geometries, properties = [], []
+        if geometries:
+            yield reproject_geometries(geometries, source_crs), properties
+
+def explode_geometries(geometries, properties, geometry_type):
+    """
+    只保留指定類型的幾何，多部件幾何 (MultiPoint 等) 拆成多筆、屬性複製。
+    含 Z 值的幾何 (PointZ 等) 去除 Z 值，資料表的幾何欄位為 2D。
+    回傳 (幾何陣列, 屬性列表, 略過筆數)。
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    parts, index = shapely.get_parts(shapely.force_2d(geometries), return_index=True)
+    keep = shapely.get_type_id(parts) == shapely.GeometryType[geometry_type.upper()]
+    keep &= ~shapely.is_empty(parts)
+    parts, index = parts[keep], index[keep]
+    skipped = len(geometries) - len(np.unique(index))
+    return parts, [properties[i] for i in index], skipped
+
+def fiona_schema(geometry_type, fields):
+    """fields 為 [(欄位名稱, 'int'/'float'/'str'/'bool'), ...]"""
+    return {'geometry': geometry_type, 'properties': dict(fields)}
+
+def write_features(path, driver, schema, chunks, layer=None):
+    """
+    分批寫出要素。chunks 每批為 [(GeoJSON 幾何 dict 或 Shapely 幾何, 屬性 dict), ...]。
+    回傳寫出的筆數。
+    """
+    count = 0
+    with fiona.open(path, 'w', driver=driver, schema=schema, crs='EPSG:4326', layer=layer) as sink:
+        for chunk in chunks:
+            sink.writerecords(
+                {'geometry': geometry if isinstance(geometry, dict) else mapping(geometry), 'properties': props}
+                for geometry, props in chunk
+            )
+            count += len(chunk)
+    return count
+
+def zip_shapefile(shp_path):
+    """將 Shapefile 的各個組成檔案 (.shp/.shx/.dbf/.prj/.cpg) 打包為 zip，回傳 zip 路徑"""
+    base, _ = os.path.splitext(shp_path)
+    zip_path = base + '.zip'
+    directory = os.path.dirname(shp_path)
+    stem = os.path.basename(base)
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name in os.listdir(directory):
+            if os.path.splitext(name)[0] == stem and not name.endswith('.zip'):
+                archive.write(os.path.join(directory, name), name)
+    return zip_path
@@ -1,35 +1,116 @@
 # backend/services/gis_processor.py
-from shapely.geometry import shape, Point, LineString, Polygon
-from shapely.wkt import dumps, loads # 用於處理 WKT 格式，QGIS 可能更常用
+import os
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
 from pyproj import CRS, Transformer # 用於座標轉換
 
-# 定義一個轉換器，從 WGS84 (EPSG:4326) 轉換到一個投影座標系 (例如，台灣地區使用 UTM Zone 51N, EPSG:32651)
-# 這樣可以進行精確的面積和長度計算
-# 在實際應用中，您可能需要根據您的專案區域選擇合適的 UTM Zone 或其他投影座標系
-transformer_to_utm = Transformer.from_crs("EPSG:4326", "EPSG:32651", always_xy=True)
-transformer_from_utm = Transformer.from_crs("EPSG:32651", "EPSG:4326", always_xy=True)
+# 長度與面積需在投影座標系 (公尺) 中計算。預設依幾何所在位置自動選擇 UTM 帶
+# (例如台灣地區為 UTM Zone 51N, EPSG:32651)，轉換器依座標系組合快取重複使用。
+# 可透過環境變數 HYDRO_UTM_EPSG 固定專案使用的投影座標系
+UTM_EPSG = int(os.environ['HYDRO_UTM_EPSG']) if os.environ.get('HYDRO_UTM_EPSG') else None
+DEFAULT_UTM_EPSG = 32651 # 沒有任何幾何可判斷位置時使用
+
+@lru_cache(maxsize=32)
+def get_transformer(source_crs, target_crs="EPSG:4326"):
+    """取得 (並快取) 兩個座標系之間的轉換器，座標系可為 EPSG 代碼字串或 WKT"""
+    return Transformer.from_crs(CRS.from_user_input(source_crs), CRS.from_user_input(target_crs), always_xy=True)
+
+@lru_cache(maxsize=32)
+def _same_crs(source_crs, target_crs):
+    return CRS.from_user_input(source_crs) == CRS.from_user_input(target_crs)
+
+def _coords_transform(transformer):
+    """包裝轉換器，供 shapely.transform 一次轉換整個 (N, 2) 座標陣列"""
+    def transform(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+    return transform
+
+def utm_epsg_for(lon, lat):
+    """經緯度所在 UTM 帶的 EPSG 代碼 (北半球 326xx、南半球 327xx)，可傳入陣列"""
+    zone = np.floor((np.asarray(lon, dtype=float) + 180) / 6).astype(np.int64) % 60 + 1
+    return np.where(np.asarray(lat, dtype=float) >= 0, 32600, 32700) + zone
+
+def utm_epsg_for_extent(geometries):
+    """
+    依 WGS84 幾何陣列的整體範圍中心選擇 UTM 帶；設定 HYDRO_UTM_EPSG 時固定使用該座標系。
+    拓撲吸附等需要在同一座標系比較距離的計算，應以整個管網的範圍選擇一次。
+    """
+    if UTM_EPSG is not None:
+        return UTM_EPSG
+    geometries = np.asarray(geometries, dtype=object)
+    geometries = geometries[~(shapely.is_missing(geometries) | shapely.is_empty(geometries))]
+    if len(geometries) == 0:
+        return DEFAULT_UTM_EPSG
+    min_x, min_y, max_x, max_y = shapely.total_bounds(geometries)
+    return int(utm_epsg_for((min_x + max_x) / 2, (min_y + max_y) / 2))
+
+def transform_geometries_to_utm(geometries, epsg=None):
+    """
+    將 Shapely 幾何陣列從 WGS84 轉換到 UTM 座標系，epsg 未指定時依幾何範圍自動選擇。
+    shapely.transform 會把所有幾何的座標攤平成單一緩衝區，只呼叫一次 pyproj。
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    epsg = utm_epsg_for_extent(geometries) if epsg is None else epsg
+    return shapely.transform(geometries, _coords_transform(get_transformer("EPSG:4326", f"EPSG:{epsg}")))
 
 def transform_geometry_to_utm(geojson_geometry):
-    """將 GeoJSON 幾何從 WGS84 轉換到 UTM 座標系 (EPSG:32651)"""
-    geom_shapely = shape(geojson_geometry)
-    
-    def transform_point(x, y):
-        return transformer_to_utm.transform(x, y)
-
-    if geom_shapely.geom_type == 'Point':
-        return Point(transform_point(geom_shapely.x, geom_shapely.y))
-    elif geom_shapely.geom_type == 'LineString':
-        coords_utm = [transform_point(x, y) for x, y in geom_shapely.coords]
-        return LineString(coords_utm)
-    elif geom_shapely.geom_type == 'Polygon':
-        exterior_utm = [transform_point(x, y) for x, y in geom_shapely.exterior.coords]
-        interiors_utm = []
-        for interior in geom_shapely.interiors:
-            interiors_utm.append([transform_point(x, y) for x, y in interior.coords])
-        return Polygon(exterior_utm, interiors_utm)
-    # 處理其他類型或集合類型
-    return geom_shapely # 返回未轉換的，或者拋出錯誤
+    """將 GeoJSON 幾何從 WGS84 轉換到所在位置的 UTM 座標系"""
+    return transform_geometries_to_utm([shape(geojson_geometry)])[0]
+
+def reproject_geometries(geometries, source_crs, target_crs="EPSG:4326"):
+    """將 Shapely 幾何陣列從 source_crs 批次轉換到 target_crs (預設 WGS84)"""
+    geometries = np.asarray(geometries, dtype=object)
+    if _same_crs(source_crs, target_crs):
+        return geometries
+    return shapely.transform(geometries, _coords_transform(get_transformer(source_crs, target_crs)))
+
+def geometries_from_elements(elements):
+    """
+    將 GeoAlchemy2 從資料庫讀回的 WKB 元素批次解碼為 Shapely 幾何陣列。
+    None 會保留為 None。
+    """
+    buffers = []
+    for element in elements:
+        if element is None:
+            buffers.append(None)
+        elif isinstance(element.data, str):
+            buffers.append(element.data) # hex 字串
+        else:
+            buffers.append(bytes(element.data))
+    return shapely.from_wkb(np.array(buffers, dtype=object))
 
+def _measure(geometries, measure):
+    """
+    在各幾何所在的 UTM 帶中量測。量測值只取決於幾何本身，
+    不論是單筆編輯、批次匯入或整個管網模擬，同一幾何都得到相同結果；
+    每個 UTM 帶只轉換一次 (一般管網只有一個帶)。
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    result = np.zeros(len(geometries))
+    if len(geometries) == 0:
+        return result
+    if UTM_EPSG is not None:
+        zones = np.full(len(geometries), UTM_EPSG)
+    else:
+        bounds = shapely.bounds(geometries)
+        zones = utm_epsg_for(np.nan_to_num((bounds[:, 0] + bounds[:, 2]) / 2),
+                             np.nan_to_num((bounds[:, 1] + bounds[:, 3]) / 2))
+    for epsg in np.unique(zones):
+        in_zone = zones == epsg
+        result[in_zone] = measure(transform_geometries_to_utm(geometries[in_zone], int(epsg)))
+    return np.nan_to_num(result, nan=0.0)
+
+def measure_areas(geometries):
+    """批次計算多邊形面積 (平方公尺)，空幾何回傳 0"""
+    return _measure(geometries, shapely.area)
+
+def measure_lengths(geometries):
+    """批次計算線段長度 (公尺)，空幾何回傳 0"""
+    return _measure(geometries, shapely.length)
 
 def calculate_area_from_geom(geojson_geometry):
     """
@@ -53,4 +134,4 @@ def get_pipe_length_from_geom(geojson_geometry):
         return geom_utm.length # 返回公尺
     except Exception as e:
         print(f"Error calculating length: {e}")
-        return 0
\ No newline at end of file
+        return 0
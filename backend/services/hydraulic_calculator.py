@@ -1,77 +1,167 @@
 # backend/services/hydraulic_calculator.py
-import math
+import os
+from collections import namedtuple
+
+import numpy as np
 
 # 曼寧糙度係數表 (簡化，實際應用可能更複雜)
 MANNING_N_VALUES = {
     'concrete': 0.013,
     'ductile_iron': 0.012,
     'pvc': 0.009,
-    'earth': 0.025
+    'earth': 0.025,
+    # 前端表單使用的中文管材名稱
+    '混凝土': 0.013,
+    '鑄鐵': 0.014,
 }
+DEFAULT_MANNING_N = 0.013
 
 def get_manning_n(material):
-    return MANNING_N_VALUES.get(material.lower(), 0.013) # 預設值
+    if not material:
+        return DEFAULT_MANNING_N
+    return MANNING_N_VALUES.get(material.lower(), DEFAULT_MANNING_N) # 預設值
+
+# ==============================================================================
+# 圓管部分滿流幾何
+# θ 為水面在圓心所對應的圓心角 (0 ~ 2π)，水深比 d/D = (1 - cos(θ/2)) / 2
+# 依曼寧公式，流量比 Q/Qfull = (θ - sinθ)/(2π) * ((θ - sinθ)/θ)^(2/3)
+# 流速比 V/Vfull = ((θ - sinθ)/θ)^(2/3)
+# ==============================================================================
+
+def _velocity_ratio(theta):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rh_ratio = np.where(theta > 0, (theta - np.sin(theta)) / theta, 0.0)
+    return np.maximum(rh_ratio, 0.0) ** (2.0 / 3.0)
+
+def _flow_ratio(theta):
+    return (theta - np.sin(theta)) / (2 * np.pi) * _velocity_ratio(theta)
+
+def _depth_ratio(theta):
+    return (1 - np.cos(theta / 2)) / 2
+
+def _theta_at_max_flow():
+    """圓管最大流量發生在約 0.938 管徑處 (Q/Qfull ≈ 1.076)，流量比在 0 ~ 此角度間單調遞增"""
+    theta = np.linspace(np.pi, 2 * np.pi, 200001)
+    return float(theta[np.argmax(_flow_ratio(theta))])
+
+THETA_AT_MAX_FLOW = _theta_at_max_flow()
+
+def solve_partial_flow_angle(flow_ratio, iterations=60):
+    """
+    以向量化二分法求解 Q/Qfull = flow_ratio 對應的圓心角。
+    flow_ratio 會被限制在 [0, 1]，取單調段 (0 ~ THETA_AT_MAX_FLOW) 上的解。
+    """
+    target = np.clip(np.asarray(flow_ratio, dtype=float), 0.0, 1.0)
+    low = np.zeros_like(target)
+    high = np.full_like(target, THETA_AT_MAX_FLOW)
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        too_low = _flow_ratio(mid) < target
+        low = np.where(too_low, mid, low)
+        high = np.where(too_low, high, mid)
+    return (low + high) / 2
+
+# ==============================================================================
+# 部分滿流查表
+# 匯入時以圓心角均勻取樣建立一次 Q/Qfull → d/D、V/Vfull 的無因次對照表，
+# 求解時以單調線性內插查表；預估內插誤差超過容許值的區間才改用精確二分法求解。
+# ==============================================================================
+
+PARTIAL_FLOW_TABLE_SIZE = int(os.environ.get('HYDRO_PARTIAL_FLOW_TABLE_SIZE', 4097))
+PARTIAL_FLOW_TOLERANCE = float(os.environ.get('HYDRO_PARTIAL_FLOW_TOLERANCE', 1e-5))
+
+PartialFlowTable = namedtuple('PartialFlowTable', ['flow_ratio', 'depth_ratio', 'velocity_ratio', 'interval_error'])
+
+def build_partial_flow_table(size=PARTIAL_FLOW_TABLE_SIZE):
+    """建立部分滿流對照表，interval_error 為各區間中點的內插誤差 (d/D 與 V/Vfull 取大者)"""
+    theta = np.linspace(0.0, THETA_AT_MAX_FLOW, size)
+    flow_ratio = _flow_ratio(theta)
+    depth_ratio = _depth_ratio(theta)
+    velocity_ratio = _velocity_ratio(theta)
+
+    mid = (theta[:-1] + theta[1:]) / 2
+    mid_flow = _flow_ratio(mid)
+    depth_error = np.abs(np.interp(mid_flow, flow_ratio, depth_ratio) - _depth_ratio(mid))
+    velocity_error = np.abs(np.interp(mid_flow, flow_ratio, velocity_ratio) - _velocity_ratio(mid))
+    return PartialFlowTable(flow_ratio, depth_ratio, velocity_ratio, np.maximum(depth_error, velocity_error))
+
+PARTIAL_FLOW_TABLE = build_partial_flow_table()
+
+def lookup_partial_flow(flow_ratio, tolerance=None, table=None):
+    """
+    以查表求 Q/Qfull 對應的水深比 d/D 與流速比 V/Vfull。
+    flow_ratio 會被限制在 [0, 1]；落在誤差超過 tolerance 區間的值改以精確解計算。
+    """
+    tolerance = PARTIAL_FLOW_TOLERANCE if tolerance is None else tolerance
+    table = PARTIAL_FLOW_TABLE if table is None else table
+    shape = np.shape(flow_ratio)
+    target = np.clip(np.atleast_1d(np.asarray(flow_ratio, dtype=float)), 0.0, 1.0)
+    depth_ratio = np.interp(target, table.flow_ratio, table.depth_ratio)
+    velocity_ratio = np.interp(target, table.flow_ratio, table.velocity_ratio)
+
+    interval = np.clip(np.searchsorted(table.flow_ratio, target) - 1, 0, len(table.interval_error) - 1)
+    inexact = table.interval_error[interval] > tolerance
+    if np.any(inexact):
+        theta = solve_partial_flow_angle(target[inexact])
+        depth_ratio[inexact] = _depth_ratio(theta)
+        velocity_ratio[inexact] = _velocity_ratio(theta)
+    return depth_ratio.reshape(shape), velocity_ratio.reshape(shape)
+
+PipeHydraulics = namedtuple('PipeHydraulics', ['capacity', 'velocity', 'depth', 'fill_ratio', 'capacity_ratio'])
+
+def calculate_network_hydraulics(diameter, slope, manning_n, flow):
+    """
+    一次計算整個管網所有圓管的曼寧公式水力特性。
+    參數皆為等長陣列 (或可廣播的純量)，回傳 PipeHydraulics：
+    - capacity: 滿管流量 (CMS)
+    - velocity: 流速 (m/s)，超載時以 流量/滿管面積 估算
+    - depth: 水深 (m)，超載時為滿管
+    - fill_ratio: 水深比 d/D
+    - capacity_ratio: 流量比 Q/Qfull (滿管度)
+    無效輸入 (管徑或糙度 <= 0、坡度 < 0) 的管線各項結果皆為 0。
+    """
+    diameter, slope, manning_n, flow = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (diameter, slope, manning_n, flow)))
+    valid = (diameter > 0) & (slope >= 0) & (manning_n > 0)
+    d = np.where(valid, diameter, 1.0)
+    n = np.where(valid, manning_n, 1.0)
+    s = np.where(valid, slope, 0.0)
+    q = np.where(valid, np.maximum(flow, 0.0), 0.0)
+
+    area_full = np.pi * (d / 2) ** 2
+    rh_full = d / 4 # 滿管時的水力半徑
+    v_full = (1 / n) * rh_full ** (2 / 3) * np.sqrt(s)
+    q_full = area_full * v_full
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        capacity_ratio = np.where(q_full > 0, q / q_full, 0.0)
+    surcharged = (q > q_full) | ((q_full == 0) & (q > 0))
+
+    depth_ratio, velocity_ratio = lookup_partial_flow(capacity_ratio)
+    depth = np.where(surcharged, d, d * depth_ratio)
+    velocity = np.where(surcharged, q / area_full, v_full * velocity_ratio)
+
+    zero = np.zeros_like(d)
+    return PipeHydraulics(
+        capacity=np.where(valid, q_full, zero),
+        velocity=np.where(valid, velocity, zero),
+        depth=np.where(valid, depth, zero),
+        fill_ratio=np.where(valid, depth / d, zero),
+        capacity_ratio=np.where(valid, capacity_ratio, zero),
+    )
 
 def calculate_pipe_hydraulics(diameter, slope, manning_n, design_flow):
     """
     計算圓管的曼寧公式水力特性。
     根據設計流量計算實際流量、流速和水深。
-    這裡的水深計算使用簡化迭代法或查表，實際精確解法更複雜。
+    單管版本，實際計算由 calculate_network_hydraulics 完成。
     """
     if diameter <= 0 or slope < 0 or manning_n <= 0:
         return 0, 0, 0, 0 # 無效輸入
 
-    radius = diameter / 2
-    area_full = math.pi * radius**2
-    perimeter_full = math.pi * diameter
-    rh_full = area_full / perimeter_full # 滿管時的水力半徑
-
-    v_full = (1 / manning_n) * (rh_full**(2/3)) * (slope**(1/2)) if slope > 0 else 0
-    q_full = area_full * v_full
-
+    result = calculate_network_hydraulics(diameter, slope, manning_n, design_flow)
     calculated_flow = design_flow # 假設設計流量即為期望的實際流量
-
-    # --- 簡化的水深和流速計算 (實際應用中應使用更精確的數值解法) ---
-    # 對於重力流下的部分滿管，水深 d 的計算是一個非線性問題，通常需要迭代
-    # 這裡為 MVP 目的，進行簡化處理：
-    calculated_depth = diameter # 預設為滿管水深
-    calculated_velocity = v_full # 預設為滿管流速
-    
-    if design_flow <= q_full and q_full > 0: # 僅在未滿管且滿管流量大於0時進行近似
-        # 非常簡化的流量-水深關係近似，僅作示意
-        # 實際工程會使用如 "Trapezoidal/Circular Culvert Flow" 查表或迭代計算
-        flow_ratio_simplified = design_flow / q_full
-        if flow_ratio_simplified <= 0.5: # 流量小於一半時，水深可能約為流量比乘以管徑
-            calculated_depth = diameter * (flow_ratio_simplified ** 0.5) * 0.8
-        else: # 流量大於一半時，水深會逐漸接近管徑
-             calculated_depth = diameter * (0.5 + (flow_ratio_simplified - 0.5) * 0.8)
-
-        if calculated_depth < 0.01: calculated_depth = 0.01 # 避免水深過小
-        
-        # 重新計算部分滿管的面積和水力半徑，然後計算流速
-        if calculated_depth > 0:
-            theta = 2 * math.acos(1 - (2 * calculated_depth / diameter))
-            area_partial = (radius**2 / 2) * (theta - math.sin(theta))
-            perimeter_partial = radius * theta
-            if perimeter_partial > 0:
-                rh_partial = area_partial / perimeter_partial
-                calculated_velocity = (1 / manning_n) * (rh_partial**(2/3)) * (slope**(1/2)) if slope > 0 else 0
-            else:
-                calculated_velocity = 0 # 無水流
-        else:
-            calculated_velocity = 0
-
-    elif design_flow > q_full:
-        # 如果設計流量超過滿管容量，則認為是超載，水深為滿管或更高（壓力流），
-        # 但這裡暫時只用滿管水深表示。
-        # 流速則按流量/滿管面積估算，以反映流量增大
-        calculated_depth = diameter
-        calculated_velocity = design_flow / area_full if area_full > 0 else 0
-    # --- 簡化結束 ---
-
-    flow_ratio = design_flow / q_full if q_full > 0 else 0 # 滿管度
-
-    return calculated_flow, calculated_velocity, calculated_depth, flow_ratio
+    return calculated_flow, float(result.velocity), float(result.depth), float(result.capacity_ratio)
 
 def calculate_rational_formula_peak_flow(area_sqm, runoff_coefficient, rainfall_intensity_mmhr):
     """
@@ -86,9 +176,35 @@ def calculate_rational_formula_peak_flow(area_sqm, runoff_coefficient, rainfall_
     area_hectares = area_sqm / 10000.0
     if runoff_coefficient < 0 or runoff_coefficient > 1 or rainfall_intensity_mmhr < 0 or area_hectares < 0:
         return 0 # 無效輸入
-    
+
     return (1.0 / 360.0) * runoff_coefficient * rainfall_intensity_mmhr * area_hectares
 
+def calculate_rational_peak_flows(area_sqm, runoff_coefficient, rainfall_intensity_mmhr):
+    """
+    合理化公式的向量化版本，Q = C * I * A / 3,600,000 (A 為平方公尺，Q 為 CMS)。
+    負值結果視為 0。
+    """
+    area, c, i = (np.asarray(v, dtype=float) for v in (area_sqm, runoff_coefficient, rainfall_intensity_mmhr))
+    return np.maximum(c * i * area / 3600000.0, 0.0)
+
+def check_manhole_overflow_batch(manhole_elevation_invert, manhole_overflow_point_elevation, inflow_to_manhole, downstream_pipe_capacity):
+    """
+    check_manhole_overflow 的向量化版本，參數皆為等長陣列。
+    回傳 (is_overflow, water_level) 兩個陣列。
+    """
+    invert, overflow_elevation, inflow, capacity = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (manhole_elevation_invert, manhole_overflow_point_elevation,
+                                                inflow_to_manhole, downstream_pipe_capacity)))
+    is_overflow = inflow > capacity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        level_ratio = np.where(capacity > 0, inflow / capacity, 0.0)
+    water_level = np.where(
+        is_overflow,
+        overflow_elevation + (inflow - capacity) * 0.1, # 簡化水位上升
+        invert + (overflow_elevation - invert) * level_ratio,
+    )
+    return is_overflow, water_level
+
 def check_manhole_overflow(manhole_elevation_invert, manhole_overflow_point_elevation, inflow_to_manhole, downstream_pipe_capacity):
     """
     檢查人孔是否溢流。
@@ -96,16 +212,19 @@ def check_manhole_overflow(manhole_elevation_invert, manhole_overflow_point_elev
     這裡僅比較流量是否超過下游管線承載力。
     更精確的方法會根據流入流量計算人孔內的水位。
     """
-    is_overflow = False
-    current_water_level = manhole_elevation_invert # 簡化：初始假設水位在底部
-
-    if inflow_to_manhole > downstream_pipe_capacity:
-        is_overflow = True
-        # 如果溢流，假設水位到達溢流點或更高
-        current_water_level = manhole_overflow_point_elevation + (inflow_to_manhole - downstream_pipe_capacity) * 0.1 # 簡化水位上升
-    else:
-        # 如果沒有溢流，水位則在底部與溢流點之間，簡化為設計流量比例
-        level_ratio = inflow_to_manhole / downstream_pipe_capacity if downstream_pipe_capacity > 0 else 0
-        current_water_level = manhole_elevation_invert + (manhole_overflow_point_elevation - manhole_elevation_invert) * level_ratio
+    is_overflow, water_level = check_manhole_overflow_batch(
+        manhole_elevation_invert, manhole_overflow_point_elevation, inflow_to_manhole, downstream_pipe_capacity)
+    return bool(is_overflow), float(water_level)
 
-    return is_overflow, current_water_level
\ No newline at end of file
+def calculate_manhole_levels(bottom_elevation, overflow_elevation, top_elevation, inflow, design_flow_limit):
+    """
+    依流入量與設計流量上限的比例內插人孔水位 (不超過頂蓋標高)，並判斷是否溢流。
+    參數皆為等長陣列，回傳 (water_level, is_overflow)。
+    """
+    bottom, overflow, top, inflow, limit = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (bottom_elevation, overflow_elevation, top_elevation,
+                                                inflow, design_flow_limit)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(limit > 0, inflow / limit, 0.0)
+    water_level = np.where(limit > 0, np.minimum(bottom + ratio * (overflow - bottom), top), bottom)
+    return water_level, water_level > overflow
@@ -0,0 +1,45 @@
+# backend/services/job_queue.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 本機背景工作佇列：以執行緒池執行模擬工作，不需外部 message broker。
+# 工作狀態由呼叫端寫入資料庫；這裡只負責排程，以及合併相同參數、相同管網狀態的進行中工作。
+
+class JobQueue:
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight = {} # dedupe_key → job_id
+
+    def _get_executor(self):
+        # 延遲建立執行緒池，避免僅匯入模組 (例如建表腳本) 時就啟動執行緒
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hydro-job')
+        return self._executor
+
+    def submit(self, dedupe_key, create_job, run_job):
+        """
+        提交工作。若已有相同 dedupe_key 的工作在排隊或執行中，直接回傳該工作 id。
+        create_job() 建立工作紀錄並回傳 (job_id, 是否需要排程)，在鎖內呼叫以避免重複建立；
+        run_job(job_id) 在背景執行緒中執行。
+        回傳 (job_id, 是否為新工作)。
+        """
+        with self._lock:
+            existing = self._inflight.get(dedupe_key)
+            if existing is not None:
+                return existing, False
+            job_id, schedule = create_job()
+            if not schedule:
+                return job_id, False
+            self._inflight[dedupe_key] = job_id
+        self._get_executor().submit(self._run, dedupe_key, job_id, run_job)
+        return job_id, True
+
+    def _run(self, dedupe_key, job_id, run_job):
+        try:
+            run_job(job_id)
+        finally:
+            with self._lock:
+                if self._inflight.get(dedupe_key) == job_id:
+                    del self._inflight[dedupe_key]
@@ -0,0 +1,124 @@
+# backend/services/metrics.py
+import threading
+import time
+from contextvars import ContextVar
+
+# 行程內的效能指標：請求數與耗時、每個請求的 SQL 數與耗時、模擬各階段耗時。
+# 每次請求的數值先累積在 RequestTimings (不需加鎖)，請求結束時才一次併入 MetricsRegistry，
+# 以 Prometheus 文字格式輸出；單次請求的明細另外寫成 Server-Timing 標頭。
+
+class MetricsRegistry:
+    """執行緒安全的 counter / gauge / summary 集合"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {} # 名稱 → (類型, 說明, {標籤 tuple: 數值})
+        self._collectors = [] # 輸出時才取值的指標 (例如快取大小與命中次數)
+
+    def describe(self, name, metric_type, help_text):
+        with self._lock:
+            self._metrics.setdefault(name, (metric_type, help_text, {}))
+
+    def add_collector(self, collector):
+        """collector() 回傳 [(名稱, 類型 (gauge/counter), 說明, [(標籤 dict, 數值), ...])]，於輸出時呼叫"""
+        self._collectors.append(collector)
+
+    def merge(self, updates):
+        """
+        一次併入多筆更新 [('inc' 或 'observe', 名稱, 數值, 標籤 dict)]，只取一次鎖。
+        inc 累加 counter；observe 累計 summary 的總和與次數。
+        """
+        with self._lock:
+            for kind, name, value, labels in updates:
+                key = tuple(sorted(labels.items()))
+                values = self._metrics[name][2]
+                if kind == 'observe':
+                    total, count = values.get(key, (0.0, 0))
+                    values[key] = (total + value, count + 1)
+                else:
+                    values[key] = values.get(key, 0.0) + value
+
+    def render(self):
+        """輸出 Prometheus text exposition format (0.0.4)"""
+        lines = []
+        with self._lock:
+            snapshot = [(name, metric_type, help_text, dict(values))
+                        for name, (metric_type, help_text, values) in self._metrics.items()]
+        for name, metric_type, help_text, values in snapshot:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(values.items()):
+                if metric_type == 'summary':
+                    lines.append(f"{name}_sum{_labels(key)} {_number(value[0])}")
+                    lines.append(f"{name}_count{_labels(key)} {value[1]}")
+                else:
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _labels(key):
+    if not key:
+        return ''
+    escaped = (f'{name}="{_escape(value)}"' for name, value in key)
+    return '{' + ','.join(escaped) + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return repr(float(value))
+
+class RequestTimings:
+    """單一請求 (或背景工作) 的 SQL 數、SQL 耗時與模擬階段耗時"""
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.phases = {} # 階段 → 秒
+
+    def add_phase(self, stage, seconds):
+        self.phases[stage] = self.phases.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Server-Timing 標頭值 (毫秒)"""
+        entries = [f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"']
+        entries.extend(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.phases.items())
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+# 目前執行中的請求計時；SQLAlchemy 事件與模擬階段計時都寫到這裡
+current_timings = ContextVar('current_timings', default=None)
+
+class PhaseTimer:
+    """
+    包裝模擬的進度回報函式：每次切換階段時記錄前一個階段的耗時。
+    呼叫 stop() 結束最後一個階段並回傳 {階段: 秒}。
+    """
+    def __init__(self, progress):
+        self.progress = progress
+        self.phases = {}
+        self._stage = None
+        self._start = None
+
+    def _close(self):
+        if self._stage is not None:
+            now = time.perf_counter()
+            self.phases[self._stage] = self.phases.get(self._stage, 0.0) + now - self._start
+            self._stage = None
+
+    def __call__(self, stage, fraction):
+        self._close()
+        self.progress(stage, fraction) # 進度回報本身 (例如寫入工作狀態) 不計入階段耗時
+        self._stage, self._start = stage, time.perf_counter()
+
+    def stop(self):
+        self._close()
+        return self.phases
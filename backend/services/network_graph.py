@@ -0,0 +1,189 @@
+# backend/services/network_graph.py
+from collections import namedtuple
+
+import numpy as np
+
+# 管網拓撲：以人孔為節點、管線為有向邊 (from_manhole_id → to_manhole_id)。
+# 鄰接關係以 CSR 陣列儲存，節點與管線皆以陣列索引表示，
+# 對外則透過 id ↔ 索引的對照表轉換。
+
+RoutingResult = namedtuple('RoutingResult', ['node_inflow', 'pipe_flow', 'unrouted_pipes'])
+
+def _csr_positions(indptr, nodes):
+    """展開 CSR 中多個節點的所有鄰接位置 (向量化)"""
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total)
+
+class NetworkGraph:
+    def __init__(self, manhole_ids, pipe_ids, from_ids, to_ids):
+        """
+        manhole_ids: 所有人孔 id
+        pipe_ids, from_ids, to_ids: 管線 id 與起迄人孔 id (未連結者為 None)
+        只有起迄人孔皆存在的管線才會成為圖的邊。
+        """
+        self.manhole_ids = np.asarray(manhole_ids, dtype=np.int64)
+        self.pipe_ids = np.asarray(pipe_ids, dtype=np.int64)
+        self.node_count = len(self.manhole_ids)
+
+        self._node_order = np.argsort(self.manhole_ids, kind='stable')
+        self._sorted_ids = self.manhole_ids[self._node_order]
+
+        from_index = self.node_index(from_ids)
+        to_index = self.node_index(to_ids)
+        connected = (from_index >= 0) & (to_index >= 0)
+        self.edge_pipes = np.flatnonzero(connected) # 邊 → 管線陣列索引
+        self.edge_from = from_index[connected]
+        self.edge_to = to_index[connected]
+
+        # 下游 (出流) CSR
+        order = np.argsort(self.edge_from, kind='stable')
+        self.out_edges = order
+        self.out_indptr = np.zeros(self.node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.edge_from, minlength=self.node_count), out=self.out_indptr[1:])
+
+        # 上游 (入流) CSR
+        order = np.argsort(self.edge_to, kind='stable')
+        self.in_edges = order
+        self.in_indptr = np.zeros(self.node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.edge_to, minlength=self.node_count), out=self.in_indptr[1:])
+
+        self._levels = None
+        self._components = None
+
+    def node_index(self, ids):
+        """將人孔 id 轉為節點索引，找不到 (或為 None) 者回傳 -1"""
+        ids = np.array([-1 if i is None else i for i in ids], dtype=np.int64)
+        if self.node_count == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self._sorted_ids, ids), 0, self.node_count - 1)
+        found = self._sorted_ids[pos] == ids
+        return np.where(found, self._node_order[pos], -1)
+
+    def downstream_edges(self, node):
+        return self.out_edges[self.out_indptr[node]:self.out_indptr[node + 1]]
+
+    def upstream_edges(self, node):
+        return self.in_edges[self.in_indptr[node]:self.in_indptr[node + 1]]
+
+    def levels(self):
+        """
+        以分層 Kahn 演算法求拓撲分層 (O(V+E))：第 k 層的節點其所有上游節點都位於前 k-1 層。
+        回傳 (節點層列表, 各層節點的出流邊列表)。
+        位於迴路上 (或迴路下游) 的節點不會出現在結果中。
+        """
+        if self._levels is None:
+            in_degree = np.diff(self.in_indptr)
+            frontier = np.flatnonzero(in_degree == 0)
+            node_levels, edge_levels = [], []
+            while len(frontier):
+                edges = self.out_edges[_csr_positions(self.out_indptr, frontier)]
+                node_levels.append(frontier)
+                edge_levels.append(edges)
+                targets = self.edge_to[edges]
+                np.subtract.at(in_degree, targets, 1)
+                frontier = np.unique(targets[in_degree[targets] == 0])
+            self._levels = (node_levels, edge_levels)
+        return self._levels
+
+    def topological_order(self):
+        """節點的拓撲順序"""
+        node_levels, _ = self.levels()
+        if not node_levels:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(node_levels)
+
+    def downstream_closure(self, seed_nodes):
+        """自起始節點沿出流方向擴展，回傳所有可到達節點 (含起始節點) 的布林遮罩"""
+        reached = np.zeros(self.node_count, dtype=bool)
+        frontier = np.unique(np.asarray(seed_nodes, dtype=np.int64))
+        frontier = frontier[frontier >= 0]
+        while len(frontier):
+            reached[frontier] = True
+            edges = self.out_edges[_csr_positions(self.out_indptr, frontier)]
+            targets = np.unique(self.edge_to[edges])
+            frontier = targets[~reached[targets]]
+        return reached
+
+    def cyclic_nodes(self):
+        """無法排入拓撲順序的節點 (迴路及受迴路影響的下游節點)"""
+        ordered = np.zeros(self.node_count, dtype=bool)
+        ordered[self.topological_order()] = True
+        return np.flatnonzero(~ordered)
+
+    def components(self):
+        """以標籤傳遞加指標跳躍求弱連通元件，回傳每個節點的元件編號 (0 起算)"""
+        if self._components is None:
+            labels = np.arange(self.node_count)
+            while True:
+                from_labels, to_labels = labels[self.edge_from], labels[self.edge_to]
+                low = np.minimum(from_labels, to_labels)
+                hooked = labels.copy()
+                np.minimum.at(hooked, from_labels, low)
+                np.minimum.at(hooked, to_labels, low)
+                while True:
+                    jumped = hooked[hooked]
+                    if np.array_equal(jumped, hooked):
+                        break
+                    hooked = jumped
+                if np.array_equal(hooked, labels):
+                    break
+                labels = hooked
+            _, self._components = np.unique(labels, return_inverse=True)
+        return self._components
+
+    def summary(self):
+        """管網拓撲檢核摘要"""
+        components = self.components()
+        cyclic = self.cyclic_nodes()
+        return {
+            'node_count': int(self.node_count),
+            'edge_count': int(len(self.edge_pipes)),
+            'unconnected_pipe_count': int(len(self.pipe_ids) - len(self.edge_pipes)),
+            'component_count': int(components.max() + 1) if self.node_count else 0,
+            'outlet_count': int(np.count_nonzero(np.diff(self.out_indptr) == 0)),
+            'cyclic_manhole_ids': self.manhole_ids[cyclic].tolist(),
+        }
+
+    def accumulate(self, local_inflow, split_weights=None):
+        """
+        依拓撲順序將各人孔的本地入流量往下游累加。
+        local_inflow: 每個節點的本地入流量 (CMS)；可為 (節點數, 情境數) 的二維陣列，一次累加多個情境
+        split_weights: 每條管線的分流權重 (例如滿管容量)；同一人孔有多條出流管時依權重比例分配，
+                       未提供或權重總和為 0 時平均分配。
+        回傳 RoutingResult：
+        - node_inflow: 每個人孔的總入流量 (本地 + 上游)
+        - pipe_flow: 每條管線的流量，未連結或位於迴路上的管線為 NaN
+        - unrouted_pipes: pipe_flow 為 NaN 的管線索引
+        """
+        node_inflow = np.array(local_inflow, dtype=float)
+        edge_count = len(self.edge_pipes)
+        if split_weights is None:
+            weights = np.ones(edge_count)
+        else:
+            weights = np.maximum(np.asarray(split_weights, dtype=float)[self.edge_pipes], 0.0)
+
+        # 每條邊占其上游節點總出流的比例
+        weight_sum = np.bincount(self.edge_from, weights=weights, minlength=self.node_count)
+        out_degree = np.diff(self.out_indptr)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(weight_sum[self.edge_from] > 0,
+                                weights / weight_sum[self.edge_from],
+                                1.0 / np.maximum(out_degree[self.edge_from], 1))
+
+        extra_dims = node_inflow.shape[1:]
+        fraction = fraction.reshape((edge_count,) + (1,) * len(extra_dims))
+        edge_flow = np.full((edge_count,) + extra_dims, np.nan)
+        for edges in self.levels()[1]:
+            flows = node_inflow[self.edge_from[edges]] * fraction[edges]
+            edge_flow[edges] = flows
+            np.add.at(node_inflow, self.edge_to[edges], flows)
+
+        pipe_flow = np.full((len(self.pipe_ids),) + extra_dims, np.nan)
+        pipe_flow[self.edge_pipes] = edge_flow
+        unrouted = np.isnan(pipe_flow.reshape(len(self.pipe_ids), -1)).any(axis=1)
+        return RoutingResult(node_inflow, pipe_flow, np.flatnonzero(unrouted))
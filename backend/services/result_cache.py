@@ -0,0 +1,59 @@
+# backend/services/result_cache.py
+import threading
+from collections import OrderedDict
+
+# 以管網版本為鍵的結果快取：模擬結果與列表回應序列化後以 bytes 存放，
+# 依最近使用順序 (LRU) 淘汰，總大小不超過 max_bytes。
+# 鍵的第一個元素為管網版本，版本遞增後舊項目不再被命中，會自然被淘汰。
+
+class ResultCache:
+    def __init__(self, max_bytes, max_entries=1024):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key → (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """取得快取值並標記為最近使用，未命中回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """加入快取，size 預設為 len(value)；單筆超過上限者不快取"""
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,62 @@
+# backend/services/scenarios.py
+import numpy as np
+
+# 多情境批次模擬：將 N 組參數覆寫疊成 (要素數, 情境數) 的二維陣列，
+# 與管網累加、水理核心一起以一次陣列運算完成，不修改基礎資料表。
+
+SCENARIO_OPTIONS = ('name', 'rainfall_factor', 'rainfall_intensity', 'runoff_coefficient',
+                    'runoff_coefficient_factor', 'catchment_overrides')
+
+def stack_catchment_parameters(catchment_ids, runoff_coefficients, rainfall_intensities, scenarios):
+    """
+    依各情境的覆寫建立 (集水區數, 情境數) 的逕流係數與降雨強度矩陣。
+    每個情境可包含：
+    - rainfall_intensity / runoff_coefficient：所有集水區改用此值
+    - rainfall_factor / runoff_coefficient_factor：乘上基礎值 (例如氣候變遷降雨增量)
+    - catchment_overrides：{集水區 id: {"runoff_coefficient": ..., "rainfall_intensity": ...}}
+    """
+    count = len(scenarios)
+    c = np.repeat(np.asarray(runoff_coefficients, dtype=float)[:, None], count, axis=1)
+    i = np.repeat(np.asarray(rainfall_intensities, dtype=float)[:, None], count, axis=1)
+    index = {catchment_id: k for k, catchment_id in enumerate(catchment_ids)}
+
+    for s, scenario in enumerate(scenarios):
+        unknown = set(scenario) - set(SCENARIO_OPTIONS)
+        if unknown:
+            raise ValueError(f"不支援的情境參數: {', '.join(sorted(unknown))}")
+        if 'rainfall_intensity' in scenario:
+            i[:, s] = float(scenario['rainfall_intensity'])
+        if 'runoff_coefficient' in scenario:
+            c[:, s] = float(scenario['runoff_coefficient'])
+        i[:, s] *= float(scenario.get('rainfall_factor', 1.0))
+        c[:, s] *= float(scenario.get('runoff_coefficient_factor', 1.0))
+        for catchment_id, override in (scenario.get('catchment_overrides') or {}).items():
+            k = index.get(int(catchment_id))
+            if k is None:
+                raise ValueError(f"找不到集水區 {catchment_id}")
+            if 'rainfall_intensity' in override:
+                i[k, s] = float(override['rainfall_intensity'])
+            if 'runoff_coefficient' in override:
+                c[k, s] = float(override['runoff_coefficient'])
+
+    if np.any(i < 0) or np.any((c < 0) | (c > 1)):
+        raise ValueError("降雨強度不可為負，逕流係數須介於 0 與 1 之間")
+    return c, i
+
+# 摘要只列出入流量最大的溢流人孔，完整的溢流判斷在情境的 results 中
+SUMMARY_OVERFLOW_LIMIT = 100
+
+def summarize_scenario(manhole_ids, overflows, manhole_inflow, full_capacity_ratio, peak_flows,
+                       overflow_limit=SUMMARY_OVERFLOW_LIMIT):
+    """單一情境的精簡摘要，overflow_manhole_ids 為入流量最大的前 overflow_limit 個溢流人孔 (由大到小)"""
+    overflow_index = np.flatnonzero(overflows)
+    overflow_inflow = np.asarray(manhole_inflow, dtype=float)[overflow_index]
+    top = overflow_index[np.argsort(-overflow_inflow, kind='stable')[:overflow_limit]]
+    return {
+        'overflow_manhole_count': int(len(overflow_index)),
+        'overflow_manhole_ids': np.asarray(manhole_ids)[top].tolist(),
+        'max_full_capacity_ratio': float(np.max(full_capacity_ratio)) if len(full_capacity_ratio) else None,
+        'surcharged_pipe_count': int(np.count_nonzero(full_capacity_ratio > 100)),
+        'max_manhole_inflow': float(np.max(manhole_inflow)) if len(manhole_inflow) else None,
+        'total_peak_runoff': float(np.sum(peak_flows)),
+    }
@@ -0,0 +1,68 @@
+# backend/services/serializers.py
+import json
+from collections.abc import Mapping
+
+from geoalchemy2.elements import WKBElement, WKTElement
+from geoalchemy2.shape import to_shape
+from shapely.geometry import mapping
+from shapely.wkt import loads as wkt_loads
+
+# 所有圖層模型共用的序列化層。
+# 幾何欄位從資料庫讀回時為 WKB，直接在 Python 端以 Shapely 解碼成 GeoJSON，
+# 不再對每一筆資料額外執行一次 ST_AsGeoJSON 查詢。
+
+def geometry_to_geojson(geom):
+    """將 GeoAlchemy2 幾何值 (WKB/WKT 元素或 WKT 字串) 轉為 GeoJSON dict"""
+    if geom is None:
+        return None
+    if isinstance(geom, (WKBElement, WKTElement)):
+        shapely_geom = to_shape(geom)
+    elif isinstance(geom, str):
+        # 剛指派但尚未寫入資料庫的 WKT 字串
+        shapely_geom = wkt_loads(geom)
+    else:
+        shapely_geom = geom
+    return mapping(shapely_geom)
+
+def serialize_feature(values, fields):
+    """
+    依欄位清單將單一要素序列化為 dict。
+    values 可以是 ORM 物件或查詢結果的 row mapping。
+    """
+    if isinstance(values, Mapping):
+        getter = values.get
+    else:
+        getter = lambda name: getattr(values, name, None)
+    data = {field: getter(field) for field in fields}
+    data['geom'] = geometry_to_geojson(getter('geom'))
+    return data
+
+def serialize_features(rows, fields):
+    """批次序列化多個要素"""
+    return [serialize_feature(row, fields) for row in rows]
+
+def to_geojson_feature(values, fields):
+    """將要素序列化為 GeoJSON Feature"""
+    properties = serialize_feature(values, fields)
+    geometry = properties.pop('geom')
+    return {'type': 'Feature', 'id': properties.get('id'), 'geometry': geometry, 'properties': properties}
+
+def stream_feature_collection(rows, fields, **members):
+    """
+    逐筆輸出 GeoJSON FeatureCollection 字串片段，供 Flask 串流回應使用。
+    members 會附加為 FeatureCollection 的額外成員 (例如 next_cursor)。
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(to_geojson_feature(row, fields), ensure_ascii=False)
+        separator = ','
+    yield ']'
+    for key, value in members.items():
+        yield ', ' + json.dumps(key) + ': ' + json.dumps(value)
+    yield '}'
+
+def stream_ndjson(rows, fields):
+    """逐行輸出 newline-delimited GeoJSON (每行一個 Feature)"""
+    for row in rows:
+        yield json.dumps(to_geojson_feature(row, fields), ensure_ascii=False) + '\n'
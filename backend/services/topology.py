@@ -0,0 +1,72 @@
+# backend/services/topology.py
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+# 管網拓撲自動連結：以 STRtree 空間索引將管線端點吸附到最近的人孔。
+# 輸入的幾何皆須為投影座標 (公尺)，容許距離才有意義。
+
+def nearest_within(points, targets, tolerance, tree=None):
+    """
+    每個幾何在 tolerance 距離內最近的目標索引，找不到 (或幾何為 None/空幾何) 者為 -1。
+    points、targets 為 Shapely 幾何陣列；已建好的 STRtree 可由 tree 傳入重複使用。
+    """
+    points = np.asarray(points, dtype=object)
+    result = np.full(len(points), -1, dtype=np.int64)
+    targets = np.asarray(targets, dtype=object)
+    valid = ~(shapely.is_missing(points) | shapely.is_empty(points))
+    if len(targets) == 0 or not valid.any():
+        return result
+    tree = STRtree(targets) if tree is None else tree
+    # 先以 dwithin 取出容許距離內的所有候選配對，再對每個點取距離最小者；
+    # 比逐點的 query_nearest 快數倍
+    candidates = np.flatnonzero(valid)
+    point_index, target_index = tree.query(points[candidates], predicate='dwithin', distance=tolerance)
+    if len(point_index) == 0:
+        return result
+    distances = shapely.distance(points[candidates][point_index], targets[target_index])
+    order = np.lexsort((target_index, distances, point_index))
+    point_index, target_index = point_index[order], target_index[order]
+    _, first = np.unique(point_index, return_index=True)
+    result[candidates[point_index[first]]] = target_index[first]
+    return result
+
+def snap_pipe_endpoints(lines, manhole_points, tolerance):
+    """
+    將管線起點與終點吸附到 tolerance 距離內最近的人孔。
+    回傳 (起點人孔索引, 終點人孔索引)，找不到者為 -1。
+    """
+    lines = np.asarray(lines, dtype=object)
+    manhole_points = np.asarray(manhole_points, dtype=object)
+    tree = STRtree(manhole_points)
+    starts = shapely.get_point(lines, 0)
+    ends = shapely.get_point(lines, -1)
+    return (nearest_within(starts, manhole_points, tolerance, tree),
+            nearest_within(ends, manhole_points, tolerance, tree))
+
+def assign_catchment_outlets(polygons, manhole_points, manhole_elevations, search_distance):
+    """
+    指定每個集水區的出流人孔：集水區內底部標高最低 (最下游) 的人孔，標高相同時取索引較小者；
+    集水區內沒有人孔時，取 search_distance 距離內最近的人孔。找不到者為 -1。
+    manhole_elevations 中的 NaN (未填標高) 排在最後。
+    """
+    polygons = np.asarray(polygons, dtype=object)
+    manhole_points = np.asarray(manhole_points, dtype=object)
+    result = np.full(len(polygons), -1, dtype=np.int64)
+    if len(polygons) == 0 or len(manhole_points) == 0:
+        return result
+    tree = STRtree(manhole_points)
+
+    polygon_index, point_index = tree.query(polygons, predicate='intersects')
+    if len(polygon_index):
+        elevations = np.asarray(manhole_elevations, dtype=float)
+        elevations = np.where(np.isnan(elevations), np.inf, elevations)
+        order = np.lexsort((point_index, elevations[point_index], polygon_index))
+        polygon_index, point_index = polygon_index[order], point_index[order]
+        _, first = np.unique(polygon_index, return_index=True)
+        result[polygon_index[first]] = point_index[first]
+
+    missing = np.flatnonzero(result < 0)
+    if len(missing) and search_distance > 0:
+        result[missing] = nearest_within(polygons[missing], manhole_points, search_distance, tree)
+    return result
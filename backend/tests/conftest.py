@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+import os
+import sys
+
+# 測試直接匯入 backend 下的模組 (services.*、app)，與 app.py 的匯入方式相同
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,203 @@
+# backend/tests/test_api.py
+import io
+import json
+import os
+
+import pytest
+
+# 需要 PostGIS：HYDRO_TEST_DATABASE_URL 指向專用的測試資料庫，每個測試都會執行 init_db.sql 重建資料表
+TEST_DATABASE_URL = os.environ.get('HYDRO_TEST_DATABASE_URL')
+INIT_SQL = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                        'database', 'init_db.sql')
+
+pytestmark = pytest.mark.skipif(TEST_DATABASE_URL is None, reason='未設定 HYDRO_TEST_DATABASE_URL (PostGIS 測試資料庫)')
+
+
+@pytest.fixture(scope='module')
+def hydro():
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    import app as hydro
+    if hydro.app.config['SQLALCHEMY_DATABASE_URI'] != TEST_DATABASE_URL:
+        pytest.skip('app 已以其他資料庫設定匯入')
+    return hydro
+
+
+@pytest.fixture
+def client(hydro):
+    with open(INIT_SQL, encoding='utf-8') as f:
+        script = f.read()
+    with hydro.app.app_context():
+        connection = hydro.db.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(script)
+            connection.commit()
+        finally:
+            connection.close()
+    hydro.result_cache.clear()
+    return hydro.app.test_client()
+
+
+@pytest.fixture
+def db_state(hydro):
+    """查詢目前的管網版本與各圖層筆數"""
+    def state():
+        with hydro.app.app_context():
+            return {
+                'revision': hydro.current_network_revision(),
+                **{layer: hydro.db.session.query(model).count() for layer, model in hydro.LAYER_MODELS.items()},
+            }
+    return state
+
+
+def point(lon, lat):
+    return {'type': 'Point', 'coordinates': [lon, lat]}
+
+
+def line(*coordinates):
+    return {'type': 'LineString', 'coordinates': [list(c) for c in coordinates]}
+
+
+def upserted_ids(changes, layer):
+    return [feature['id'] for feature in changes[layer]['upserted']]
+
+
+# --- 批次編輯 ---
+
+def test_batch_rolls_back_when_an_operation_fails(client, db_state):
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'layer': 'manholes', 'ref': 'm1', 'data': {'geom': point(121.5, 25.0)}},
+        {'op': 'create', 'layer': 'manholes', 'data': {'geom': point(121.501, 25.0)}},
+        # 管線欄位只接受 LineString，人孔寫入之後才由 PostGIS 拒絕
+        {'op': 'create', 'layer': 'pipelines', 'data': {'from_manhole_id': 'm1', 'geom': point(121.5, 25.0)}},
+    ]})
+
+    assert response.status_code == 500
+    assert db_state() == {'revision': 0, 'manholes': 0, 'pipelines': 0, 'catchment_areas': 0}
+
+
+def test_batch_missing_feature_leaves_no_changes(client, db_state):
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'layer': 'manholes', 'data': {'geom': point(121.5, 25.0)}},
+        {'op': 'delete', 'layer': 'pipelines', 'id': 999},
+    ]})
+
+    assert response.status_code == 404
+    assert db_state()['manholes'] == 0
+    assert db_state()['revision'] == 0
+
+
+def test_batch_rejects_unknown_manhole_reference(client, db_state):
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'layer': 'manholes', 'ref': 'm1', 'data': {'geom': point(121.5, 25.0)}},
+        {'op': 'create', 'layer': 'pipelines',
+         'data': {'from_manhole_id': 'm1', 'to_manhole_id': 999, 'geom': line((121.5, 25.0), (121.501, 25.0))}},
+    ]})
+
+    assert response.status_code == 400
+    assert '第 1 個操作' in response.get_json()['message']
+    assert db_state()['manholes'] == 0
+
+
+def test_batch_rejects_null_for_not_null_fields(client, db_state):
+    created = client.post('/api/manholes', json={'name': 'A', 'geom': point(121.5, 25.0)}).get_json()
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'update', 'layer': 'manholes', 'id': created['id'], 'data': {'name': None}},
+    ]})
+
+    assert response.status_code == 400
+    assert 'name' in response.get_json()['message']
+    assert db_state()['revision'] == 1
+
+
+def test_batch_commits_all_operations(client, db_state):
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'layer': 'pipelines',
+         'data': {'from_manhole_id': 'a', 'to_manhole_id': 'b', 'geom': line((121.5, 25.0), (121.501, 25.0))}},
+        {'op': 'create', 'layer': 'manholes', 'ref': 'a', 'data': {'geom': point(121.5, 25.0)}},
+        {'op': 'create', 'layer': 'manholes', 'ref': 'b', 'data': {'geom': point(121.501, 25.0)}},
+    ]})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['revision'] == 1
+    assert [result['layer'] for result in body['results']] == ['pipelines', 'manholes', 'manholes']
+    assert db_state() == {'revision': 1, 'manholes': 2, 'pipelines': 1, 'catchment_areas': 0}
+
+
+# --- 匯入 ---
+
+def test_import_keeps_empty_strings_and_defaults_blank_names(client):
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': line((121.5, 25.0), (121.501, 25.0)),
+         'properties': {'name': '', 'material': 'PVC', 'diameter': None}},
+        {'type': 'Feature', 'geometry': line((121.6, 25.0), (121.601, 25.0)),
+         'properties': {'name': 'P2', 'material': '', 'diameter': 0.8}},
+    ]}
+    response = client.post('/api/import/pipelines', data={
+        'file': (io.BytesIO(json.dumps(collection).encode()), 'pipes.geojson'),
+        'snap_tolerance_m': '0',
+    })
+
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()['imported'] == 2
+    pipes = sorted(client.get('/api/changes?since=0').get_json()['pipelines']['upserted'], key=lambda f: f['id'])
+    # 空白或未提供的屬性使用欄位預設值，名稱不會以 NULL 寫入
+    assert [(f['name'], f['material'], f['diameter']) for f in pipes] == [('匯入管線', 'PVC', 0.5), ('P2', '混凝土', 0.8)]
+
+
+# --- 增量同步 ---
+
+def test_changes_returns_deltas_since_revision(client):
+    a = client.post('/api/manholes', json={'name': 'A', 'geom': point(121.5, 25.0)}).get_json()
+    b = client.post('/api/manholes', json={'name': 'B', 'geom': point(121.6, 25.0)}).get_json()
+    assert (a['revision'], b['revision']) == (1, 2)
+
+    changes = client.get('/api/changes?since=0').get_json()
+    assert changes['revision'] == 2
+    assert upserted_ids(changes, 'manholes') == [a['id'], b['id']]
+    assert changes['pipelines'] == {'upserted': [], 'deleted': []}
+
+    changes = client.get('/api/changes?since=1').get_json()
+    assert upserted_ids(changes, 'manholes') == [b['id']]
+
+    changes = client.get('/api/changes?since=2').get_json()
+    assert changes['manholes'] == {'upserted': [], 'deleted': []}
+
+    assert client.put(f"/api/manholes/{a['id']}", json={'name': 'A2'}).status_code == 200
+    assert client.delete(f"/api/manholes/{b['id']}").status_code == 204
+    changes = client.get('/api/changes?since=2').get_json()
+    assert changes['revision'] == 4
+    assert [feature['name'] for feature in changes['manholes']['upserted']] == ['A2']
+    assert changes['manholes']['deleted'] == [b['id']]
+
+    # 從頭同步時，已刪除的要素只出現在 deleted
+    changes = client.get('/api/changes?since=0').get_json()
+    assert upserted_ids(changes, 'manholes') == [a['id']]
+    assert changes['manholes']['deleted'] == [b['id']]
+
+
+@pytest.mark.parametrize('query', ['', '?since=-1', '?since=abc', '?since=99'])
+def test_changes_rejects_invalid_since(client, query):
+    assert client.get(f'/api/changes{query}').status_code == 400
+
+
+# --- 模擬與管網版本 ---
+
+def test_simulation_without_changes_keeps_revision(client, db_state):
+    client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'layer': 'manholes', 'ref': 'a', 'data': {'geom': point(121.5, 25.0), 'inflow': 0.01}},
+        {'op': 'create', 'layer': 'manholes', 'ref': 'b', 'data': {'geom': point(121.501, 25.0)}},
+        {'op': 'create', 'layer': 'pipelines',
+         'data': {'from_manhole_id': 'a', 'to_manhole_id': 'b', 'diameter': 0.5, 'slope': 0.01,
+                  'geom': line((121.5, 25.0), (121.501, 25.0))}},
+    ]})
+
+    first = client.post('/api/simulate', json={'mode': 'full'}).get_json()
+    assert (first['base_revision'], first['revision']) == (1, 2)
+
+    # 結果與資料庫相同，不遞增版本
+    second = client.post('/api/simulate', json={'mode': 'incremental'}).get_json()
+    assert (second['base_revision'], second['revision']) == (2, 2)
+    assert db_state()['revision'] == 2
+    assert client.get('/api/changes?since=2').get_json()['manholes']['upserted'] == []
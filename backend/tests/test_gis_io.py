@@ -0,0 +1,59 @@
+# backend/tests/test_gis_io.py
+import fiona
+import shapely
+from shapely.geometry import LineString, Point, mapping
+
+from services.gis_io import (explode_geometries, fiona_schema, layer_fields, read_feature_chunks,
+                             shapefile_field_names, write_features, zip_shapefile)
+
+
+def write_gpkg(path, geometry_type, geometries):
+    schema = {'geometry': geometry_type, 'properties': {'name': 'str'}}
+    with fiona.open(path, 'w', driver='GPKG', schema=schema, crs='EPSG:4326') as sink:
+        sink.writerecords({'geometry': mapping(geometry), 'properties': {'name': f'f{i}'}}
+                          for i, geometry in enumerate(geometries))
+
+
+def import_rows(path, geometry_type):
+    """與 import_features 相同的讀取、拆解與 WKB 轉換步驟"""
+    rows = []
+    for geometries, properties in read_feature_chunks(path):
+        parts, properties, skipped = explode_geometries(geometries, properties, geometry_type)
+        assert skipped == 0
+        rows.extend(shapely.to_wkb(shapely.set_srid(parts, 4326), hex=True, include_srid=True))
+    return [shapely.from_wkb(row) for row in rows]
+
+
+def test_point_z_is_imported_as_2d(tmp_path):
+    path = str(tmp_path / 'manholes.gpkg')
+    write_gpkg(path, '3D Point', [Point(121.5, 25.0, 12.3), Point(121.6, 25.1, 8.0)])
+
+    geometries = import_rows(path, 'Point')
+
+    assert not shapely.has_z(geometries).any()
+    assert [(g.x, g.y) for g in geometries] == [(121.5, 25.0), (121.6, 25.1)]
+
+
+def test_linestring_z_is_imported_as_2d(tmp_path):
+    path = str(tmp_path / 'pipelines.gpkg')
+    write_gpkg(path, '3D LineString', [LineString([(121.5, 25.0, 3.0), (121.501, 25.0, 2.5)])])
+
+    geometries = import_rows(path, 'LineString')
+
+    assert not shapely.has_z(geometries).any()
+    assert list(geometries[0].coords) == [(121.5, 25.0), (121.501, 25.0)]
+
+
+def test_shapefile_field_names_round_trip(tmp_path):
+    fields = ['name', 'calculated_flow', 'calculated_velocity', 'calculated_depth', 'from_manhole_id']
+    short_names = shapefile_field_names(fields)
+    assert all(len(name) <= 10 for name in short_names.values())
+    assert len(set(short_names.values())) == len(fields)
+
+    path = str(tmp_path / 'pipelines.shp')
+    schema = fiona_schema('LineString', [(short_names[f], 'str' if f == 'name' else 'float') for f in fields])
+    properties = {short_names[f]: ('P-1' if f == 'name' else 1.5) for f in fields}
+    write_features(path, 'ESRI Shapefile', schema, [[(LineString([(121.5, 25.0), (121.501, 25.0)]), properties)]])
+
+    # 匯入時以相同的欄位順序計算短名稱，檔案中的欄位名稱與匯出時一致
+    assert layer_fields(zip_shapefile(path)) == [short_names[f] for f in fields]
@@ -0,0 +1,74 @@
+# backend/tests/test_hydraulic_calculator.py
+import numpy as np
+
+from services.hydraulic_calculator import (PARTIAL_FLOW_TOLERANCE, _depth_ratio, _velocity_ratio,
+                                           calculate_network_hydraulics, calculate_pipe_hydraulics,
+                                           lookup_partial_flow, solve_partial_flow_angle)
+
+
+def manning_full_flow(diameter, slope, manning_n):
+    area = np.pi * (diameter / 2) ** 2
+    velocity = (1 / manning_n) * (diameter / 4) ** (2 / 3) * np.sqrt(slope)
+    return area * velocity, velocity
+
+
+def test_network_hydraulics_matches_manning():
+    q_full, v_full = manning_full_flow(0.5, 0.01, 0.013)
+    # 半滿管的流量比恰為 0.5，水深為半管、流速與滿管相同；兩倍滿管流量為超載
+    result = calculate_network_hydraulics(0.5, 0.01, 0.013, np.array([0.5 * q_full, 2 * q_full]))
+
+    np.testing.assert_allclose(result.capacity, q_full)
+    np.testing.assert_allclose(result.capacity_ratio, [0.5, 2.0])
+    np.testing.assert_allclose(result.depth, [0.25, 0.5], atol=1e-4)
+    np.testing.assert_allclose(result.fill_ratio, [0.5, 1.0], atol=1e-4)
+    np.testing.assert_allclose(result.velocity, [v_full, 2 * q_full / (np.pi * 0.25 ** 2)], rtol=1e-4)
+
+
+def test_network_hydraulics_zeroes_invalid_pipes():
+    result = calculate_network_hydraulics([0.0, 0.5, 0.5], [0.01, -0.01, 0.01], [0.013, 0.013, 0.0], 0.1)
+
+    for values in result:
+        np.testing.assert_array_equal(values, 0.0)
+
+
+def test_scalar_wrapper_matches_network_kernel():
+    flow, velocity, depth, ratio = calculate_pipe_hydraulics(0.6, 0.005, 0.013, 0.2)
+    result = calculate_network_hydraulics([0.6], [0.005], [0.013], [0.2])
+
+    assert flow == 0.2
+    assert (velocity, depth, ratio) == (result.velocity[0], result.depth[0], result.capacity_ratio[0])
+
+
+def exact_partial_flow(flow_ratio):
+    theta = solve_partial_flow_angle(flow_ratio)
+    return _depth_ratio(theta), _velocity_ratio(theta)
+
+
+def test_lookup_matches_exact_solve_within_tolerance():
+    rng = np.random.default_rng(0)
+    flow_ratio = np.concatenate([np.linspace(0.0, 1.0, 2001), rng.random(5000), [1e-9, 1e-6, 0.999999]])
+
+    depth, velocity = lookup_partial_flow(flow_ratio)
+    exact_depth, exact_velocity = exact_partial_flow(flow_ratio)
+
+    # 容許值以區間中點估計，另留一點餘裕
+    assert np.max(np.abs(depth - exact_depth)) <= 2 * PARTIAL_FLOW_TOLERANCE
+    assert np.max(np.abs(velocity - exact_velocity)) <= 2 * PARTIAL_FLOW_TOLERANCE
+
+
+def test_zero_tolerance_falls_back_to_exact_solve():
+    flow_ratio = np.linspace(0.0, 1.0, 101)
+
+    depth, velocity = lookup_partial_flow(flow_ratio, tolerance=0.0)
+    exact_depth, exact_velocity = exact_partial_flow(flow_ratio)
+
+    np.testing.assert_allclose(depth, exact_depth, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(velocity, exact_velocity, rtol=0, atol=1e-12)
+
+
+def test_lookup_clips_ratio_and_keeps_shape():
+    depth, velocity = lookup_partial_flow(np.array([[-0.5, 0.0], [1.0, 3.0]]))
+
+    assert depth.shape == velocity.shape == (2, 2)
+    np.testing.assert_allclose(depth[0], 0.0, atol=1e-12)
+    np.testing.assert_allclose(depth[1, 0], depth[1, 1])
@@ -0,0 +1,136 @@
+# backend/tests/test_metrics.py
+import os
+import re
+import sys
+import time
+
+import pytest
+
+from services.metrics import MetricsRegistry, PhaseTimer, RequestTimings
+
+
+def sample(text, name, **labels):
+    """取出 Prometheus 文字格式中指定名稱與標籤的數值，不存在時回傳 0"""
+    label_text = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    prefix = f'{name}{{{label_text}}} ' if labels else f'{name} '
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+# --- 指標集合 ---
+
+def test_registry_renders_counters_and_summaries():
+    registry = MetricsRegistry()
+    registry.describe('requests_total', 'counter', '請求數')
+    registry.describe('duration_seconds', 'summary', '耗時')
+
+    registry.merge([('inc', 'requests_total', 1, {'endpoint': '/a', 'status': '200'}),
+                    ('inc', 'requests_total', 2, {'status': '200', 'endpoint': '/a'}),
+                    ('observe', 'duration_seconds', 0.5, {'endpoint': '/a'}),
+                    ('observe', 'duration_seconds', 0.25, {'endpoint': '/a'})])
+    text = registry.render()
+
+    assert '# TYPE requests_total counter' in text
+    assert sample(text, 'requests_total', endpoint='/a', status='200') == 3.0
+    assert sample(text, 'duration_seconds_sum', endpoint='/a') == 0.75
+    assert sample(text, 'duration_seconds_count', endpoint='/a') == 2
+
+
+def test_registry_escapes_labels_and_calls_collectors():
+    registry = MetricsRegistry()
+    registry.describe('hits_total', 'counter', '命中數')
+    registry.merge([('inc', 'hits_total', 1, {'path': 'a"b\\c'})])
+    registry.add_collector(lambda: [('cache_bytes', 'gauge', '快取大小', [({}, 42)])])
+    text = registry.render()
+
+    assert 'hits_total{path="a\\"b\\\\c"} 1.0' in text
+    assert '# TYPE cache_bytes gauge' in text
+    assert sample(text, 'cache_bytes') == 42.0
+
+
+def test_request_timings_server_timing():
+    timings = RequestTimings('/api/test')
+    timings.sql_count = 3
+    timings.sql_seconds = 0.0125
+    timings.add_phase('routing', 0.002)
+    timings.add_phase('routing', 0.001)
+
+    entries = timings.server_timing().split(', ')
+
+    assert entries[0] == 'sql;dur=12.5;desc="3 queries"'
+    assert entries[1] == 'routing;dur=3.0'
+    assert re.fullmatch(r'total;dur=\d+\.\d', entries[2])
+
+
+def test_phase_timer_records_each_stage():
+    reported = []
+    timer = PhaseTimer(lambda stage, fraction: reported.append((stage, fraction)))
+
+    timer('loading', 0.0)
+    time.sleep(0.01)
+    timer('routing', 0.5)
+    phases = timer.stop()
+
+    assert reported == [('loading', 0.0), ('routing', 0.5)]
+    assert list(phases) == ['loading', 'routing']
+    assert phases['loading'] >= 0.01
+    assert timer.stop() == phases
+
+
+# --- 請求計時 (Server-Timing 標頭、SQL 計數與 /api/metrics) ---
+
+@pytest.fixture(scope='module')
+def hydro(tmp_path_factory):
+    # 未設定 PostGIS 測試資料庫時以 SQLite 執行，只用到不含幾何欄位的 simulation_jobs
+    if 'app' not in sys.modules:
+        os.environ['DATABASE_URL'] = (os.environ.get('HYDRO_TEST_DATABASE_URL')
+                                      or f"sqlite:///{tmp_path_factory.mktemp('metrics') / 'hydro.db'}")
+    import app as hydro
+    if not hydro.METRICS_ENABLED:
+        pytest.skip('效能指標未啟用 (HYDRO_METRICS=0)')
+    with hydro.app.app_context():
+        hydro.SimulationJob.__table__.create(hydro.db.engine, checkfirst=True)
+    return hydro
+
+
+@pytest.fixture
+def client(hydro):
+    return hydro.app.test_client()
+
+
+def test_response_has_server_timing_with_sql_count(client):
+    response = client.get('/api/jobs/missing-job')
+
+    assert response.status_code == 404
+    assert response.headers['Timing-Allow-Origin'] == '*'
+    match = re.match(r'sql;dur=\d+\.\d;desc="(\d+) queries", total;dur=\d+\.\d$', response.headers['Server-Timing'])
+    assert match and int(match.group(1)) >= 1
+
+
+def test_metrics_count_requests_and_sql_statements(client):
+    endpoint = '/api/jobs/<job_id>'
+    before = client.get('/api/metrics').get_data(as_text=True)
+    response = client.get('/api/jobs/missing-job')
+    sql_count = int(re.search(r'desc="(\d+) queries"', response.headers['Server-Timing']).group(1))
+    after = client.get('/api/metrics').get_data(as_text=True)
+
+    def delta(name, **labels):
+        return sample(after, name, **labels) - sample(before, name, **labels)
+
+    assert delta('hydro_http_requests_total', endpoint=endpoint, method='GET', status='404') == 1
+    assert delta('hydro_http_request_duration_seconds_count', endpoint=endpoint, method='GET') == 1
+    assert delta('hydro_sql_statements_total', endpoint=endpoint) == sql_count
+    assert delta('hydro_sql_duration_seconds_total', endpoint=endpoint) > 0
+
+
+def test_metrics_endpoint_uses_prometheus_text_format(client):
+    response = client.get('/api/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert '# TYPE hydro_http_requests_total counter' in text
+    assert '# TYPE hydro_result_cache_lookups_total counter' in text
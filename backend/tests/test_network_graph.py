@@ -0,0 +1,64 @@
+# backend/tests/test_network_graph.py
+import numpy as np
+
+from services.network_graph import NetworkGraph
+
+
+def test_accumulate_dendritic_network():
+    # 1 → 3, 2 → 3, 3 → 4, 4 → 5；管線 15 未連結終點
+    graph = NetworkGraph([1, 2, 3, 4, 5], [11, 12, 13, 14, 15], [1, 2, 3, 4, 5], [3, 3, 4, 5, None])
+
+    result = graph.accumulate(np.ones(5))
+
+    np.testing.assert_allclose(result.node_inflow, [1, 1, 3, 4, 5])
+    np.testing.assert_allclose(result.pipe_flow[:4], [1, 1, 3, 4])
+    assert np.isnan(result.pipe_flow[4])
+    assert result.unrouted_pipes.tolist() == [4]
+
+
+def test_accumulate_splits_by_weight():
+    # 1 分流到 2 (權重 1) 與 3 (權重 3)，兩者再匯流到 4
+    graph = NetworkGraph([1, 2, 3, 4], [1, 2, 3, 4], [1, 1, 2, 3], [2, 3, 4, 4])
+
+    result = graph.accumulate([4.0, 0.0, 0.0, 0.0], split_weights=[1.0, 3.0, 1.0, 1.0])
+
+    np.testing.assert_allclose(result.pipe_flow, [1.0, 3.0, 1.0, 3.0])
+    np.testing.assert_allclose(result.node_inflow, [4.0, 1.0, 3.0, 4.0])
+
+
+def test_accumulate_multiple_scenarios():
+    graph = NetworkGraph([1, 2, 3], [1, 2], [1, 2], [2, 3])
+
+    result = graph.accumulate(np.array([[1.0, 2.0], [0.0, 1.0], [0.0, 0.0]]))
+
+    np.testing.assert_allclose(result.node_inflow[:, 0], [1, 1, 1])
+    np.testing.assert_allclose(result.node_inflow[:, 1], [2, 3, 3])
+    assert result.pipe_flow.shape == (2, 2)
+
+
+def test_cycle_detection():
+    # 2 → 3 → 2 為迴路，4 在迴路下游；1 與 5 不受影響
+    graph = NetworkGraph([1, 2, 3, 4, 5], [1, 2, 3, 4, 5], [1, 2, 3, 3, 5], [2, 3, 2, 4, None])
+
+    assert graph.manhole_ids[graph.cyclic_nodes()].tolist() == [2, 3, 4]
+    assert graph.summary()['cyclic_manhole_ids'] == [2, 3, 4]
+
+    result = graph.accumulate(np.ones(5))
+    assert np.isnan(result.pipe_flow[1:4]).all()
+    assert result.pipe_flow[0] == 1.0
+
+
+def test_summary():
+    graph = NetworkGraph([1, 2, 3, 4, 5, 6], [1, 2, 3, 4], [1, 2, 3, 5], [2, 3, 4, 6])
+
+    summary = graph.summary()
+    assert summary['component_count'] == 2
+    assert summary['outlet_count'] == 2
+    assert summary['cyclic_manhole_ids'] == []
+
+
+def test_downstream_closure():
+    graph = NetworkGraph([1, 2, 3, 4, 5, 6], [1, 2, 3, 4], [1, 2, 3, 5], [2, 3, 4, 6])
+
+    reached = graph.downstream_closure(graph.node_index([2]))
+    assert graph.manhole_ids[reached].tolist() == [2, 3, 4]
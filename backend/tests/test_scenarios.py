@@ -0,0 +1,25 @@
+# backend/tests/test_scenarios.py
+import numpy as np
+
+from services.scenarios import summarize_scenario
+
+
+def test_summary_lists_top_overflow_manholes_by_inflow():
+    overflows = np.array([True, False, True, True, True])
+    inflow = np.array([0.2, 9.0, 0.5, 0.1, 0.5])
+
+    summary = summarize_scenario([10, 11, 12, 13, 14], overflows, inflow, np.array([50.0, 120.0]),
+                                 np.array([0.1, 0.2]), overflow_limit=3)
+
+    assert summary['overflow_manhole_count'] == 4
+    assert summary['overflow_manhole_ids'] == [12, 14, 10]
+    assert summary['surcharged_pipe_count'] == 1
+    assert summary['max_manhole_inflow'] == 9.0
+
+
+def test_summary_without_overflow():
+    summary = summarize_scenario([1, 2], np.array([False, False]), np.array([0.1, 0.2]), np.array([]), np.array([]))
+
+    assert summary['overflow_manhole_count'] == 0
+    assert summary['overflow_manhole_ids'] == []
+    assert summary['max_full_capacity_ratio'] is None
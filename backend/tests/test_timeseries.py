@@ -0,0 +1,38 @@
+# backend/tests/test_timeseries.py
+import numpy as np
+
+from services.timeseries import muskingum_coefficients, muskingum_route
+
+
+def sequential_muskingum(inflow, c0, c1, c2):
+    """逐時間步的 Muskingum 演算 (對照用)"""
+    outflow = np.empty_like(inflow)
+    outflow[:, 0] = inflow[:, 0]
+    for t in range(1, inflow.shape[1]):
+        outflow[:, t] = c2 * outflow[:, t - 1] + c0 * inflow[:, t] + c1 * inflow[:, t - 1]
+    return outflow
+
+
+def test_scan_matches_sequential_routing():
+    rng = np.random.default_rng(1)
+    inflow = rng.random((6, 300)) * 2.0
+    # 含 K=0 與短管線 (直接傳遞) 及長延遲的管線
+    travel_time_s = np.array([0.0, 10.0, 60.0, 300.0, 1200.0, 3600.0])
+    c0, c1, c2 = muskingum_coefficients(travel_time_s, 60.0, x=0.2)
+
+    np.testing.assert_allclose(muskingum_route(inflow, c0, c1, c2),
+                               sequential_muskingum(inflow, c0, c1, c2), rtol=1e-10, atol=1e-12)
+
+
+def test_scan_handles_non_power_of_two_lengths():
+    inflow = np.sin(np.linspace(0, np.pi, 37))[None, :] + 0.1
+    c0, c1, c2 = muskingum_coefficients([900.0], 60.0)
+
+    np.testing.assert_allclose(muskingum_route(inflow, c0, c1, c2),
+                               sequential_muskingum(inflow, c0, c1, c2), rtol=1e-10, atol=1e-12)
+
+
+def test_coefficients_conserve_volume():
+    c0, c1, c2 = muskingum_coefficients(np.array([0.0, 30.0, 600.0, 7200.0]), 60.0)
+    np.testing.assert_allclose(c0 + c1 + c2, 1.0)
+    assert np.all(np.array([c0, c1, c2]) >= 0)
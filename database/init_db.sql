@@ -18,10 +18,14 @@ CREATE TABLE manholes (
     bottom_elevation NUMERIC(10, 3),    -- 底部標高 (公尺)
     design_flow_limit NUMERIC(10, 3),   -- 設計流量上限 (CMS, 立方公尺/秒)
     overflow_elevation NUMERIC(10, 3),  -- 溢流點標高 (公尺)
+    inflow DOUBLE PRECISION DEFAULT 0,              -- 人孔本地入流量 (CMS)
+    downstream_capacity DOUBLE PRECISION DEFAULT 0, -- 下游容量 (CMS)
     geom GEOMETRY(Point, 4326),         -- 人孔的地理位置 (點)，使用 WGS84 座標系 (EPSG:4326)
 
     -- 以下欄位用於儲存模擬結果，初始化時可為空
-    calculated_water_level NUMERIC(10, 3), -- 模擬後的計算水位
+    -- (與程式計算值相同型別，寫回時才能以 IS DISTINCT FROM 判斷結果是否變動)
+    calculated_inflow DOUBLE PRECISION,      -- 模擬後的總入流量 (含集水區逕流與上游累加)
+    calculated_water_level DOUBLE PRECISION, -- 模擬後的計算水位
     is_overflow BOOLEAN DEFAULT FALSE,     -- 模擬後是否溢流
     simulation_notes TEXT                  -- 模擬相關筆記或訊息
 );
@@ -31,8 +35,8 @@ CREATE TABLE manholes (
 CREATE TABLE pipelines (
     id SERIAL PRIMARY KEY,              -- 唯一識別碼，自動遞增
     name VARCHAR(255) NOT NULL,         -- 管線名稱
-    from_manhole_id INTEGER REFERENCES manholes(id), -- 起點人孔 ID
-    to_manhole_id INTEGER REFERENCES manholes(id),   -- 終點人孔 ID
+    from_manhole_id INTEGER REFERENCES manholes(id) ON DELETE SET NULL, -- 起點人孔 ID
+    to_manhole_id INTEGER REFERENCES manholes(id) ON DELETE SET NULL,   -- 終點人孔 ID
     diameter NUMERIC(10, 3),            -- 管徑 (公尺)
     slope NUMERIC(10, 5),               -- 坡度 (無單位)
     material VARCHAR(100),              -- 管材 (如: Concrete, PVC, HDPE)
@@ -40,10 +44,11 @@ CREATE TABLE pipelines (
     geom GEOMETRY(LineString, 4326),    -- 管線的地理位置 (線)，使用 WGS84 座標系 (EPSG:4326)
 
     -- 以下欄位用於儲存模擬結果，初始化時可為空
-    calculated_flow NUMERIC(10, 3),       -- 模擬後的計算流量
-    calculated_velocity NUMERIC(10, 3),   -- 模擬後的計算流速
-    calculated_depth NUMERIC(10, 3),      -- 模擬後的計算水深
-    full_capacity_ratio NUMERIC(5, 2),    -- 模擬後的滿管度百分比 (0-100)
+    calculated_flow DOUBLE PRECISION,     -- 模擬後的計算流量
+    calculated_velocity DOUBLE PRECISION, -- 模擬後的計算流速
+    calculated_depth DOUBLE PRECISION,    -- 模擬後的計算水深
+    full_capacity_ratio DOUBLE PRECISION, -- 模擬後的滿管度百分比 (超載時大於 100)
+    calculated_length_m DOUBLE PRECISION, -- 管線長度 (公尺，UTM 座標下量測，新增或修改幾何時儲存)
     simulation_notes TEXT                 -- 模擬相關筆記或訊息
 );
 
@@ -52,12 +57,14 @@ CREATE TABLE pipelines (
 CREATE TABLE catchment_areas (
     id SERIAL PRIMARY KEY,               -- 唯一識別碼，自動遞增
     name VARCHAR(255) NOT NULL,          -- 集水區名稱
+    outlet_manhole_id INTEGER REFERENCES manholes(id) ON DELETE SET NULL, -- 逕流排入的人孔 ID
     runoff_coefficient NUMERIC(5, 3),    -- 逕流係數 (0-1)
     rainfall_intensity NUMERIC(10, 3),   -- 降雨強度 (mm/hr)
     geom GEOMETRY(Polygon, 4326),        -- 集水區的地理位置 (多邊形)，使用 WGS84 座標系 (EPSG:4326)
 
     -- 以下欄位用於儲存模擬結果，初始化時可為空
-    calculated_peak_flow NUMERIC(10, 3), -- 模擬後的計算洪峰流量
+    calculated_peak_flow DOUBLE PRECISION, -- 模擬後的計算洪峰流量
+    calculated_area_sq_m DOUBLE PRECISION, -- 集水區面積 (平方公尺，UTM 座標下量測，新增或修改幾何時儲存)
     simulation_notes TEXT                -- 模擬相關筆記或訊息
 );
 
@@ -69,4 +76,68 @@ CREATE INDEX idx_catchment_areas_geom ON catchment_areas USING GIST (geom);
 -- 7. 允許 from_manhole_id 和 to_manhole_id 欄位可以為 NULL
 -- (在前端繪製時，可能先建立管線，再連結人孔)
 ALTER TABLE pipelines ALTER COLUMN from_manhole_id DROP NOT NULL;
-ALTER TABLE pipelines ALTER COLUMN to_manhole_id DROP NOT NULL;
\ No newline at end of file
+ALTER TABLE pipelines ALTER COLUMN to_manhole_id DROP NOT NULL;
+-- 8. 管網版本 (任何要素新增、修改、刪除或寫回模擬結果時遞增，作為結果快取的鍵)
+DROP TABLE IF EXISTS network_state CASCADE;
+CREATE TABLE network_state (
+    id INTEGER PRIMARY KEY,             -- 只有 id=1 一筆
+    revision BIGINT NOT NULL DEFAULT 0, -- 管網版本
+    simulated_revision BIGINT,          -- 上次穩態模擬寫回時已涵蓋的管網版本 (增量模擬由此推得待重算要素)，NULL 表示尚未完整模擬過
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+INSERT INTO network_state (id, revision) VALUES (1, 0);
+
+-- 9. 要素版本 (最後一次新增、修改或寫回模擬結果時的管網版本) 與刪除紀錄，供 /api/changes 增量同步
+ALTER TABLE manholes ADD COLUMN revision BIGINT;
+ALTER TABLE pipelines ADD COLUMN revision BIGINT;
+ALTER TABLE catchment_areas ADD COLUMN revision BIGINT;
+CREATE INDEX idx_manholes_revision ON manholes (revision);
+CREATE INDEX idx_pipelines_revision ON pipelines (revision);
+CREATE INDEX idx_catchment_areas_revision ON catchment_areas (revision);
+
+DROP TABLE IF EXISTS deleted_features CASCADE;
+CREATE TABLE deleted_features (
+    id SERIAL PRIMARY KEY,
+    layer VARCHAR(50) NOT NULL,         -- 資料表名稱
+    feature_id INTEGER NOT NULL,        -- 被刪除要素的 id
+    revision BIGINT NOT NULL,           -- 刪除時的管網版本
+    deleted_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX idx_deleted_features_revision ON deleted_features (revision);
+
+-- 10. 批次情境模擬結果 (POST /api/scenarios/batch)，不修改基礎資料表
+DROP TABLE IF EXISTS simulation_scenarios CASCADE;
+CREATE TABLE simulation_scenarios (
+    id SERIAL PRIMARY KEY,
+    batch_id VARCHAR(36) NOT NULL,      -- 同一次批次請求的識別碼
+    name VARCHAR(100),                  -- 情境名稱
+    parameters JSON,                    -- 情境參數覆寫
+    summary JSON,                       -- 溢流人孔、最大滿管度等精簡摘要
+    results JSON,                       -- 各要素完整結果 (以欄位為單位的陣列)
+    created_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX idx_simulation_scenarios_batch_id ON simulation_scenarios (batch_id);
+
+-- 11. 背景模擬工作 (POST /api/jobs/simulate)
+DROP TABLE IF EXISTS simulation_jobs CASCADE;
+CREATE TABLE simulation_jobs (
+    id VARCHAR(36) PRIMARY KEY,                     -- 工作識別碼 (UUID)
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',   -- queued / running / succeeded / failed
+    progress DOUBLE PRECISION NOT NULL DEFAULT 0,   -- 進度 (0-1)
+    stage VARCHAR(50),                              -- 目前階段
+    parameters JSON,                                -- 模擬參數
+    dedupe_key VARCHAR(64),                         -- 參數與管網版本的雜湊，用於合併重複提交
+    owner VARCHAR(255),                             -- 執行工作的行程 (主機名稱:pid)
+    heartbeat_at TIMESTAMP,                         -- 所屬行程最後一次回報存活的時間
+    result JSON,                                    -- 模擬結果
+    error TEXT,                                     -- 失敗原因
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX idx_simulation_jobs_dedupe_key ON simulation_jobs (dedupe_key);
+CREATE INDEX idx_simulation_jobs_status ON simulation_jobs (status);
+
+-- 12. 人孔的 geography 運算式索引：管線端點吸附與出流人孔搜尋以 geography <-> (公尺) 做 KNN 排序
+CREATE INDEX idx_manholes_geog ON manholes USING GIST ((geom::geography(Geometry, 4326)));
+
@@ -0,0 +1,24 @@
+-- database/upgrade_db.sql
+
+-- 既有資料庫的一次性升級腳本 (init_db.sql 會刪除並重建資料表，只適用於新資料庫)。
+-- 每個步驟只需執行一次，請在停止後端服務後依序執行。
+
+-- 1. 模擬結果欄位改為 DOUBLE PRECISION
+-- 舊版以 NUMERIC 四捨五入儲存，與程式計算值永遠不同，寫回時每次模擬都被視為結果有變動；
+-- full_capacity_ratio 的 NUMERIC(5, 2) 在滿管度超過 999.99% 時也會溢位。
+ALTER TABLE manholes
+    ALTER COLUMN calculated_inflow TYPE DOUBLE PRECISION,
+    ALTER COLUMN calculated_water_level TYPE DOUBLE PRECISION;
+ALTER TABLE pipelines
+    ALTER COLUMN calculated_flow TYPE DOUBLE PRECISION,
+    ALTER COLUMN calculated_velocity TYPE DOUBLE PRECISION,
+    ALTER COLUMN calculated_depth TYPE DOUBLE PRECISION,
+    ALTER COLUMN full_capacity_ratio TYPE DOUBLE PRECISION;
+ALTER TABLE catchment_areas
+    ALTER COLUMN calculated_peak_flow TYPE DOUBLE PRECISION;
+
+-- 2. 管線長度與集水區面積改為在 UTM 座標下量測，只在新增或修改幾何時儲存
+-- 舊版以 EPSG:3857 量測 (數值偏大)，加入欄位後請在 backend 目錄執行一次
+-- python remeasure_geometry.py 重新量測全部要素；之後變更 HYDRO_UTM_EPSG 時也需再執行。
+ALTER TABLE pipelines ADD COLUMN IF NOT EXISTS calculated_length_m DOUBLE PRECISION;
+ALTER TABLE catchment_areas ADD COLUMN IF NOT EXISTS calculated_area_sq_m DOUBLE PRECISION;